@@ -1,10 +1,70 @@
 from django.contrib import admin
-from . import models
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.html import format_html
+from . import jobs, models
+from .forms import RegionForm
+from .geometry import simplify, svg_path
+from .pagination import EstimatedCountPaginator
+
+
+# Changelists of the large tables skip the unfiltered count, and take
+# the total from the database statistics
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class RegionAdminForm(RegionForm):
+    """Region form that leaves the area alone unless a new one is given
+
+    The area is only shown as a preview, since a form field with the
+    full geometry can be megabytes of text.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['area'] = None
+            self.fields['area'].required = False
+            self.fields['area'].help_text = "Leave empty to keep the current area"
+
+    def clean_area(self):
+        return self.cleaned_data['area'] or self.instance.area
 
 
 @admin.register(models.Region)
-class Region(admin.ModelAdmin):
-    pass
+class Region(LargeTableAdmin):
+    form = RegionAdminForm
+    list_display = ['name', 'area_km2', 'num_vertices', 'xmin', 'ymin', 'xmax', 'ymax']
+    search_fields = ['name']
+    readonly_fields = ['preview']
+    fields = ['name', 'preview', 'area']
+    # Preview size, in pixels
+    preview_size = 300
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # Only the change form uses the area (which Region.objects defers)
+        match = request.resolver_match
+        if match and match.url_name and match.url_name.endswith('_change'):
+            queryset = queryset.with_area()
+        return queryset
+
+    def preview(self, obj):
+        if not obj.area:
+            return ''
+        xmin, ymin, xmax, ymax = obj.area.extent
+        size = max(xmax - xmin, ymax - ymin) or 1
+        # Vertices closer than a pixel are not visible anyway
+        area = simplify(obj.area, size / self.preview_size)
+        return format_html(
+            '<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" '
+            'viewBox="{} {} {} {}"><path d="{}" fill="#8ab" fill-rule="evenodd" '
+            'stroke="#345" vector-effect="non-scaling-stroke"/></svg>',
+            self.preview_size, self.preview_size, xmin, -ymax, size, size, svg_path(area))
+    preview.short_description = "Area (simplified)"
 
 
 class Impact(admin.StackedInline):
@@ -15,51 +75,111 @@ class Synthesis(admin.StackedInline):
     models = models.Synthesis
 
 
-class ObsDatasetInline(admin.StackedInline):
+class ObsDatasetInline(admin.TabularInline):
     model = models.ObsDataset
     extra = 1
+    show_change_link = True
 
 
 #@admin.register(models.ModelDataset)
-class ModelDatasetInline(admin.StackedInline):
+class ModelDatasetInline(admin.TabularInline):
     model = models.ModelDataset
     extra = 1
+    show_change_link = True
 
 
 @admin.register(models.ObsDataset)
-class ObsDataset(admin.ModelAdmin):
-    pass
+class ObsDataset(LargeTableAdmin):
+    list_display = ['__str__', 'event', 'value', 'pr']
+    list_select_related = ['event']
+    raw_id_fields = ['event']
 
 
 @admin.register(models.ModelDataset)
-class ModelDataset(admin.ModelAdmin):
-    pass
+class ModelDataset(LargeTableAdmin):
+    list_display = ['__str__', 'event', 'model_type', 'pr']
+    list_select_related = ['event']
+    raw_id_fields = ['event']
 
 
 @admin.register(models.Impact)
-class Impact(admin.ModelAdmin):
+class Impact(LargeTableAdmin):
     pass
 
 
 
 @admin.register(models.Synthesis)
-class Synthesis(admin.ModelAdmin):
+class Synthesis(LargeTableAdmin):
     pass
 
 
 @admin.register(models.FitParameters)
-class FitParameters(admin.ModelAdmin):
-    pass
+class FitParameters(LargeTableAdmin):
+    raw_id_fields = ['obsdataset']
 
 
 @admin.register(models.ReturnTime)
-class ReturnTime(admin.ModelAdmin):
-    pass
+class ReturnTime(LargeTableAdmin):
+    raw_id_fields = ['obsdataset']
 
 
 @admin.register(models.Event)
-class Event(admin.ModelAdmin):
+class Event(LargeTableAdmin):
+    list_display = ['name', 'region', 'variable', 'startdate', 'pr']
+    list_filter = ['variable']
+    list_select_related = ['region', 'synthesis']
+    search_fields = ['name']
+    autocomplete_fields = ['region']
+    raw_id_fields = ['impact', 'synthesis']
     inlines = [
         ObsDatasetInline,
         ModelDatasetInline
     ]
+
+    actions = ['compute_return_times', 'bootstrap_return_times']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('region').defer('region__area')
+
+    def compute_return_times(self, request, queryset):
+        jobs.enqueue('compute-return-times', list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, "Queued the computation of the return times")
+    compute_return_times.short_description = "Recompute the return times from the fits"
+
+    def bootstrap_return_times(self, request, queryset):
+        jobs.enqueue('bootstrap-return-times', list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, "Queued the bootstrap of the return time bounds")
+    bootstrap_return_times.short_description = "Recompute the return time bounds (bootstrap)"
+
+    def pr(self, obj):
+        return obj.synthesis.pr
+    pr.admin_order_field = 'synthesis__pr'
+    pr.short_description = "PR"
+
+
+@admin.register(models.Job)
+class Job(LargeTableAdmin):
+    list_display = ['task', 'status', 'priority', 'percent', 'attempts', 'created', 'finished']
+    list_filter = ['status', 'task']
+    readonly_fields = [field.name for field in models.Job._meta.fields]
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    def percent(self, obj):
+        return '%d%%' % (100 * obj.progress)
+    percent.short_description = "Progress"
+
+    def retry(self, request, queryset):
+        count = 0
+        for job in queryset.filter(status=models.Job.FAILED):
+            # Unless the same work is queued already
+            try:
+                with transaction.atomic():
+                    count += models.Job.objects.filter(pk=job.pk).update(
+                        status=models.Job.QUEUED, attempts=0, run_after=timezone.now())
+            except IntegrityError:
+                pass
+        self.message_user(request, "Queued %d jobs again" % count)
+    retry.short_description = "Retry the failed jobs"
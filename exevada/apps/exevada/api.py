@@ -0,0 +1,360 @@
+"""Read-only JSON API
+
+Every resource has a list (/api/v1/<resource>/) and a detail
+(/api/v1/<resource>/<id>/) endpoint. They take the query parameters
+
+- fields: comma-separated fields to include (default: all but the
+  heavy ones, like region areas)
+- embed: comma-separated relations to include as objects instead of
+  ids (or lists of ids)
+- zoom: map zoom level, selecting the simplification of region areas
+- <filter>: the filters listed per resource (lists only)
+- after, limit: keyset pagination on the id (lists only)
+
+Responses carry a weak ETag derived from the versions of their cache
+tags (see `cache`), and a Last-Modified time from the latest change
+(`updated`) or deletion of the objects of the models they include.
+Both are known before any object is read, so conditional requests
+with a matching If-None-Match or If-Modified-Since get a 304 (Not
+Modified) without running the queries of the response.
+
+"""
+
+import hashlib
+import json
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Prefetch
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.views.generic.base import View
+from . import gev, models
+from .cache import CachedViewMixin, model_tag, object_tag
+from .geometry import level_for_zoom
+
+
+MAX_LIMIT = 1000
+DEFAULT_LIMIT = 100
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Resource:
+    """API description of a model
+
+    `fields` are the default fields; `heavy` fields are only included
+    on request. `embeds` maps relation names to (model attribute,
+    resource name, many) tuples. `filters` lists the allowed lookups.
+
+    """
+
+    def __init__(self, model, fields, heavy=(), embeds=None, filters=()):
+        self.model = model
+        self.fields = list(fields)
+        self.heavy = list(heavy)
+        self.embeds = embeds or {}
+        self.filters = list(filters)
+
+    def parse_fields(self, params):
+        if 'fields' not in params:
+            return list(self.fields)
+        fields = [field for field in params['fields'].split(',') if field]
+        unknown = set(fields) - set(self.fields) - set(self.heavy) - set(self.embeds)
+        if unknown:
+            raise BadRequest("Unknown fields: %s" % ', '.join(sorted(unknown)))
+        return fields
+
+    def parse_embeds(self, params):
+        embeds = [name for name in params.get('embed', '').split(',') if name]
+        unknown = set(embeds) - set(self.embeds)
+        if unknown:
+            raise BadRequest("Unknown relations: %s" % ', '.join(sorted(unknown)))
+        return embeds
+
+    @property
+    def nested_fields(self):
+        """Default fields of embedded objects: no lists of related objects"""
+        return [name for name in self.fields
+                if name not in self.embeds or not self.embeds[name][2]]
+
+    def get_queryset(self, fields, embeds, params):
+        queryset = self.model.objects.all()
+        deferred = [name for name in self.heavy if name not in fields]
+        for name in self.embeds:
+            attr, resource, many = self.embeds[name]
+            if name not in fields and name not in embeds:
+                continue
+            related = RESOURCES[resource]
+            if many:
+                inner = related.model.objects.defer(*related.heavy) if related.heavy else None
+                queryset = queryset.prefetch_related(Prefetch(attr, queryset=inner))
+            elif name in embeds:
+                queryset = queryset.select_related(attr)
+                deferred.extend('%s__%s' % (attr, heavy) for heavy in related.heavy)
+        return queryset.defer(*deferred) if deferred else queryset
+
+    def filter(self, queryset, params):
+        lookups = {name: value for name, value in params.items() if name in self.filters}
+        try:
+            return queryset.filter(**lookups)
+        except (ValidationError, ValueError) as exc:
+            raise BadRequest("Invalid filter value: %s" % exc)
+
+    def value(self, obj, name, params):
+        field = self.model._meta.get_field(name)
+        if field.is_relation:
+            return getattr(obj, field.attname)
+        return getattr(obj, name)
+
+    def serialize(self, obj, fields, embeds, params):
+        data = {}
+        for name in fields:
+            if name in self.embeds:
+                attr, resource, many = self.embeds[name]
+                related = RESOURCES[resource]
+                if many:
+                    objs = getattr(obj, attr).all()
+                    data[name] = ([related.serialize(item, related.nested_fields, [], params)
+                                   for item in objs]
+                                  if name in embeds else [item.pk for item in objs])
+                elif name in embeds:
+                    item = getattr(obj, attr)
+                    data[name] = related.serialize(item, related.nested_fields, [], params)
+                else:
+                    data[name] = self.value(obj, attr, params)
+            else:
+                data[name] = self.value(obj, name, params)
+        return data
+
+
+class RegionResource(Resource):
+    """Region areas are included as GeoJSON, simplified for the `zoom`
+    parameter"""
+
+    def get_queryset(self, fields, embeds, params):
+        queryset = super().get_queryset(fields, embeds, params)
+        level = level_for_zoom(_zoom(params))
+        if 'area' in fields and level is not None:
+            queryset = queryset.defer('area').prefetch_related(Prefetch(
+                'simplified', queryset=models.SimplifiedRegion.objects.filter(level=level),
+                to_attr='simplified_area'))
+        elif 'area' in fields:
+            queryset = queryset.with_area()
+        return queryset
+
+    def value(self, obj, name, params):
+        if name != 'area':
+            return super().value(obj, name, params)
+        simplified = getattr(obj, 'simplified_area', None)
+        area = simplified[0].area if simplified else obj.area_for_zoom(_zoom(params))
+        return json.loads(area.geojson)
+
+
+def _zoom(params):
+    try:
+        return int(params['zoom'])
+    except (KeyError, ValueError):
+        return None
+
+
+RESOURCES = {
+    'events': Resource(
+        models.Event,
+        ['id', 'name', 'region', 'startdate', 'duration', 'enddate', 'variable',
+         'fitted_distribution',
+         'impact', 'synthesis', 'seasons', 'obs_datasets', 'model_datasets'],
+        embeds={
+            'region': ('region', 'regions', False),
+            'impact': ('impact', 'impacts', False),
+            'synthesis': ('synthesis', 'syntheses', False),
+            'seasons': ('season', 'seasons', True),
+            'obs_datasets': ('observational_datasets', 'obsdatasets', True),
+            'model_datasets': ('model_datasets', 'modeldatasets', True),
+        },
+        filters=['variable', 'region', 'startdate__gte', 'startdate__lte',
+                 'enddate__gte', 'enddate__lte', 'synthesis__pr__gte', 'synthesis__pr__lte']),
+    'regions': RegionResource(
+        models.Region,
+        ['id', 'name', 'xmin', 'ymin', 'xmax', 'ymax', 'centroid_x', 'centroid_y',
+         'num_vertices', 'area_km2', 'geohash'],
+        heavy=['area'],
+        embeds={'events': ('event_set', 'events', True)},
+        filters=['name', 'name__icontains', 'area_km2__gte', 'area_km2__lte']),
+    'impacts': Resource(
+        models.Impact,
+        ['id', 'deaths', 'affected', 'request', 'comments']),
+    'syntheses': Resource(
+        models.Synthesis,
+        ['id', 'pr', 'delta_i', 'conclusions', 'contact', 'webpage', 'doi'],
+        filters=['pr__gte', 'pr__lte']),
+    'seasons': Resource(
+        models.Season,
+        ['id', 'event', 'start', 'end'],
+        embeds={'event': ('event', 'events', False)},
+        filters=['event']),
+    'obsdatasets': Resource(
+        models.ObsDataset,
+        ['id', 'event', 'value', 'doi', 'pr', 'delta_i', 'comments',
+         'fit_parameters', 'return_times'],
+        embeds={
+            'event': ('event', 'events', False),
+            'fit_parameters': ('best_fit_value', 'fitparameters', True),
+            'return_times': ('return_period', 'returntimes', True),
+        },
+        filters=['event', 'pr__gte', 'pr__lte']),
+    'modeldatasets': Resource(
+        models.ModelDataset,
+        ['id', 'event', 'model_type', 'period', 'trend', 'pr', 'delta_i'],
+        embeds={'event': ('event', 'events', False)},
+        filters=['event', 'pr__gte', 'pr__lte']),
+    'fitparameters': Resource(
+        models.FitParameters,
+        ['id', 'obsdataset', 'mu', 'sigma', 'xi', 'alpha'],
+        embeds={'obsdataset': ('obsdataset', 'obsdatasets', False)},
+        filters=['obsdataset']),
+    'returntimes': Resource(
+        models.ReturnTime,
+        ['id', 'obsdataset', 'value', 'lower', 'upper'],
+        embeds={'obsdataset': ('obsdataset', 'obsdatasets', False)},
+        filters=['obsdataset']),
+}
+
+
+class ApiView(CachedViewMixin, View):
+    """JSON response with an ETag and a Last-Modified time, honouring
+    If-None-Match and If-Modified-Since
+
+    Subclasses implement `get_data(resource, fields, embeds, params,
+    **kwargs)`, returning the data of the response.
+
+    """
+
+    resource = None
+
+    def get_models(self):
+        """The model of the resource and all models that may be embedded"""
+        resource = RESOURCES[self.resource]
+        return [resource.model] + [
+            RESOURCES[name].model for attr, name, many in resource.embeds.values()]
+
+    def get_cache_tags(self):
+        return [model_tag(model) for model in self.get_models()]
+
+    def get_etag(self):
+        """Weak ETag of the URL and the versions of the cache tags, which
+        change with every change that may show in the response"""
+        key = '|'.join([self.request.get_full_path()] + self.cache_versions)
+        return 'W/' + quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def get_last_modified(self):
+        """Time (as a timestamp) of the latest change or deletion of an
+        object of the models of the response, or None"""
+        names = [model._meta.model_name for model in self.get_models()]
+        times = [model.objects.aggregate(time=Max('updated'))['time']
+                 for model in self.get_models()]
+        times.append(models.Tombstone.objects.filter(
+            model__in=names).aggregate(time=Max('deleted'))['time'])
+        times = [time for time in times if time is not None]
+        return int(max(times).timestamp()) if times else None
+
+    def get(self, request, **kwargs):
+        resource = RESOURCES[self.resource]
+        params = request.GET
+        try:
+            fields = resource.parse_fields(params)
+            embeds = resource.parse_embeds(params)
+            fields += [name for name in embeds if name not in fields]
+            etag = self.get_etag()
+            last_modified = self.get_last_modified()
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                data = self.get_data(resource, fields, embeds, params, **kwargs)
+                response = HttpResponse(json.dumps(data, cls=DjangoJSONEncoder),
+                                        content_type='application/json')
+        except BadRequest as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+class ResourceList(ApiView):
+    def get_data(self, resource, fields, embeds, params):
+        try:
+            limit = min(max(int(params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+            after = int(params.get('after', 0))
+        except ValueError:
+            raise BadRequest("limit and after should be integers")
+        queryset = resource.filter(resource.get_queryset(fields, embeds, params), params)
+        objs = list(queryset.filter(pk__gt=after).order_by('pk')[:limit + 1])
+        more = len(objs) > limit
+        objs = objs[:limit]
+        next_query = None
+        if more:
+            query = params.copy()
+            query['after'] = objs[-1].pk
+            next_query = '?' + query.urlencode()
+        return {
+            'results': [resource.serialize(obj, fields, embeds, params) for obj in objs],
+            'next': self.request.path + next_query if next_query else None,
+        }
+
+
+class ResourceDetail(ApiView):
+    def get_cache_tags(self):
+        model, *embedded = self.get_models()
+        return ([object_tag(model, self.kwargs['pk'])] +
+                [model_tag(related) for related in embedded])
+
+    def get_data(self, resource, fields, embeds, params, pk):
+        try:
+            obj = resource.get_queryset(fields, embeds, params).get(pk=pk)
+        except resource.model.DoesNotExist:
+            raise Http404("No such object")
+        return resource.serialize(obj, fields, embeds, params)
+
+
+def _finite(values):
+    return [float(value) if np.isfinite(value) else None for value in values]
+
+
+class GevEvaluation(CachedViewMixin, View):
+    """Return periods, probability ratios and intensity changes for the
+    observational datasets of an event
+
+    Evaluated at the dataset values, or at the comma-separated
+    `threshold` values, for the optional `delta_t` warming.
+
+    """
+
+    def get_cache_tags(self):
+        return [object_tag(models.Event, self.kwargs['pk'])]
+
+    def get(self, request, pk):
+        if not models.Event.objects.filter(pk=pk).exists():
+            raise Http404("No such event")
+        try:
+            thresholds = [float(value) for value in request.GET['threshold'].split(',')
+                          if value] if 'threshold' in request.GET else None
+            delta_t = float(request.GET['delta_t']) if 'delta_t' in request.GET else None
+        except ValueError:
+            return JsonResponse({'error': "threshold and delta_t should be numbers"}, status=400)
+
+        fits = gev.load(models.ObsDataset.objects.filter(event=pk))
+        if thresholds:
+            threshold = np.array(thresholds)[np.newaxis, :]
+        else:
+            threshold = fits['value'][:, np.newaxis]
+        params = {name: fits[name][:, np.newaxis] for name in ('mu', 'sigma', 'xi', 'alpha', 'scale')}
+        results = gev.evaluate(threshold, delta_t=delta_t, **params)
+        threshold = np.broadcast_to(threshold, results['pr'].shape)
+        return JsonResponse({'datasets': [
+            dict({name: _finite(values[i]) for name, values in results.items()},
+                 obsdataset=int(obsdataset), threshold=_finite(threshold[i]))
+            for i, obsdataset in enumerate(fits['obsdataset'])]})
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class EventsConfig(AppConfig):
-    name = 'events'
+    name = 'apps.exevada'
+    label = 'exevada'
+
+    def ready(self):
+        from . import signals
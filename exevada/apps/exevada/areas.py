@@ -0,0 +1,180 @@
+"""Reading region areas from files and text
+
+Files are read with GDAL/OGR, one feature at a time, so large files
+are never loaded into memory as a whole: shapefiles (zipped, or the
+.shp next to its companion files), GeoJSON, GeoPackage and any other
+vector format GDAL supports. WKT and WKB are read with GEOS.
+
+Uploads are limited to `UPLOAD_EXTENSIONS`, also for the files in zip
+archives: formats such as VRT make GDAL read other local files or
+URLs.
+
+All geometries are transformed to the SRID of `Region.area`, repaired
+if invalid, and returned as MultiPolygons.
+
+"""
+
+import os
+import tempfile
+import zipfile
+from django.contrib.gis.gdal import DataSource, GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry, MultiPolygon, Polygon
+from . import models
+
+
+SRID = models.Region._meta.get_field('area').srid
+# Extensions of files holding a single WKT or WKB geometry
+WKT_EXTENSIONS = ('.wkt', '.txt')
+WKB_EXTENSIONS = ('.wkb',)
+# Extensions of uploads
+UPLOAD_EXTENSIONS = (('.zip', '.shp', '.geojson', '.json', '.gpkg') +
+                     WKT_EXTENSIONS + WKB_EXTENSIONS)
+# Companion files of shapefiles, allowed in zip archives
+SHAPEFILE_EXTENSIONS = ('.shx', '.dbf', '.prj', '.cpg')
+
+
+class AreaError(ValueError):
+    pass
+
+
+def polygons(geom):
+    """The polygons making up a geometry; other parts are dropped"""
+    if isinstance(geom, Polygon):
+        return [geom]
+    if geom.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        return [polygon for part in geom for polygon in polygons(part)]
+    return []
+
+
+def to_area(geom):
+    """Geometry transformed to the area SRID, repaired and as a
+    MultiPolygon"""
+
+    if not geom.srid:
+        geom.srid = SRID
+    if geom.srid != SRID:
+        geom = geom.transform(SRID, clone=True)
+    if not geom.valid:
+        # Buffering by zero resolves self-intersections
+        geom = geom.buffer(0)
+    parts = polygons(geom)
+    if not parts:
+        raise AreaError("No polygons found (geometry type %s)" % geom.geom_type)
+    area = MultiPolygon(parts, srid=SRID)
+    if not area.valid:
+        # Overlapping parts
+        area = area.unary_union
+        area = area if isinstance(area, MultiPolygon) else MultiPolygon(area, srid=SRID)
+    return area
+
+
+def check_extension(name, allowed=UPLOAD_EXTENSIONS):
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in allowed:
+        raise AreaError("Unsupported file type %s" % (extension or os.path.basename(name)))
+    return extension
+
+
+def check_archive(path):
+    """Check the files in a zip archive against the upload extensions"""
+    allowed = tuple(set(UPLOAD_EXTENSIONS) - {'.zip'}) + SHAPEFILE_EXTENSIONS
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    check_extension(info.filename, allowed)
+    except (zipfile.BadZipFile, OSError) as exc:
+        raise AreaError("Cannot read %s: %s" % (os.path.basename(path), exc))
+
+
+def open_datasource(path):
+    """GDAL data source of a file; zip files are read in place"""
+    if path.lower().endswith('.zip'):
+        check_archive(path)
+        path = '/vsizip/' + os.path.abspath(path)
+    try:
+        return DataSource(path)
+    except GDALException as exc:
+        raise AreaError("Cannot read %s: %s" % (os.path.basename(path), exc))
+
+
+def iter_features(path, name_field='name', layer=0):
+    """(name, area) pairs of the features in a vector file
+
+    The name is taken from the `name_field` attribute, if present.
+
+    """
+
+    datasource = open_datasource(path)
+    try:
+        layer = datasource[layer]
+    except (IndexError, KeyError, GDALException):
+        raise AreaError("No layer %s in %s" % (layer, os.path.basename(path)))
+    fields = layer.fields
+    for feature in layer:
+        geom = feature.geom
+        # Transform with OGR, which handles projections without an EPSG code
+        if geom.srs is None:
+            geom.srid = SRID
+        else:
+            geom.transform(SRID)
+        name = feature.get(name_field) if name_field in fields else None
+        yield (None if name is None else str(name)), to_area(geom.geos)
+
+
+def read_geometry(data):
+    """Area from WKT, EWKT, hex or binary WKB, or GeoJSON (a geometry,
+    or a feature collection)"""
+
+    if isinstance(data, bytes):
+        data = memoryview(data)
+    else:
+        data = data.strip()
+    try:
+        return to_area(GEOSGeometry(data))
+    except (GEOSException, GDALException, ValueError, TypeError):
+        if not isinstance(data, str) or not data.startswith('{'):
+            raise AreaError("Not a valid WKT, WKB or GeoJSON geometry")
+    # GDAL reads GeoJSON text as a data source
+    try:
+        return merge(area for name, area in iter_features(data))
+    except GDALException as exc:
+        raise AreaError("Not valid GeoJSON: %s" % exc)
+
+
+def merge(areas):
+    """Single area covering all areas"""
+    parts = [polygon for area in areas for polygon in area]
+    if not parts:
+        raise AreaError("No polygons found")
+    return to_area(MultiPolygon(parts, srid=SRID))
+
+
+def read_file(path):
+    """Single area covering all features of a file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in WKT_EXTENSIONS + WKB_EXTENSIONS:
+        mode = 'rb' if extension in WKB_EXTENSIONS else 'r'
+        with open(path, mode) as fh:
+            return read_geometry(fh.read())
+    return merge(area for name, area in iter_features(path))
+
+
+def read_upload(upload):
+    """Single area covering all features of an uploaded file
+
+    Uploads kept in memory are written to a temporary file first, as
+    GDAL reads from disk.
+
+    """
+
+    suffix = check_extension(upload.name)
+    # Temporary upload files keep the extension, by which GDAL
+    # recognizes the format
+    if hasattr(upload, 'temporary_file_path'):
+        return read_file(upload.temporary_file_path())
+    with tempfile.NamedTemporaryFile(suffix=suffix) as fh:
+        for chunk in upload.chunks():
+            fh.write(chunk)
+        fh.flush()
+        return read_file(fh.name)
@@ -0,0 +1,154 @@
+"""Async versions of the read-only views, for ASGI servers
+
+Under ASGI, Django runs synchronous views one at a time in a single
+thread (per process), so a slow query or a large region area holds up
+every other request. The views here are coroutines that run the work
+of the regular views in two bounded thread pools instead:
+
+- database work (queries, cache lookups, template rendering) in
+  `EXEVADA_ASYNC_DB_THREADS` threads, which should not exceed the
+  number of database connections the server may open
+- geometry serialization (GeoJSON and vector tile encoding), which is
+  CPU bound and mostly spent in GEOS and GDAL, in
+  `EXEVADA_ASYNC_GEOMETRY_THREADS` threads
+
+The ORM of this Django version is synchronous only, so the queries
+themselves still run in threads; the gain is that requests no longer
+queue behind each other. Async views need Django 3.1 or later, and are
+only used when `EXEVADA_ASYNC` is set (which `project.asgi` does).
+
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from django.http import HttpResponse
+from . import profiling, tiles, views
+from .cache import cache_entry, cached_response, get_cache
+
+
+_executors = {}
+
+
+def executor(name):
+    """The thread pool `name` ('db' or 'geometry'), created on first use"""
+    if name not in _executors:
+        workers = {'db': settings.EXEVADA_ASYNC_DB_THREADS,
+                   'geometry': settings.EXEVADA_ASYNC_GEOMETRY_THREADS}[name]
+        _executors[name] = ThreadPoolExecutor(workers, thread_name_prefix='exevada-%s' % name)
+    return _executors[name]
+
+
+def _with_connections(function, *args, **kwargs):
+    # Pool threads outlive requests, so the request_started and
+    # request_finished handlers never close their connections
+    close_old_connections()
+    try:
+        return profiling.sampled(function, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def database(function, *args, **kwargs):
+    """Call `function` in the database thread pool, in a copy of the
+    current context (which holds the routing state, see `routers`, and
+    the profile, see `profiling`)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor('db'), functools.partial(
+        context.run, _with_connections, function, *args, **kwargs))
+
+
+async def geometry(function, *args, **kwargs):
+    """Call `function` in the geometry thread pool, in a copy of the
+    current context"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor('geometry'), functools.partial(
+        context.run, profiling.sampled, function, *args, **kwargs))
+
+
+def offload(view_class, **initkwargs):
+    """Async view running the whole of the (synchronous) view in the
+    database thread pool"""
+
+    view = view_class.as_view(**initkwargs)
+
+    async def async_view(request, *args, **kwargs):
+        response = await database(view, request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            await database(response.render)
+        return response
+
+    async_view.view_class = view_class
+    async_view.view_initkwargs = initkwargs
+    return async_view
+
+
+def _setup(view_class, request, args, kwargs, **initkwargs):
+    view = view_class(**initkwargs)
+    view.setup(request, *args, **kwargs)
+    return view
+
+
+def geojson(view_class, **initkwargs):
+    """Async `views.RegionsGeoJSON` (or subclass): the rows are
+    fetched in the database pool and serialized in the geometry pool"""
+
+    async def async_view(request, *args, **kwargs):
+        view = _setup(view_class, request, args, kwargs, **initkwargs)
+        if request.method not in ('GET', 'HEAD'):
+            return view.http_method_not_allowed(request, *args, **kwargs)
+        cache = get_cache()
+        key = await database(view.get_cache_key, request)
+        cached = await database(cache.get, key)
+        if cached is not None:
+            return cached_response(request, cached)
+
+        rows = await database(lambda: list(view.get_rows()))
+        content = await geometry(view.get_content, rows)
+        response = HttpResponse(content, content_type=view.content_type)
+        if not view.may_be_stale():
+            await database(cache.set, key, cache_entry(response), settings.EXEVADA_CACHE_TIMEOUT)
+        return response
+
+    async_view.view_class = view_class
+    async_view.view_initkwargs = initkwargs
+    return async_view
+
+
+def tile(view_class, **initkwargs):
+    """Async `views.RegionTile`: cached tiles are read, and new ones
+    encoded and stored, in the geometry pool"""
+
+    async def async_view(request, z, x, y):
+        view = _setup(view_class, request, (), {'z': z, 'x': x, 'y': y}, **initkwargs)
+        if request.method not in ('GET', 'HEAD'):
+            return view.http_method_not_allowed(request)
+        view.check_tile(z, x, y)
+        data = await geometry(tiles.cached, z, x, y)
+        if data is None:
+            rows = await database(lambda: list(view.get_rows(z, x, y)))
+            data = await geometry(tiles.encode_regions, rows, z, x, y)
+            await geometry(tiles.store, z, x, y, data)
+        return HttpResponse(data, content_type=tiles.CONTENT_TYPE)
+
+    async_view.view_class = view_class
+    async_view.view_initkwargs = initkwargs
+    return async_view
+
+
+def as_view(view_class, **initkwargs):
+    """Async view for one of the read-only views"""
+    if django.VERSION < (3, 1):
+        raise ImproperlyConfigured("EXEVADA_ASYNC needs Django 3.1 or later")
+    if issubclass(view_class, views.RegionsGeoJSON):
+        return geojson(view_class, **initkwargs)
+    if issubclass(view_class, views.RegionTile):
+        return tile(view_class, **initkwargs)
+    return offload(view_class, **initkwargs)
@@ -0,0 +1,306 @@
+"""Benchmarks of the views, admin pages, spatial lookups and imports
+
+`run` loads synthetic data (see `synthetic`) in steps up to each of a
+number of event counts, and times every case at each step: the views
+of `urls`, the admin changelists, and the spatial region lookups.
+Cases record latency percentiles (in ms), the number of queries and
+the response status. Results are plain dicts, to be stored as JSON
+and compared with `compare`.
+
+The data is loaded into the current database, so this should run on
+a test database (as the `benchmark` command does).
+
+`load_test` measures a running server instead, with concurrent clients
+(see the `loadtest` command).
+
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+import django
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from . import api, jobs, models, synthetic, tiles
+
+
+PERCENTILES = [50, 90, 99]
+# Responses with the full database are only requested once
+ONCE = {'export-csv', 'export-ndjson'}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    pos = p / 100 * (len(values) - 1)
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summarize(times):
+    """Latency statistics, in ms, of durations in seconds"""
+    times = [t * 1000 for t in times]
+    stats = {'p%d' % p: percentile(times, p) for p in PERCENTILES}
+    stats.update(mean=sum(times) / len(times), min=min(times), max=max(times), n=len(times))
+    return stats
+
+
+def measure(function, repeat, warmup=1):
+    """Statistics of calling `function`, with the highest query count
+    and the last return value (the response status, or the number of
+    rows) as status"""
+
+    for i in range(warmup):
+        function()
+    times = []
+    queries = 0
+    status = None
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            status = function()
+            times.append(time.perf_counter() - start)
+        queries = max(queries, len(context))
+    return dict(summarize(times), queries=queries, status=status)
+
+
+def request(client, url):
+    def get():
+        response = client.get(url)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        return response.status_code
+    return get
+
+
+def view_urls(event, region):
+    """(name, url) of the views, for an event and region"""
+
+    def url(name, *args, query=''):
+        return reverse('exevada:%s' % name, args=args) + query
+
+    x, y = region.area.point_on_surface.coords
+    bbox = (region.xmin, region.ymin, region.xmax, region.ymax)
+    (column, _), (row, _) = tiles.tile_range(bbox, 4)
+    urls = [
+        ('index', url('index')),
+        ('events', url('events')),
+        ('events-pr', url('events', query='?sort=-pr')),
+        ('events-variable', url('events', query='?variable=%s' % event.variable)),
+        ('events-region-date', url('events', query='?region=%d&start=1970-01-01&end=1990-01-01'
+                                   % region.pk)),
+        ('events-active', url('events', query='?active_from=1980-07-10&active_until=1980-07-20')),
+        ('events-season', url('events', query='?season_start=12&season_end=2')),
+        ('search-events-point', url('search-events', query='?lon=%f&lat=%f' % (x, y))),
+        ('search-events-radius', url('search-events',
+                                     query='?lon=%f&lat=%f&radius=500' % (x, y))),
+        ('search-events-bbox', url('search-events', query='?bbox=%f,%f,%f,%f' % (
+            x - 5, y - 5, x + 5, y + 5))),
+        ('event-clusters-world', url('event-clusters', query='?zoom=2')),
+        ('event-clusters-bbox', url('event-clusters', query='?zoom=8&bbox=%f,%f,%f,%f' % (
+            x - 5, y - 5, x + 5, y + 5))),
+        ('search', url('search', query='?q=%s' % event.variable)),
+        ('event', url('event', event.pk)),
+        ('obsdata', url('obsdata', event.pk)),
+        ('modeldata', url('modeldata', event.pk)),
+        ('add-event', url('add-event')),
+        ('add-region', url('add-region')),
+        ('export-csv', url('export-events', 'csv')),
+        ('export-ndjson', url('export-events', 'ndjson')),
+        ('statistics', url('statistics', query='?dimension=variable')),
+        ('api-events-gev', url('api-events-gev', event.pk)),
+        ('regions', url('regions')),
+        ('regions-geojson', url('regions-geojson', query='?zoom=3')),
+        ('region-tile', url('region-tile', 4, column, row)),
+        ('region', url('region', region.pk)),
+        ('region-geojson', url('region-geojson', region.pk)),
+        ('region-geojson-full', url('region-geojson', region.pk, query='?zoom=20')),
+        ('region-shapes', url('region-shapes', query='?zoom=3')),
+        ('region-shape-wkb', url('region-shape', region.pk, 'wkb', query='?zoom=20')),
+        ('region-shape-twkb', url('region-shape', region.pk, 'twkb', query='?zoom=20')),
+    ]
+    objects = {
+        'events': event.pk, 'regions': region.pk, 'impacts': event.impact_id,
+        'syntheses': event.synthesis_id,
+    }
+    for name, resource in api.RESOURCES.items():
+        urls.append(('api-%s' % name, url('api-%s' % name)))
+        pk = objects.get(name) or resource.model.objects.values_list('pk', flat=True).first()
+        if pk is not None:
+            urls.append(('api-%s-detail' % name, url('api-%s-detail' % name, pk)))
+    urls.append(('api-events-embed', url('api-events', query='?embed=region,synthesis,seasons')))
+    return urls
+
+
+def admin_urls(event):
+    urls = [('admin-%s' % model._meta.model_name,
+             reverse('admin:%s_%s_changelist' % (model._meta.app_label, model._meta.model_name)))
+            for model in admin.site._registry]
+    urls.append(('admin-event-change', reverse('admin:exevada_event_change', args=[event.pk])))
+    return urls
+
+
+def spatial_lookups(region):
+    point = region.area.point_on_surface
+    x, y = point.coords
+    bbox = (x - 5, y - 5, x + 5, y + 5)
+
+    def lookup(queryset):
+        return lambda: len(queryset.values_list('pk', flat=True))
+
+    return [
+        ('spatial-containing', lookup(models.Region.objects.containing(point))),
+        ('spatial-within-distance', lookup(models.Region.objects.within_distance(point, 500))),
+        ('spatial-intersecting', lookup(models.Region.objects.intersecting(bbox))),
+        ('spatial-events-in-bbox', lookup(models.Event.objects.filter(
+            region__in=models.Region.objects.intersecting(bbox)))),
+    ]
+
+
+def load(events, regions, first, seed, stdout):
+    """Generate and import events `first` up to `events`; returns the
+    import statistics"""
+
+    fd, path = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            for record in synthetic.iter_events(events - first, regions, seed=seed + first):
+                fh.write(json.dumps(record) + '\n')
+        start = time.perf_counter()
+        call_command('import_events', path, stdout=stdout)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.remove(path)
+    return {'events': events - first, 'seconds': elapsed,
+            'events_per_second': (events - first) / elapsed if elapsed else None}
+
+
+def run(scales, regions=100, vertices=1000, repeat=20, seed=0, stdout=None, progress=None):
+    """Benchmark results at each number of events in `scales`"""
+
+    progress = progress or (lambda message: None)
+    start = time.perf_counter()
+    names = []
+    for name, area in synthetic.iter_regions(regions, vertices, seed=seed):
+        models.Region.objects.create(name=name, area=area)
+        names.append(name)
+    results = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'django': django.get_version(), 'database': connection.vendor,
+            'regions': regions, 'vertices': vertices, 'repeat': repeat, 'seed': seed,
+            'region_seconds': time.perf_counter() - start,
+        },
+        'scales': {},
+    }
+
+    user = get_user_model().objects.create_superuser('benchmark', 'benchmark@example.org',
+                                                     'benchmark')
+    client = Client()
+    client.force_login(user)
+    loaded = 0
+    for events in sorted(scales):
+        progress("Loading %d events" % events)
+        result = {'import': load(events, names, loaded, seed, stdout), 'cases': {}}
+        loaded = events
+        # The jobs of the import and the regions (simplification,
+        # statistics), as the workers would have run them
+        jobs.work(threading.Event(), burst=True)
+        # A typical event, and its region
+        event = models.Event.objects.order_by('pk')[models.Event.objects.count() // 2]
+        region = event.region
+        cases = [(name, request(client, url))
+                 for name, url in view_urls(event, region) + admin_urls(event)]
+        cases += spatial_lookups(region)
+        for name, function in cases:
+            progress("%d events: %s" % (events, name))
+            result['cases'][name] = measure(function, 1 if name in ONCE else repeat)
+        results['scales'][str(events)] = result
+    return results
+
+
+def compare(results, baseline, threshold=1.25, minimum=1.0):
+    """Rows (scale, case, baseline p50, p50, ratio, regression) for the
+    cases in both results
+
+    A case regresses if its median is more than `threshold` times, and
+    `minimum` ms, slower than the baseline, or if it needs more queries.
+
+    """
+
+    rows = []
+    for scale, result in results['scales'].items():
+        old_cases = baseline.get('scales', {}).get(scale, {}).get('cases', {})
+        for name, case in result['cases'].items():
+            old = old_cases.get(name)
+            if not old:
+                continue
+            ratio = case['p50'] / old['p50'] if old['p50'] else float('inf')
+            regression = ((ratio > threshold and case['p50'] - old['p50'] > minimum) or
+                          case['queries'] > old['queries'])
+            rows.append((scale, name, old['p50'], case['p50'], ratio, regression))
+    return rows
+
+
+async def fetch(url, timeout):
+    """Status of a GET of `url`, reading the whole response"""
+
+    parts = urllib.parse.urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=secure or None), timeout)
+    try:
+        writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n'
+                      % (path, parts.netloc)).encode('latin-1'))
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        while await asyncio.wait_for(reader.read(65536), timeout):
+            pass
+    finally:
+        writer.close()
+    return int(status_line.split()[1])
+
+
+async def load_test(urls, concurrency, requests, timeout=30):
+    """Throughput and latency of `requests` GETs of `urls` (in turn),
+    made by `concurrency` concurrent clients"""
+
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(urls[i % len(urls)])
+    times = []
+    statuses = {}
+
+    async def client():
+        while not queue.empty():
+            url = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                status = await fetch(url, timeout)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError) as exc:
+                status = type(exc).__name__
+            times.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return dict(summarize(times), concurrency=concurrency, seconds=elapsed,
+                throughput=len(times) / elapsed,
+                errors=sum(count for status, count in statuses.items() if status != 200),
+                statuses={str(status): count for status, count in statuses.items()})
@@ -0,0 +1,164 @@
+"""Parametric bootstrap of return period confidence intervals
+
+For each observational dataset, samples are drawn from its fitted GEV
+distribution (in the present climate), a GEV is refitted to every
+sample with L-moments, and the return period of the dataset value is
+evaluated for each refit; the bounds are quantiles of those return
+periods. All samples of a dataset are drawn and refitted in one
+batch of NumPy operations.
+
+Each dataset has its own random stream, seeded from the global seed
+and its primary key, so results do not depend on the number of worker
+processes or on which other datasets are computed with it.
+
+"""
+
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from django.db import connections, transaction
+from django.utils import timezone
+from . import cache, gev, models
+
+
+EULER = 0.5772156649015329
+# Lanczos approximation (g = 7), good to about 15 digits
+LANCZOS_G = 7
+LANCZOS = [0.99999999999980993, 676.5203681218851, -1259.1392167224028, 771.32342877765313,
+           -176.61502916214059, 12.507343278686905, -0.13857109526572012,
+           9.9843695780195716e-6, 1.5056327351493116e-7]
+
+
+def gamma(z):
+    """Gamma function of an array, with the reflection formula below 1/2"""
+
+    z = np.asarray(z, dtype=float)
+    reflect = z < 0.5
+    x = np.where(reflect, 1 - z, z) - 1
+    series = LANCZOS[0] + sum(c / (x + i) for i, c in enumerate(LANCZOS[1:], 1))
+    t = x + LANCZOS_G + 0.5
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        result = math.sqrt(2 * math.pi) * t ** (x + 0.5) * np.exp(-t) * series
+        return np.where(reflect, math.pi / (np.sin(math.pi * z) * result), result)
+
+
+def fit_lmoments(samples):
+    """GEV parameters (mu, sigma, xi) of each row of `samples`, from
+    its L-moments (Hosking, Wallis & Wood, 1985)"""
+
+    x = np.sort(samples, axis=-1)
+    n = x.shape[-1]
+    i = np.arange(n)
+    b0 = x.mean(axis=-1)
+    b1 = (x * i / (n - 1)).mean(axis=-1)
+    b2 = (x * i * (i - 1) / ((n - 1) * (n - 2))).mean(axis=-1)
+    l1, l2, l3 = b0, 2 * b1 - b0, 6 * b2 - 6 * b1 + b0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = 2 / (3 + l3 / l2) - math.log(2) / math.log(3)
+        # Hosking's k is minus the shape
+        k = 7.8590 * c + 2.9554 * c ** 2
+        gumbel = np.abs(k) < 1e-6
+        k = np.where(gumbel, 1, k)
+        g = gamma(1 + k)
+        sigma = np.where(gumbel, l2 / math.log(2), l2 * k / ((1 - 2 ** -k) * g))
+        mu = np.where(gumbel, l1 - EULER * sigma, l1 - sigma * (1 - g) / k)
+    return mu, sigma, np.where(gumbel, 0, -k)
+
+
+def rng(seed, pk):
+    return np.random.default_rng(np.random.SeedSequence([seed, pk]))
+
+
+def bounds(pk, value, mu, sigma, xi, samples=1000, size=50, level=0.95, seed=0):
+    """Lower and upper bound of the return period of `value`"""
+
+    u = rng(seed, pk).random((samples, size))
+    resampled = gev.quantile(u, mu, sigma, xi)
+    fit = fit_lmoments(resampled)
+    with np.errstate(divide='ignore'):
+        periods = 1 / (1 - gev.cdf(value, *fit))
+    periods = np.where(np.isnan(periods), np.inf, periods)
+    tail = (1 - level) / 2
+    lower, upper = np.quantile(periods, [tail, 1 - tail])
+    return float(lower), float(upper)
+
+
+def _bounds_chunk(args):
+    rows, options = args
+    return [(row[0], bounds(*row, **options)) for row in rows]
+
+
+def compute(obsdatasets=None, workers=None, chunk_size=100, batch_size=500, progress=None,
+            **options):
+    """Recompute the bounds of the return times of the datasets
+
+    The fits are evaluated in `workers` processes (in this process for
+    a single worker), `chunk_size` datasets at a time, and the return times updated in batches of
+    `batch_size`. `progress` is called with the fraction of the chunks
+    done. Returns the number of updated datasets, and that of the
+    datasets skipped, for non-finite bounds or for lack of a return
+    time.
+
+    """
+
+    fits = gev.load(obsdatasets)
+    # The bounds apply to the return time in the present climate, which
+    # does not depend on whether the fit shifts or scales
+    rows = list(zip(fits['obsdataset'].tolist(), fits['value'].tolist(), fits['mu'].tolist(),
+                    fits['sigma'].tolist(), fits['xi'].tolist()))
+    chunks = [(rows[i:i + chunk_size], options) for i in range(0, len(rows), chunk_size)]
+    updated = skipped = 0
+    pending = {}
+
+    def flush():
+        nonlocal skipped
+        # Like compute_return_times, only the first return time of a dataset
+        returntimes = {}
+        for returntime in models.ReturnTime.objects.filter(
+                obsdataset__in=list(pending)).order_by('obsdataset_id', 'pk'):
+            returntimes.setdefault(returntime.obsdataset_id, returntime)
+        now = timezone.now()
+        for pk, returntime in returntimes.items():
+            returntime.lower, returntime.upper = pending[pk]
+            returntime.updated = now
+        with transaction.atomic():
+            models.ReturnTime.objects.bulk_update(returntimes.values(),
+                                                  ['lower', 'upper', 'updated'])
+        # Datasets without a return time
+        skipped += len(pending) - len(returntimes)
+        pending.clear()
+        return len(returntimes)
+
+    def collect(results):
+        nonlocal updated, skipped
+        for done, chunk in enumerate(results, 1):
+            for pk, (lower, upper) in chunk:
+                if math.isfinite(lower) and math.isfinite(upper):
+                    pending[pk] = (lower, upper)
+                else:
+                    skipped += 1
+            if len(pending) >= batch_size:
+                updated += flush()
+            if progress:
+                progress(done / len(chunks))
+
+    if workers == 1:
+        collect(map(_bounds_chunk, chunks))
+    else:
+        # The workers only compute, but should not inherit open
+        # connections. They are forked: started afresh, they would
+        # import the models without the app registry being set up.
+        connections.close_all()
+        with ProcessPoolExecutor(workers,
+                                 mp_context=multiprocessing.get_context('fork')) as executor:
+            collect(executor.map(_bounds_chunk, chunks))
+    if pending:
+        updated += flush()
+
+    # Bulk updates do not signal
+    datasets = models.ObsDataset.objects.all() if obsdatasets is None else obsdatasets
+    events = datasets.values_list('event_id', flat=True).distinct()
+    cache.invalidate(cache.model_tag(models.ReturnTime),
+                     *(cache.object_tag(models.Event, pk) for pk in events))
+    return updated, skipped
@@ -0,0 +1,38 @@
+"""Bulk database operations"""
+
+from django.db import connections, router
+from django.db.models import Max
+
+
+def _next_pk(model, connection):
+    start = model.objects.aggregate(Max('pk'))['pk__max'] or 0
+    if connection.vendor == 'sqlite':
+        # Do not reuse the keys of deleted rows (AUTOINCREMENT tables)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s",
+                           [model._meta.db_table])
+            row = cursor.fetchone()
+        if row:
+            start = max(start, row[0])
+    return start + 1
+
+
+def bulk_insert(model, objs, batch_size=None):
+    """`bulk_create` that sets the primary keys of the created objects
+
+    Backends that cannot return the keys from a bulk insert (SQLite)
+    get keys assigned up front, following the current highest key.
+    This should run inside a transaction, and assumes no concurrent
+    inserts into the same table.
+
+    """
+
+    objs = list(objs)
+    if not objs:
+        return objs
+    connection = connections[router.db_for_write(model)]
+    if not connection.features.can_return_rows_from_bulk_insert:
+        start = _next_pk(model, connection)
+        for i, obj in enumerate(objs):
+            obj.pk = start + i
+    return model.objects.bulk_create(objs, batch_size=batch_size)
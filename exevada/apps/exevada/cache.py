@@ -0,0 +1,146 @@
+"""Response caching with tag based invalidation
+
+Cached responses are stored under a key that includes the current
+version of each of their tags. A tag is a model name ("event"), for
+pages depending on any object of that model, or a model name and
+primary key ("event:12"), for pages depending on a single object (and
+its related objects). Invalidating a tag gives it a new version, so
+every response depending on it is missed from then on; the signal
+handlers in `signals` do this on every save and delete, once its
+transaction commits.
+
+Tag versions are kept in the same cache as the responses, and are
+never reset to an earlier value, so an evicted version can not make an
+outdated response reappear. With several server processes, use a
+shared cache backend (file based, memcached, redis) rather than the
+default local-memory one.
+
+Versions carry the time they were created. With read replicas (see
+`routers`), responses read from a replica within `EXEVADA_REPLICA_LAG`
+seconds of an invalidation of one of their tags are not stored, as the
+replica may not have the change yet.
+
+Cached responses keep their ETag and Last-Modified validators, and
+conditional requests matching them get a 304 (Not Modified).
+
+"""
+
+import hashlib
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from . import routers
+
+
+def get_cache():
+    return caches[settings.EXEVADA_CACHE]
+
+
+def model_tag(model):
+    return model._meta.model_name
+
+
+def object_tag(model, pk):
+    return '%s:%s' % (model_tag(model), pk)
+
+
+def _tag_key(tag):
+    return 'exevada:tag:%s' % tag
+
+
+def _new_version():
+    return '%s.%d' % (uuid.uuid4().hex, time.time())
+
+
+def version_age(version):
+    """Seconds since a tag version was created"""
+    try:
+        return time.time() - int(version.rsplit('.', 1)[1])
+    except (IndexError, ValueError):
+        return float('inf')
+
+
+def tag_versions(tags):
+    """Current versions of the tags, creating missing ones"""
+    cache = get_cache()
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*tags):
+    """Invalidate all responses depending on any of the tags"""
+    get_cache().set_many({_tag_key(tag): _new_version() for tag in tags}, None)
+
+
+def cache_entry(response):
+    """What is cached of a response: its content and validators"""
+    return (response.content, response['Content-Type'], response.get('ETag'),
+            parse_http_date_safe(response.get('Last-Modified')))
+
+
+def cached_response(request, cached):
+    """Response from a cache entry, or a 304 if the validators of the
+    request match"""
+    content, content_type, etag, last_modified = cached
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(content, content_type=content_type)
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class CachedViewMixin:
+    """Cache the (successful) GET responses of a view
+
+    `get_cache_tags` returns the tags the response depends on.
+
+    """
+
+    cache_tags = ()
+
+    def get_cache_tags(self):
+        return list(self.cache_tags)
+
+    def get_cache_key(self, request):
+        versions = tag_versions(self.get_cache_tags())
+        self.cache_versions = versions
+        key = '|'.join([request.get_full_path()] + versions)
+        return 'exevada:response:%s' % hashlib.md5(key.encode()).hexdigest()
+
+    def may_be_stale(self):
+        """Whether the response may miss changes that a replica has not
+        received yet"""
+        return routers.uses_replicas() and any(
+            version_age(version) < settings.EXEVADA_REPLICA_LAG
+            for version in self.cache_versions)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+        # The tags may depend on the URL arguments
+        self.request, self.args, self.kwargs = request, args, kwargs
+        cache = get_cache()
+        key = self.get_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached_response(request, cached)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        if (response.status_code == 200 and not response.streaming and
+                not self.may_be_stale()):
+            cache.set(key, cache_entry(response), settings.EXEVADA_CACHE_TIMEOUT)
+        return response
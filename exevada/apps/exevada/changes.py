@@ -0,0 +1,260 @@
+"""Incremental change feed, for mirrors of the database
+
+`changes` returns a page of the objects created or modified, and of the
+objects deleted (their `Tombstone`), after a cursor. A mirror starts
+without a cursor, and passes the cursor of each page to get the next
+one; `apply` saves a page to the local database (see the `sync_from`
+command).
+
+The feed is read in sweeps. A sweep covers the changes up to a fixed
+time, `EXEVADA_CHANGES_SETTLE` seconds before it started, so that rows
+of transactions that had not committed yet (whose times are those of
+the save, not of the commit) are not skipped: they are picked up by the
+next sweep. Within a sweep the resources are read in `ORDER`, with the
+objects referenced by others first, each in order of (updated, id), and
+the deletions last.
+
+"""
+
+import datetime
+import json
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import cache, models, search
+from .api import RESOURCES, BadRequest
+from .bulk import bulk_insert
+from .pagination import decode_cursor, encode_cursor, keyset_filter
+from .signals import invalidate_tiles, related_tags
+
+
+# Resources of the feed, referenced ones first
+ORDER = ['regions', 'impacts', 'syntheses', 'events', 'seasons', 'obsdatasets',
+         'modeldatasets', 'fitparameters', 'returntimes']
+
+MAX_LIMIT = 1000
+DEFAULT_LIMIT = 500
+
+
+def feed_fields(resource):
+    """Fields of the objects in the feed: the default ones without the
+    lists of related objects, the heavy ones and the modification time"""
+    return resource.nested_fields + resource.heavy + ['updated']
+
+
+def _resource_names():
+    return {RESOURCES[name].model._meta.model_name: name for name in ORDER}
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def parse_cursor(cursor):
+    """(until, deleted, positions) of a cursor; `until` is None at the
+    start of a sweep"""
+    if not cursor:
+        return None, 0, {}
+    values = decode_cursor(cursor)
+    try:
+        until, deleted, positions = values
+        until = _datetime(until) if until else None
+        positions = {name: (_datetime(positions[name][0]), int(positions[name][1]))
+                     for name in ORDER if name in positions}
+        deleted = int(deleted)
+    except (TypeError, ValueError, KeyError, IndexError):
+        raise BadRequest("Invalid cursor")
+    return until, deleted, positions
+
+
+def _changed(name, position, until, limit):
+    resource = RESOURCES[name]
+    fields = feed_fields(resource)
+    queryset = resource.get_queryset(fields, [], {}).filter(updated__lte=until)
+    if position:
+        queryset = queryset.filter(keyset_filter(['updated', 'pk'], position))
+    objs = list(queryset.order_by('updated', 'pk')[:limit + 1])
+    return [resource.serialize(obj, fields, [], {}) for obj in objs[:limit]], len(objs) > limit
+
+
+def _add_referenced(page, until):
+    # Objects referenced by the page but changed after the end of the
+    # sweep come in their current version, so that the page can be saved
+    # as it is (and again in the next sweep). Referenced resources come
+    # earlier in ORDER, so the references of those added are followed too.
+    for name in reversed(ORDER):
+        resource = RESOURCES[name]
+        for embed, (attr, target, many) in resource.embeds.items():
+            if many or name not in page['changes']:
+                continue
+            known = {data['id'] for data in page['changes'].get(target, [])}
+            ids = {data[embed] for data in page['changes'][name]} - known - {None}
+            if not ids:
+                continue
+            related = RESOURCES[target]
+            fields = feed_fields(related)
+            objs = related.get_queryset(fields, [], {}).filter(
+                pk__in=ids, updated__gt=until).order_by('pk')
+            if objs:
+                page['changes'].setdefault(target, []).extend(
+                    related.serialize(obj, fields, [], {}) for obj in objs)
+
+
+def changes(cursor=None, limit=DEFAULT_LIMIT):
+    """Page of changes after a cursor
+
+    A dict with 'changes' (lists of serialized objects, per resource),
+    'deleted' (lists of ids, per resource), the 'cursor' of the next
+    page, and whether there are 'more' changes now.
+
+    """
+
+    until, deleted, positions = parse_cursor(cursor)
+    if until is None:
+        until = timezone.now() - datetime.timedelta(seconds=settings.EXEVADA_CHANGES_SETTLE)
+    page = {'changes': {}, 'deleted': {}}
+    remaining = limit
+    more = False
+    for name in ORDER:
+        if remaining <= 0:
+            more = True
+            break
+        objs, more = _changed(name, positions.get(name), until, remaining)
+        if objs:
+            page['changes'][name] = objs
+            positions[name] = (objs[-1]['updated'], objs[-1]['id'])
+            remaining -= len(objs)
+        if more:
+            break
+    else:
+        names = _resource_names()
+        tombstones = list(models.Tombstone.objects.filter(
+            pk__gt=deleted, deleted__lte=until).order_by('pk')[:remaining + 1])
+        more = len(tombstones) > remaining
+        for tombstone in tombstones[:remaining]:
+            page['deleted'].setdefault(names[tombstone.model], []).append(tombstone.object_id)
+            deleted = tombstone.pk
+
+    _add_referenced(page, until)
+
+    # The next sweep starts once this one is complete
+    page['cursor'] = encode_cursor([
+        until if more else None, deleted,
+        {name: [updated.isoformat(), pk] for name, (updated, pk) in positions.items()}])
+    page['more'] = more
+    return page
+
+
+def _build(resource, data):
+    """Unsaved model instance from its serialized fields"""
+    model = resource.model
+    values = {}
+    for name, value in data.items():
+        attr = resource.embeds[name][0] if name in resource.embeds else name
+        field = model._meta.get_field(attr)
+        if field.is_relation:
+            values[field.attname] = value
+        elif isinstance(field, GeometryField):
+            values[attr] = GEOSGeometry(json.dumps(value), srid=field.srid)
+        else:
+            values[attr] = field.to_python(value)
+    return model(**values)
+
+
+def _prepare(obj):
+    # Derived fields, which bulk operations do not set
+    if isinstance(obj, models.Event):
+        obj.set_enddate()
+    elif isinstance(obj, models.Season):
+        obj.set_unwrapped_end()
+
+
+def _reset_sequences(model):
+    # Rows inserted with their keys do not advance the sequences of
+    # PostgreSQL (SQLite keeps track by itself)
+    connection = connections[router.db_for_write(model)]
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+def apply(page, batch_size=500):
+    """Save a page of changes to the local database; returns the number
+    of objects saved and deleted
+
+    Objects are inserted with their original ids, or update the local
+    object with the same id. Regions are saved one by one (for their
+    simplified areas), the rest in bulk, with their tiles, search
+    documents and cached responses updated per page. The summary
+    statistics are not: they should be rebuilt once the mirror is up to
+    date.
+
+    """
+
+    now = timezone.now()
+    saved = []
+    count = 0
+    with transaction.atomic():
+        for name in ORDER:
+            resource = RESOURCES[name]
+            objs = [_build(resource, data) for data in page['changes'].get(name, [])]
+            if not objs:
+                continue
+            model = resource.model
+            count += len(objs)
+            existing = set(model.objects.filter(pk__in=[obj.pk for obj in objs]).values_list(
+                'pk', flat=True))
+            # Mirrors keep their own creation times
+            fields = [field.name for field in model._meta.concrete_fields
+                      if not field.primary_key and field.name != 'created']
+            if model is models.Region:
+                for obj in objs:
+                    if obj.pk in existing:
+                        obj.save(update_fields=fields)
+                    else:
+                        obj.save(force_insert=True)
+            else:
+                for obj in objs:
+                    _prepare(obj)
+                    obj.updated = now
+                model.objects.bulk_update([obj for obj in objs if obj.pk in existing], fields,
+                                          batch_size=batch_size)
+                bulk_insert(model, [obj for obj in objs if obj.pk not in existing],
+                            batch_size=batch_size)
+                saved.extend(objs)
+            if len(existing) < len(objs):
+                _reset_sequences(model)
+
+        # Deletions signal like any other; dependent objects first, as
+        # the cascades of the others may have removed them already
+        for name in reversed(ORDER):
+            ids = page['deleted'].get(name, [])
+            if ids:
+                count += len(ids)
+                RESOURCES[name].model.objects.filter(pk__in=ids).delete()
+
+    # Bulk operations do not signal
+    invalidate_tiles({obj.region_id for obj in saved if isinstance(obj, models.Event)})
+    search.update(models.Event.objects.filter(
+        Q(pk__in=[obj.pk for obj in saved if isinstance(obj, models.Event)]) |
+        Q(pk__in=[obj.event_id for obj in saved if isinstance(obj, models.ObsDataset)]) |
+        Q(impact__in=[obj.pk for obj in saved if isinstance(obj, models.Impact)]) |
+        Q(synthesis__in=[obj.pk for obj in saved if isinstance(obj, models.Synthesis)])
+    ).values('pk'))
+    tags = {cache.model_tag(type(obj)) for obj in saved}
+    for obj in saved:
+        tags.add(cache.object_tag(type(obj), obj.pk))
+        tags.update(related_tags(obj))
+    if tags:
+        cache.invalidate(*tags)
+    return count
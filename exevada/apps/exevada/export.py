@@ -0,0 +1,221 @@
+"""Streaming export of the events with their related data
+
+The events are read in chunks of primary keys, each chunk with its
+related objects prefetched, and written out as they are read, so the
+memory use is independent of the size of the database. Each writer
+is a generator of text (or bytes, for Parquet) chunks, suitable for a
+StreamingHttpResponse or for writing to a file.
+
+"""
+
+import csv
+import importlib.util
+import io
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from . import models
+
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'geojson': 'application/geo+json',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def iter_events(chunk_size=1000, with_area=False, queryset=None):
+    """Iterate over the events of `queryset` (default: all events),
+    with their related objects
+
+    The region areas are only loaded with `with_area`.
+
+    """
+
+    if queryset is None:
+        queryset = models.Event.objects.all()
+    obsdatasets = models.ObsDataset.objects.prefetch_related('best_fit_value', 'return_period')
+    queryset = queryset.select_related('region', 'impact', 'synthesis').prefetch_related(
+        'season', Prefetch('observational_datasets', queryset=obsdatasets), 'model_datasets')
+    if not with_area:
+        queryset = queryset.defer('region__area')
+    last = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last).order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last = chunk[-1].pk
+
+
+def _fields(obj, *names):
+    return {name: getattr(obj, name) for name in names}
+
+
+def event_record(event):
+    """Nested dict with the event data"""
+
+    record = _fields(event, 'id', 'name', 'startdate', 'duration', 'variable',
+                     'fitted_distribution', 'region_id')
+    record['region'] = event.region.name
+    record['impact'] = _fields(event.impact, 'deaths', 'affected', 'request', 'comments')
+    record['synthesis'] = _fields(event.synthesis, 'pr', 'delta_i', 'conclusions',
+                                  'contact', 'webpage', 'doi')
+    record['seasons'] = [_fields(season, 'start', 'end') for season in event.season.all()]
+    record['obs_datasets'] = [
+        dict(_fields(dataset, 'id', 'value', 'doi', 'pr', 'delta_i', 'comments'),
+             fit_parameters=[_fields(fit, 'mu', 'sigma', 'xi', 'alpha')
+                             for fit in dataset.best_fit_value.all()],
+             return_times=[_fields(rt, 'value', 'lower', 'upper')
+                           for rt in dataset.return_period.all()])
+        for dataset in event.observational_datasets.all()]
+    record['model_datasets'] = [
+        _fields(dataset, 'id', 'model_type', 'period', 'trend', 'pr', 'delta_i')
+        for dataset in event.model_datasets.all()]
+    return record
+
+
+def _dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+# Columns of the flat (CSV and Parquet) formats, with their Parquet type
+COLUMNS = [
+    ('id', 'int64'), ('name', 'string'), ('startdate', 'date32'), ('duration', 'int64'),
+    ('variable', 'string'), ('fitted_distribution', 'string'),
+    ('region_id', 'int64'), ('region', 'string'),
+    ('impact_deaths', 'float64'), ('impact_affected', 'float64'),
+    ('impact_request', 'string'), ('impact_comments', 'string'),
+    ('synthesis_pr', 'float64'), ('synthesis_delta_i', 'float64'),
+    ('synthesis_conclusions', 'string'), ('synthesis_contact', 'string'),
+    ('synthesis_webpage', 'string'), ('synthesis_doi', 'string'),
+    ('seasons', 'string'), ('obs_datasets', 'string'), ('model_datasets', 'string'),
+]
+
+
+def flat_record(event):
+    """Flat dict with the event data; the lists of related objects are
+    JSON encoded"""
+
+    record = event_record(event)
+    for name in ('impact', 'synthesis'):
+        for key, value in record.pop(name).items():
+            record[name + '_' + key] = value
+    record['impact_deaths'] = float(record['impact_deaths'])
+    record['impact_affected'] = float(record['impact_affected'])
+    for name in ('seasons', 'obs_datasets', 'model_datasets'):
+        record[name] = _dumps(record[name])
+    return record
+
+
+class _Echo:
+    """File-like object returning what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def write_csv(events):
+    writer = csv.DictWriter(_Echo(), [name for name, _ in COLUMNS])
+    yield writer.writeheader()
+    for event in events:
+        yield writer.writerow(flat_record(event))
+
+
+def write_ndjson(events):
+    for event in events:
+        yield _dumps(event_record(event)) + '\n'
+
+
+def write_geojson(events):
+    """GeoJSON feature collection, with the region areas as geometry
+
+    The events should come with their region areas.
+
+    """
+
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ''
+    for event in events:
+        yield '%s{"type": "Feature", "id": %d, "geometry": %s, "properties": %s}' % (
+            separator, event.pk, event.region.area.geojson, _dumps(event_record(event)))
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+class _ChunkSink(io.RawIOBase):
+    """Writable file-like object collecting the written data, to be
+    taken out in chunks"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def write_parquet(events, row_group_size=10000):
+    """Parquet file, one row group per `row_group_size` events
+
+    Requires the optional pyarrow package.
+
+    """
+
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([(name, getattr(pyarrow, type_)()) for name, type_ in COLUMNS])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+
+    def write(rows):
+        columns = {name: [row[name] for row in rows] for name, _ in COLUMNS}
+        writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+
+    rows = []
+    for event in events:
+        rows.append(flat_record(event))
+        if len(rows) >= row_group_size:
+            write(rows)
+            rows = []
+            yield sink.take()
+    if rows:
+        write(rows)
+    writer.close()
+    yield sink.take()
+
+
+WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'geojson': write_geojson,
+    'parquet': write_parquet,
+}
+
+
+def available(fmt):
+    """Whether a format is known and its dependencies are installed"""
+    if fmt == 'parquet':
+        return importlib.util.find_spec('pyarrow') is not None
+    return fmt in WRITERS
+
+
+def export(fmt, chunk_size=1000, queryset=None):
+    """Generator of the data chunks for exporting the events of
+    `queryset` (default: all events) in a format"""
+    return WRITERS[fmt](iter_events(chunk_size, with_area=(fmt == 'geojson'), queryset=queryset))
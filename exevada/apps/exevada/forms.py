@@ -1,5 +1,10 @@
+import math
+from django import forms
+from django.contrib.gis import forms as gis_forms
+from django.contrib.gis.geos import GEOSGeometry
 from django.forms import ModelForm
-from .models import Event, Region, ObsDataset, ModelDataset
+from . import areas
+from .models import Event, Region, ObsDataset, ModelDataset, Season
 from .widgets import AreaInput
 
 
@@ -11,10 +16,30 @@ class EventForm(ModelForm):
         exclude = []
 
 
+class AreaField(gis_forms.MultiPolygonField):
+    """Region area from an uploaded file, or from WKT, hex WKB or GeoJSON
+    text (see `areas`)"""
+
+    widget = AreaInput
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, GEOSGeometry):
+            return value
+        try:
+            if isinstance(value, str):
+                return areas.read_geometry(value)
+            return areas.read_upload(value)
+        except areas.AreaError as exc:
+            raise forms.ValidationError(str(exc), code='invalid_geom')
+
+
 class RegionForm(ModelForm):
     class Meta:
         model = Region
         exclude = []
+        field_classes = {'area': AreaField}
         widgets = {'area': AreaInput()}
 
 
@@ -28,3 +53,94 @@ class ModelDatasetForm(ModelForm):
     class Meta:
         model = ModelDataset
         exclude = []
+
+
+class BBoxField(forms.CharField):
+    """Bounding box given as "xmin,ymin,xmax,ymax", as a tuple"""
+
+    def to_python(self, value):
+        value = super().to_python(value)
+        if not value:
+            return None
+        try:
+            bbox = tuple(float(item) for item in value.split(','))
+        except ValueError:
+            raise forms.ValidationError("Bounding box values should be numbers")
+        if not all(math.isfinite(item) for item in bbox):
+            raise forms.ValidationError("Bounding box values should be finite")
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise forms.ValidationError("Bounding box should be xmin,ymin,xmax,ymax")
+        return bbox
+
+
+class SpatialSearchForm(forms.Form):
+    """Search for events by location
+
+    Either a point (`lon`, `lat`), optionally with a `radius` in km,
+    or a bounding box `bbox` given as "xmin,ymin,xmax,ymax".
+
+    """
+
+    lon = forms.FloatField(required=False, min_value=-180, max_value=180)
+    lat = forms.FloatField(required=False, min_value=-90, max_value=90)
+    radius = forms.FloatField(required=False, min_value=0, help_text="Radius in km")
+    bbox = BBoxField(required=False, help_text="xmin,ymin,xmax,ymax")
+
+    def clean(self):
+        data = super().clean()
+        has_point = data.get('lon') is not None and data.get('lat') is not None
+        if has_point == bool(data.get('bbox')):
+            raise forms.ValidationError("Give either a point (lon, lat) or a bounding box")
+        if data.get('radius') and not has_point:
+            raise forms.ValidationError("A radius requires a point")
+        return data
+
+
+class EventFilterForm(forms.Form):
+    MONTHS = [('', '---------')] + Season.MONTHS
+
+    variable = forms.CharField(required=False)
+    start = forms.DateField(required=False, help_text="Earliest starting date")
+    end = forms.DateField(required=False, help_text="Latest starting date")
+    active_from = forms.DateField(required=False, help_text="Active on or after this date")
+    active_until = forms.DateField(required=False, help_text="Active on or before this date")
+    season_start = forms.TypedChoiceField(choices=MONTHS, coerce=int, empty_value=None,
+                                          required=False, help_text="Season in these months")
+    season_end = forms.TypedChoiceField(choices=MONTHS, coerce=int, empty_value=None,
+                                        required=False, help_text="Through this month "
+                                        "(default: the starting month)")
+    region = forms.IntegerField(required=False, min_value=1, help_text="Region id")
+
+    def filter(self, queryset):
+        """Apply the (valid) filters to an Event queryset"""
+        data = self.cleaned_data if self.is_valid() else {}
+        if data.get('variable'):
+            queryset = queryset.filter(variable=data['variable'])
+        if data.get('start'):
+            queryset = queryset.filter(startdate__gte=data['start'])
+        if data.get('end'):
+            queryset = queryset.filter(startdate__lte=data['end'])
+        if data.get('active_from') or data.get('active_until'):
+            queryset = queryset.active_between(data.get('active_from'), data.get('active_until'))
+        if data.get('season_start'):
+            queryset = queryset.in_months(data['season_start'],
+                                          data.get('season_end') or data['season_start'])
+        if data.get('region'):
+            queryset = queryset.filter(region_id=data['region'])
+        return queryset
+
+
+class TextSearchForm(forms.Form):
+    q = forms.CharField(label="Search", max_length=255,
+                        help_text='Words to match, and "quoted phrases"')
+
+
+class ClusterForm(forms.Form):
+    """Map view to cluster the events for: a bounding box (default: the
+    world) and zoom level"""
+
+    bbox = BBoxField(required=False, help_text="xmin,ymin,xmax,ymax")
+    zoom = forms.IntegerField(min_value=0, max_value=24)
+
+    def clean_bbox(self):
+        return self.cleaned_data['bbox'] or (-180, -90, 180, 90)
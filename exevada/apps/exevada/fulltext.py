@@ -0,0 +1,82 @@
+"""Full-text index of the search documents (see `search`)
+
+This module does not import the models, so that migrations can use
+it: the documents are built from the events given, which may be
+historical models.
+
+"""
+
+CONFIG = 'english'
+VECTOR = ("setweight(to_tsvector('{config}', title), 'A') || "
+          "setweight(to_tsvector('{config}', body), 'B')").format(config=CONFIG)
+FTS_TABLE = 'exevada_searchdocument_fts'
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5(title, body, content='exevada_searchdocument', "
+    "content_rowid='event_id', tokenize='porter unicode61')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON exevada_searchdocument BEGIN "
+    "INSERT INTO {fts}(rowid, title, body) VALUES (new.event_id, new.title, new.body); END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON exevada_searchdocument BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, title, body) "
+    "VALUES ('delete', old.event_id, old.title, old.body); END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE ON exevada_searchdocument BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, title, body) "
+    "VALUES ('delete', old.event_id, old.title, old.body); "
+    "INSERT INTO {fts}(rowid, title, body) VALUES (new.event_id, new.title, new.body); END",
+]
+POSTGRESQL_INDEX = [
+    "CREATE INDEX exevada_searchdocument_vector ON exevada_searchdocument "
+    "USING gin (({vector}))",
+]
+
+
+def create_index(connection):
+    """Create the full-text index of the search documents, if the
+    backend has one"""
+
+    if connection.vendor == 'sqlite':
+        statements = SQLITE_INDEX
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRESQL_INDEX
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement.format(fts=FTS_TABLE, vector=VECTOR))
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("DROP TABLE IF EXISTS %s" % FTS_TABLE)
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute("DROP TRIGGER IF EXISTS %s_%s" % (FTS_TABLE, trigger))
+        elif connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS exevada_searchdocument_vector")
+
+
+def document(event):
+    """Title and body of an event, with its impact, synthesis and
+    observational datasets loaded"""
+
+    body = [event.synthesis.conclusions, event.impact.request, event.impact.comments]
+    body.extend(dataset.comments for dataset in event.observational_datasets.all())
+    return {
+        'title': '\n'.join([event.name, event.variable]),
+        'body': '\n\n'.join(text for text in body if text),
+    }
+
+
+def iter_documents(events, chunk_size=500):
+    """(event, document) pairs of an Event queryset, read in chunks"""
+
+    events = events.select_related('impact', 'synthesis').prefetch_related(
+        'observational_datasets').order_by('pk')
+    last = 0
+    while True:
+        chunk = list(events.filter(pk__gt=last)[:chunk_size])
+        if not chunk:
+            return
+        for event in chunk:
+            yield event, document(event)
+        last = chunk[-1].pk
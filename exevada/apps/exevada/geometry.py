@@ -0,0 +1,254 @@
+"""Geometry helpers shared by the models and the spatial views"""
+
+import json
+import math
+import numpy as np
+from django.contrib.gis.geos import MultiPolygon
+
+
+# Mean length of one degree of latitude, in km
+KM_PER_DEGREE = 111.32
+# Radius of the sphere with the area of the WGS84 ellipsoid, in km
+AUTHALIC_RADIUS = 6371.0072
+
+
+def expand_envelope(bbox, lat, radius):
+    """Expand an envelope by a radius given in km
+
+    The expansion in longitude is scaled with the latitude `lat`, and
+    is clamped to the full range of longitudes near the poles.
+
+    """
+
+    xmin, ymin, xmax, ymax = bbox
+    dy = radius / KM_PER_DEGREE
+    coslat = math.cos(math.radians(min(abs(lat) + dy, 90)))
+    if coslat < 1e-6:
+        xmin, xmax = -180, 180
+    else:
+        dx = dy / coslat
+        xmin, xmax = max(xmin - dx, -180), min(xmax + dx, 180)
+    return xmin, max(ymin - dy, -90), xmax, min(ymax + dy, 90)
+
+
+# Simplification tolerances (in degrees), with the highest zoom level
+# each is used for; above the last zoom level the full geometry is used
+SIMPLIFY_LEVELS = [
+    (0.1, 3),
+    (0.01, 6),
+    (0.001, 9),
+]
+
+
+def level_for_zoom(zoom):
+    """Index into `SIMPLIFY_LEVELS` for a map zoom level
+
+    Returns None when the full resolution geometry should be used.
+
+    """
+
+    if zoom is None:
+        return None
+    for level, (tolerance, maxzoom) in enumerate(SIMPLIFY_LEVELS):
+        if zoom <= maxzoom:
+            return level
+    return None
+
+
+def _ring_area(coords):
+    # Chamberlain and Duquette (2007), as used by d3-geo and Turf
+    lon, lat = np.radians(np.asarray(coords)).T
+    return abs(np.sum((lon[1:] - lon[:-1]) * (2 + np.sin(lat[:-1]) + np.sin(lat[1:])))) / 2
+
+
+def geodesic_area(geom):
+    """Area of a (multi)polygon in lon/lat degrees, in km², on the sphere"""
+    polygons = geom if geom.geom_type == 'MultiPolygon' else [geom]
+    area = 0
+    for polygon in polygons:
+        rings = [_ring_area(ring.coords) for ring in polygon]
+        area += rings[0] - sum(rings[1:])
+    return float(area * AUTHALIC_RADIUS ** 2)
+
+
+def simplify(geom, tolerance):
+    """Topology-preserving simplification of a (multi)polygon
+
+    The result is always a MultiPolygon. Geometries that would
+    collapse at this tolerance are returned unchanged.
+
+    """
+
+    simplified = geom.simplify(tolerance, preserve_topology=True)
+    if simplified.empty:
+        return geom
+    if simplified.geom_type == 'Polygon':
+        simplified = MultiPolygon(simplified, srid=geom.srid)
+    return simplified
+
+
+def feature_collection(rows):
+    """GeoJSON FeatureCollection text from (geometry, properties) pairs
+
+    The geometries are written with their own GeoJSON serialization,
+    avoiding a round trip through Python objects.
+
+    """
+
+    features = ('{"type": "Feature", "geometry": %s, "properties": %s}'
+                % (geom.geojson, json.dumps(properties))
+                for geom, properties in rows)
+    return '{"type": "FeatureCollection", "features": [%s]}' % ', '.join(features)
+
+
+def svg_path(geom, precision=4):
+    """SVG path data of a (multi)polygon, with the y axis flipped
+
+    Use with fill-rule="evenodd" to leave the holes unfilled.
+
+    """
+
+    polygons = geom if geom.geom_type == 'MultiPolygon' else [geom]
+    return ''.join(
+        'M%sZ' % ' '.join('%.*f,%.*f' % (precision, x, precision, -y) for x, y in ring.coords)
+        for polygon in polygons for ring in polygon)
+
+
+# Tiny Well-Known Binary (TWKB) geometry types
+TWKB_MULTIPOLYGON = 6
+TWKB_COLLECTION = 7
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _varints(values):
+    """Unsigned LEB128 encoding of an array of unsigned integers"""
+    remaining = np.asarray(values, dtype=np.uint64)
+    columns, masks = [], []
+    valid = np.ones(len(remaining), dtype=bool)
+    while valid.any():
+        low = (remaining & np.uint64(0x7f)).astype(np.uint8)
+        remaining = remaining >> np.uint64(7)
+        more = remaining != 0
+        columns.append(low | (more.astype(np.uint8) << 7))
+        masks.append(valid)
+        valid = valid & more
+    if not columns:
+        return b''
+    return np.stack(columns, axis=1)[np.stack(masks, axis=1)].tobytes()
+
+
+def _twkb_header(geom_type, precision, metadata=0):
+    return bytes([(int(_zigzag([precision])[0]) << 4) | geom_type, metadata])
+
+
+def twkb(geom, precision=5):
+    """TWKB of a (multi)polygon in lon/lat, with `precision` decimals
+
+    Coordinates are rounded and delta encoded as variable length
+    integers, which typically makes the result a fraction of the WKB.
+
+    """
+
+    polygons = geom if geom.geom_type == 'MultiPolygon' else [geom]
+    if geom.empty:
+        return _twkb_header(TWKB_MULTIPOLYGON, precision, 0x10)
+    scale = 10 ** precision
+    parts = [_twkb_header(TWKB_MULTIPOLYGON, precision), _varints([len(polygons)])]
+    last = np.zeros(2, dtype=np.int64)
+    for polygon in polygons:
+        parts.append(_varints([len(polygon)]))
+        for ring in polygon:
+            points = np.round(np.asarray(ring.coords) * scale).astype(np.int64)
+            deltas = np.diff(points, axis=0, prepend=last[np.newaxis])
+            last = points[-1]
+            parts.append(_varints([len(points)]))
+            parts.append(_varints(_zigzag(deltas.ravel())))
+    return b''.join(parts)
+
+
+def twkb_collection(items, precision=5):
+    """TWKB geometry collection of (id, TWKB) pairs, with the ids"""
+    items = list(items)
+    return b''.join([_twkb_header(TWKB_COLLECTION, precision, 0x04),
+                     _varints([len(items)]),
+                     _varints(_zigzag([pk for pk, data in items]))] +
+                    [data for pk, data in items])
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+
+def geohash(lon, lat, precision=GEOHASH_PRECISION):
+    """Geohash of a point: the cells of a prefix contain those of all
+    longer geohashes starting with it"""
+
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    chars = []
+    value = 0
+    for bit in range(5 * precision):
+        # Even bits split the longitude, odd ones the latitude
+        low_high, coordinate = ranges[bit % 2], (lon, lat)[bit % 2]
+        middle = (low_high[0] + low_high[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            low_high[0] = middle
+        else:
+            low_high[1] = middle
+        if bit % 5 == 4:
+            chars.append(GEOHASH_ALPHABET[value])
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_size(precision):
+    """Width and height in degrees of the geohash cells of a precision"""
+    return 360 / 2 ** ((5 * precision + 1) // 2), 180 / 2 ** (5 * precision // 2)
+
+
+def geohash_range(cell):
+    """(lowest, highest) geohashes in a cell, as bounds for `>=` and `<`
+    comparisons; the upper bound is None for the last cell"""
+    prefix = cell.rstrip(GEOHASH_ALPHABET[-1])
+    if not prefix:
+        return cell, None
+    following = GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+    return cell, prefix[:-1] + following
+
+
+def geohash_cover(bbox, max_cells=32):
+    """Geohashes of the cells covering a bounding box, of the highest
+    precision that needs at most `max_cells` cells; [''] (the whole
+    world) when even one character needs more"""
+
+    xmin, ymin, xmax, ymax = bbox
+    xmin, xmax = max(xmin, -180), min(xmax, 180)
+    ymin, ymax = max(ymin, -90), min(ymax, 90)
+    cover = ['']
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        width, height = geohash_size(precision)
+        columns, rows = round(360 / width), round(180 / height)
+        first_column = min(int((xmin + 180) // width), columns - 1)
+        last_column = min(int((xmax + 180) // width), columns - 1)
+        first_row = min(int((ymin + 90) // height), rows - 1)
+        last_row = min(int((ymax + 90) // height), rows - 1)
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > max_cells:
+            break
+        cover = [geohash(-180 + (column + 0.5) * width, -90 + (row + 0.5) * height, precision)
+                 for column in range(first_column, last_column + 1)
+                 for row in range(first_row, last_row + 1)]
+    return cover
+
+
+def cluster_precision(zoom):
+    """Geohash precision for clusters at a map zoom level: cells at most
+    a quarter of a (256 pixel) tile wide"""
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        if geohash_size(precision)[0] <= 90 / 2 ** zoom:
+            return precision
+    return GEOHASH_PRECISION
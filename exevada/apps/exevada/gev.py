@@ -0,0 +1,120 @@
+"""Return periods, probability ratios and intensity changes from
+(shifted) GEV fits
+
+The fit parameters are taken to describe the present climate: mu and
+sigma are the location and scale at the present global mean
+temperature, xi is the shape, and alpha the dependence on the global
+mean temperature. The past climate is `delta_t` degrees cooler. The
+distribution either shifts with temperature (mu' = mu + alpha dT, as
+for temperature extremes), or scales (mu' = mu exp(alpha dT / mu), and
+sigma likewise, as for precipitation extremes); events whose fitted
+distribution mentions scaling use the latter.
+
+All functions work on NumPy arrays, so that all datasets (and
+thresholds) are evaluated in one go.
+
+"""
+
+import numpy as np
+from django.conf import settings
+from . import models
+
+
+def cdf(x, mu, sigma, xi):
+    """GEV cumulative distribution function"""
+
+    x, mu, sigma, xi = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (x, mu, sigma, xi)))
+    z = (x - mu) / sigma
+    gumbel = np.abs(xi) < 1e-10
+    safe_xi = np.where(gumbel, 1, xi)
+    t = 1 + safe_xi * z
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        general = np.exp(-np.power(np.maximum(t, 0), -1 / safe_xi))
+    # Outside the support, the CDF is 0 (below a lower bound, xi > 0) or
+    # 1 (above an upper bound, xi < 0)
+    general = np.where(t > 0, general, np.where(safe_xi > 0, 0.0, 1.0))
+    with np.errstate(over='ignore'):
+        return np.where(gumbel, np.exp(-np.exp(-z)), general)
+
+
+def quantile(p, mu, sigma, xi):
+    """Inverse of the GEV CDF, for non-exceedance probability `p`"""
+
+    p, mu, sigma, xi = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (p, mu, sigma, xi)))
+    y = -np.log(p)
+    gumbel = np.abs(xi) < 1e-10
+    safe_xi = np.where(gumbel, 1, xi)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        general = mu + sigma * (np.power(y, -safe_xi) - 1) / safe_xi
+        return np.where(gumbel, mu - sigma * np.log(y), general)
+
+
+def climate(mu, sigma, alpha, dt, scale):
+    """Location and scale `dt` degrees from the fitted climate"""
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        factor = np.exp(alpha * dt / mu)
+    return (np.where(scale, mu * factor, mu + alpha * dt),
+            np.where(scale, sigma * factor, sigma))
+
+
+def evaluate(threshold, mu, sigma, xi, alpha, scale, delta_t=None):
+    """Return period, probability ratio and intensity change of events
+    reaching `threshold`
+
+    Arguments are broadcast against each other; `scale` is a boolean
+    (array) selecting a scaling instead of a shifting fit. The
+    intensity change is absolute for shifting fits, and in percent for
+    scaling fits.
+
+    Returns a dict of arrays.
+
+    """
+
+    if delta_t is None:
+        delta_t = settings.EXEVADA_GEV_DELTA_T
+    threshold, mu, sigma, xi, alpha, scale = np.broadcast_arrays(
+        *(np.asarray(a) for a in (threshold, mu, sigma, xi, alpha, scale)))
+    scale = scale.astype(bool)
+
+    p1 = 1 - cdf(threshold, mu, sigma, xi)
+    mu0, sigma0 = climate(mu, sigma, alpha, -delta_t, scale)
+    p0 = 1 - cdf(threshold, mu0, sigma0, xi)
+    # Intensity of an event as rare in the past climate
+    past = quantile(1 - p1, mu0, sigma0, xi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'return_period': 1 / p1,
+            'probability': p1,
+            'pr': p1 / p0,
+            'delta_i': np.where(scale, (threshold / past - 1) * 100, threshold - past),
+        }
+
+
+def load(obsdatasets=None):
+    """Fit parameters for observational datasets, as arrays
+
+    Uses the most recent fit of each dataset. Returns a dict with the
+    dataset ids, values (the event thresholds), fit parameters and
+    scaling flags.
+
+    """
+
+    fits = models.FitParameters.objects.order_by('obsdataset_id', 'pk')
+    if obsdatasets is not None:
+        fits = fits.filter(obsdataset__in=obsdatasets)
+    rows = {}
+    for row in fits.values_list('obsdataset_id', 'obsdataset__value', 'mu', 'sigma', 'xi', 'alpha',
+                                'obsdataset__event__fitted_distribution').iterator():
+        rows[row[0]] = row
+    rows = list(rows.values())
+    columns = list(zip(*rows)) if rows else [()] * 7
+    return {
+        'obsdataset': np.array(columns[0], dtype=int),
+        'value': np.array(columns[1], dtype=float),
+        'mu': np.array(columns[2], dtype=float),
+        'sigma': np.array(columns[3], dtype=float),
+        'xi': np.array(columns[4], dtype=float),
+        'alpha': np.array(columns[5], dtype=float),
+        'scale': np.array(['scal' in (name or '').lower() for name in columns[6]], dtype=bool),
+    }
@@ -0,0 +1,269 @@
+"""Background jobs, queued in the database
+
+Work too slow for a request, such as simplifying a new region area,
+refreshing statistics or recomputing fits, is queued as a `Job` and run
+by the worker processes of `manage.py run_workers`; there is no broker
+besides the database. Jobs
+
+- are deduplicated: queuing the same work (task and arguments) as a job
+  that is still queued returns that job, with the higher priority
+- run by priority (highest first), then in the order they were queued
+- are retried after a failure, with a delay doubling at every attempt
+  (from `EXEVADA_JOBS_RETRY_DELAY` seconds), up to their `max_attempts`
+- report their progress, which the admin shows
+- are queued again when their worker has given no sign of life for
+  `EXEVADA_JOBS_TIMEOUT` seconds
+
+With `EXEVADA_JOBS_EAGER` (development), jobs run right away instead, in
+the process queuing them.
+
+"""
+
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from . import bootstrap, cache, models, search, summaries, tiles
+
+
+logger = logging.getLogger(__name__)
+
+Job = models.Job
+
+# Task name: (function, default priority)
+TASKS = {}
+
+
+def task(name, priority=0):
+    """Register a function as the task `name`
+
+    The function is called with a `Progress` and the job arguments
+    (which should be JSON serializable).
+
+    """
+
+    def register(function):
+        TASKS[name] = (function, priority)
+        return function
+    return register
+
+
+class Progress:
+    """Progress reporting of a job"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def report(self, fraction, message=''):
+        self.job.progress, self.job.message = fraction, message
+        if self.job.pk:
+            Job.objects.filter(pk=self.job.pk).update(
+                progress=fraction, message=message, heartbeat=timezone.now())
+
+
+def _key(arguments):
+    return hashlib.md5(json.dumps(arguments, sort_keys=True).encode()).hexdigest()
+
+
+def enqueue(name, *arguments, priority=None, delay=0, max_attempts=3):
+    """Queue a job for the task `name`; returns the job
+
+    If the same work is queued already, that job is returned instead.
+    Inside a transaction, the job only becomes visible to the workers
+    with the commit, like the data it works on.
+
+    """
+
+    function, default_priority = TASKS[name]
+    if priority is None:
+        priority = default_priority
+    # As the workers will see them
+    arguments = json.loads(json.dumps(list(arguments)))
+    job = Job(task=name, arguments=json.dumps(arguments), key=_key(arguments),
+              priority=priority, max_attempts=max_attempts,
+              run_after=timezone.now() + datetime.timedelta(seconds=delay))
+    if settings.EXEVADA_JOBS_EAGER:
+        function(Progress(job), *arguments)
+        return job
+
+    while True:
+        try:
+            with transaction.atomic():
+                job.save()
+            return job
+        except IntegrityError:
+            queued = Job.objects.filter(task=name, key=job.key, status=Job.QUEUED).first()
+            # Unless a worker took it in the meantime
+            if queued is not None:
+                if queued.priority < priority:
+                    Job.objects.filter(pk=queued.pk).update(priority=priority)
+                return queued
+
+
+def claim(worker):
+    """Take the next job due, marking it as running; returns None if there
+    is none"""
+
+    now = timezone.now()
+    candidates = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by(
+        '-priority', 'run_after', 'pk').values_list('pk', flat=True)
+    # Another worker may take a candidate first
+    for pk in candidates[:10]:
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, worker=worker, started=now, heartbeat=now, finished=None,
+                attempts=F('attempts') + 1, progress=0, message=''):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def _requeue(job, **fields):
+    """Set a job back to queued, or to failed if the same work is queued
+    already (which does the retry)"""
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=job.pk).update(status=Job.QUEUED, worker='', **fields)
+    except IntegrityError:
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, worker='',
+                                             finished=timezone.now(), **fields)
+
+
+def run(job):
+    """Run a claimed job and record the outcome; returns whether it
+    succeeded"""
+
+    function = TASKS[job.task][0]
+    try:
+        function(Progress(job), *json.loads(job.arguments))
+    except Exception:
+        logger.exception("Job %d (%s) failed", job.pk, job.task)
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = settings.EXEVADA_JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            _requeue(job, message=error,
+                     run_after=timezone.now() + datetime.timedelta(seconds=delay))
+        else:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, message=error,
+                                                 finished=timezone.now())
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, progress=1,
+                                         finished=timezone.now())
+    return True
+
+
+def requeue_stale():
+    """Queue the jobs of workers that stopped responding again (or fail
+    them, after their last attempt); returns their number"""
+
+    limit = timezone.now() - datetime.timedelta(seconds=settings.EXEVADA_JOBS_TIMEOUT)
+    stale = list(Job.objects.filter(status=Job.RUNNING, heartbeat__lt=limit))
+    for job in stale:
+        message = "Worker %s stopped responding" % job.worker
+        if job.attempts < job.max_attempts:
+            _requeue(job, message=message)
+        else:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, message=message,
+                                                 finished=timezone.now())
+    return len(stale)
+
+
+@contextmanager
+def heartbeat(job):
+    """Keep the heartbeat of a running job, from another thread, so that
+    tasks which do not report progress are not taken for stale"""
+
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.EXEVADA_JOBS_TIMEOUT / 4):
+                Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                    heartbeat=timezone.now())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def work(stop, poll=1, burst=False):
+    """Run jobs until the `stop` event is set (or, in `burst` mode, until
+    no job is due); returns the number of jobs run"""
+
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    count = 0
+    while not stop.is_set():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll)
+            continue
+        with heartbeat(job):
+            run(job)
+        count += 1
+    return count
+
+
+@task('simplify-region', priority=10)
+def simplify_region(progress, region_id):
+    region = models.Region.objects.with_area().filter(pk=region_id).first()
+    if region is None:
+        return
+    region.update_simplified()
+    # Tiles and responses made before use the full area
+    tiles.invalidate((region.xmin, region.ymin, region.xmax, region.ymax))
+    cache.invalidate(cache.model_tag(models.Region), cache.object_tag(models.Region, region_id))
+
+
+@task('refresh-statistics', priority=5)
+def refresh_statistics(progress, groups):
+    summaries.refresh({tuple(group) for group in groups})
+
+
+@task('refresh-distributions', priority=5)
+def refresh_distributions(progress, groups):
+    summaries.refresh_distributions({tuple(group) for group in groups})
+
+
+@task('rebuild-statistics')
+def rebuild_statistics(progress):
+    progress.report(1, "Computed %d statistics" % summaries.rebuild())
+
+
+@task('rebuild-search-index')
+def rebuild_search_index(progress):
+    progress.report(1, "Indexed %d events" % search.rebuild())
+
+
+@task('compute-return-times')
+def compute_return_times(progress, event_ids=None):
+    output = io.StringIO()
+    call_command('compute_return_times', events=event_ids, stdout=output)
+    progress.report(1, output.getvalue().strip())
+
+
+@task('bootstrap-return-times')
+def bootstrap_return_times(progress, event_ids=None):
+    obsdatasets = None
+    if event_ids:
+        obsdatasets = models.ObsDataset.objects.filter(event__in=event_ids)
+    # The workers are the parallelism
+    updated, skipped = bootstrap.compute(obsdatasets, workers=1, progress=progress.report)
+    progress.report(1, "Updated %d return times; skipped %d datasets" % (updated, skipped))
@@ -0,0 +1,109 @@
+"""Benchmark the views, admin pages, spatial lookups and imports on
+synthetic data
+
+Runs on a fresh test database, with response caching disabled (unless
+--cached is given). Results are printed, and can be stored as JSON
+and compared with an earlier run: the command fails if any case
+regressed.
+
+"""
+
+import io
+import json
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from ... import benchmarks
+
+
+SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+def count(value):
+    """Number, with an optional k or m suffix (e.g. 100k)"""
+    try:
+        if value[-1:].lower() in SUFFIXES:
+            return int(float(value[:-1]) * SUFFIXES[value[-1].lower()])
+        return int(value)
+    except ValueError:
+        raise ValueError("Not a count: %r" % value)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the views, admin pages, spatial lookups and imports on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=count, nargs='+', default=[1000],
+                            help="Numbers of events to benchmark at, e.g. 1k 100k 1m")
+        parser.add_argument('--regions', type=int, default=100)
+        parser.add_argument('--vertices', type=int, default=1000,
+                            help="Typical number of vertices per region")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Number of timed runs per case")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cached', action='store_true',
+                            help="Use the configured response cache")
+        parser.add_argument('-o', '--output', help="Store the results as JSON")
+        parser.add_argument('--compare', metavar='PATH',
+                            help="Compare with stored results, failing on regressions")
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help="Slowdown of the median counting as a regression")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as fh:
+                baseline = json.load(fh)
+        verbosity = options['verbosity']
+
+        tile_dir = tempfile.mkdtemp(prefix='exevada-tiles-')
+        overrides = {'EXEVADA_TILE_CACHE_DIR': tile_dir, 'DEBUG': False}
+        if not options['cached']:
+            overrides['CACHES'] = {
+                'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        setup_test_environment()
+        old_config = setup_databases(verbosity=max(verbosity - 1, 0), interactive=False)
+        try:
+            with override_settings(**overrides):
+                results = benchmarks.run(
+                    options['events'], regions=options['regions'], vertices=options['vertices'],
+                    repeat=options['repeat'], seed=options['seed'], stdout=io.StringIO(),
+                    progress=self.stdout.write if verbosity >= 2 else None)
+        finally:
+            teardown_databases(old_config, verbosity=max(verbosity - 1, 0))
+            teardown_test_environment()
+            shutil.rmtree(tile_dir, ignore_errors=True)
+        results['meta']['cached'] = options['cached']
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+        if baseline is not None:
+            self.compare(results, baseline, options['threshold'])
+
+    def report(self, results):
+        for scale, result in results['scales'].items():
+            imported = result['import']
+            self.stdout.write("\n%s events (imported %d in %.1f s, %.0f events/s)" % (
+                scale, imported['events'], imported['seconds'],
+                imported['events_per_second'] or 0))
+            self.stdout.write("%-28s %9s %9s %9s %7s %6s" % (
+                'case', 'p50 ms', 'p90 ms', 'p99 ms', 'queries', 'status'))
+            for name, case in result['cases'].items():
+                self.stdout.write("%-28s %9.1f %9.1f %9.1f %7d %6s" % (
+                    name, case['p50'], case['p90'], case['p99'], case['queries'],
+                    case['status']))
+
+    def compare(self, results, baseline, threshold):
+        rows = benchmarks.compare(results, baseline, threshold)
+        self.stdout.write("\n%-10s %-28s %10s %10s %7s" % ('events', 'case', 'before ms',
+                                                           'after ms', 'ratio'))
+        for scale, name, before, after, ratio, regression in rows:
+            self.stdout.write("%-10s %-28s %10.1f %10.1f %7.2f%s" % (
+                scale, name, before, after, ratio, '  REGRESSION' if regression else ''))
+        regressions = sum(row[-1] for row in rows)
+        if regressions:
+            raise CommandError("%d regressions" % regressions)
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from ... import bootstrap, models
+
+
+class Command(BaseCommand):
+    help = "Recompute the return time bounds with a parametric bootstrap of the fits"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events',
+                            help="Only the datasets of this event (can be repeated)")
+        parser.add_argument('--samples', type=int, default=1000,
+                            help="Number of bootstrap samples per dataset")
+        parser.add_argument('--sample-size', type=int, default=50,
+                            help="Number of values (years) per sample")
+        parser.add_argument('--level', type=float, default=0.95, help="Confidence level")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int,
+                            help="Number of processes (default: number of CPUs)")
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help="Number of datasets per task")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        obsdatasets = None
+        if options['events']:
+            obsdatasets = models.ObsDataset.objects.filter(event__in=options['events'])
+        start = time.monotonic()
+        updated, skipped = bootstrap.compute(
+            obsdatasets, workers=options['workers'], chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'], samples=options['samples'],
+            size=options['sample_size'], level=options['level'], seed=options['seed'])
+        self.stdout.write("Updated %d return times in %.1f s; skipped %d datasets" % (
+            updated, time.monotonic() - start, skipped))
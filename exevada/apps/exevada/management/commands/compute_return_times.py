@@ -0,0 +1,68 @@
+"""(Re)compute the return times of the observational datasets from
+their fit parameters
+
+The return period at the dataset value is stored as the best estimate
+of the first return time of each dataset; datasets without a return
+time get one, with the bounds set to the estimate. Datasets whose
+value is outside the support of the fitted distribution are skipped.
+The bounds of the updated datasets are then recomputed by the
+bootstrap-return-times job (see `bootstrap`).
+
+"""
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from ... import cache, gev, jobs, models
+from ...bulk import bulk_insert
+
+
+class Command(BaseCommand):
+    help = "Compute the return times of the observational datasets from their fit parameters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events',
+                            help="Only the datasets of this event (can be repeated)")
+        parser.add_argument('--delta-t', type=float,
+                            help="Global mean temperature difference with the past climate")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        obsdatasets = None
+        if options['events']:
+            obsdatasets = models.ObsDataset.objects.filter(event__in=options['events'])
+        fits = gev.load(obsdatasets)
+        results = gev.evaluate(fits['value'], fits['mu'], fits['sigma'], fits['xi'],
+                               fits['alpha'], fits['scale'], delta_t=options['delta_t'])
+        finite = np.isfinite(results['return_period'])
+        periods = dict(zip(fits['obsdataset'][finite].tolist(),
+                           results['return_period'][finite].tolist()))
+
+        returntimes = models.ReturnTime.objects.order_by('obsdataset_id', 'pk')
+        if obsdatasets is not None:
+            returntimes = returntimes.filter(obsdataset__in=obsdatasets)
+        with transaction.atomic():
+            existing = {}
+            for returntime in returntimes.iterator():
+                if returntime.obsdataset_id in periods:
+                    existing.setdefault(returntime.obsdataset_id, returntime)
+            now = timezone.now()
+            for obsdataset, returntime in existing.items():
+                returntime.value = periods[obsdataset]
+                returntime.updated = now
+            models.ReturnTime.objects.bulk_update(
+                existing.values(), ['value', 'updated'], batch_size=options['batch_size'])
+            bulk_insert(models.ReturnTime, (
+                models.ReturnTime(obsdataset_id=obsdataset, value=value, lower=value, upper=value)
+                for obsdataset, value in periods.items() if obsdataset not in existing),
+                batch_size=options['batch_size'])
+
+        # Bulk updates do not signal; the pages showing return times
+        # depend on their model tag
+        cache.invalidate(cache.model_tag(models.ReturnTime))
+        # The bounds of the new values
+        if periods:
+            jobs.enqueue('bootstrap-return-times', options['events'])
+        self.stdout.write("Updated %d and created %d return times; skipped %d datasets" % (
+            len(existing), len(periods) - len(existing), (~finite).sum()))
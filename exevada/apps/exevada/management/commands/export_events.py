@@ -0,0 +1,30 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from ... import export
+
+
+class Command(BaseCommand):
+    help = "Export all events, with their related data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--output', '-o', default='-',
+                            help="Output file, or '-' for standard output")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of events read from the database at a time")
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        if not export.available(fmt):
+            raise CommandError("The %s format requires the pyarrow package" % fmt)
+        binary = fmt == 'parquet'
+        if options['output'] == '-':
+            fh = sys.stdout.buffer if binary else sys.stdout
+        else:
+            fh = open(options['output'], 'wb' if binary else 'w', newline='' if fmt == 'csv' else None)
+        try:
+            for chunk in export.export(fmt, options['chunk_size']):
+                fh.write(chunk)
+        finally:
+            if options['output'] != '-':
+                fh.close()
@@ -0,0 +1,72 @@
+"""Generate synthetic regions and events
+
+Regions are saved directly; events are written as JSON lines, and
+loaded with `import_events` unless only an output file is asked for.
+
+"""
+
+import json
+import os
+import tempfile
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from ... import models, synthetic
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic regions and events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=100)
+        parser.add_argument('--vertices', type=int, default=1000,
+                            help="Typical number of vertices per region")
+        parser.add_argument('--events', type=int, default=1000)
+        parser.add_argument('--obs-datasets', type=int, default=2,
+                            help="Average number of observational datasets per event")
+        parser.add_argument('--model-datasets', type=int, default=2,
+                            help="Average number of model datasets per event")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('-o', '--output',
+                            help="Only write the events to this file, as JSON lines, "
+                            "for existing regions")
+
+    def handle(self, *args, **options):
+        if options['output']:
+            names = list(models.Region.objects.values_list('name', flat=True))
+        else:
+            names = self.create_regions(options)
+        if not names:
+            self.stderr.write("No regions to generate events in")
+            return
+        events = synthetic.iter_events(options['events'], names, seed=options['seed'],
+                                       obsdatasets=options['obs_datasets'],
+                                       modeldatasets=options['model_datasets'])
+        if options['output']:
+            self.write(events, options['output'])
+            return
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.write(events, path)
+            call_command('import_events', path, batch_size=options['batch_size'],
+                         strict=True, verbosity=options['verbosity'], stdout=self.stdout)
+        finally:
+            os.remove(path)
+
+    def create_regions(self, options):
+        start = time.perf_counter()
+        names = []
+        for name, area in synthetic.iter_regions(options['regions'], options['vertices'],
+                                                 seed=options['seed']):
+            models.Region.objects.update_or_create(name=name, defaults={'area': area})
+            names.append(name)
+        self.stdout.write("Created %d regions in %.1f s" % (
+            len(names), time.perf_counter() - start))
+        return names
+
+    def write(self, events, path):
+        with open(path, 'w') as fh:
+            for event in events:
+                fh.write(json.dumps(event) + '\n')
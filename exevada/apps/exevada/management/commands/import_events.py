@@ -0,0 +1,292 @@
+"""Bulk import of events and their related data
+
+Input is JSON (a list of events, or one event per line), or CSV. A
+JSON event looks like
+
+    {"name": "...", "region": "<region name>", "startdate": "2019-07-24",
+     "duration": 3, "variable": "...", "fitted_distribution": "...",
+     "impact": {"deaths": ..., "affected": ..., "request": "...", "comments": "..."},
+     "synthesis": {"pr": ..., "delta_i": ..., "conclusions": "...",
+                   "contact": "...", "webpage": "...", "doi": "..."},
+     "seasons": [{"start": 6, "end": 8}],
+     "obs_datasets": [{"value": ..., "doi": "...", "pr": ..., "delta_i": ...,
+                       "comments": "...",
+                       "fit_parameters": [{"mu": ..., "sigma": ..., "xi": ..., "alpha": ...}],
+                       "return_times": [{"value": ..., "lower": ..., "upper": ...}]}],
+     "model_datasets": [{"model_type": "...", "period": "...", "trend": "...",
+                         "pr": ..., "delta_i": ...}]}
+
+CSV rows hold the event fields, the impact and synthesis fields
+prefixed with "impact_" and "synthesis_", and optionally a single
+season as "season_start" and "season_end".
+
+Regions are referred to by name, and should already exist.
+
+"""
+
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ... import cache, models, search, summaries
+from ...bulk import bulk_insert
+from ...signals import invalidate_tiles
+
+
+def iter_json(fh, chunk_size=1 << 16):
+    """Iterate over the objects in a JSON list, or in JSON lines
+
+    Only a small part of the input is held in memory at any time.
+
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = fh.read(chunk_size)
+    pos = len(buffer) - len(buffer.lstrip())
+    if not buffer[pos:pos + 1] == '[':
+        # JSON lines
+        lines = itertools.chain(io.StringIO(buffer + fh.readline()), fh)
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as exc:
+                raise CommandError("Invalid JSON on line %d: %s" % (
+                    number, getattr(exc, 'msg', exc)))
+            yield obj
+        return
+
+    pos += 1
+    offset = 0
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        end = None
+        if pos < len(buffer):
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                # Only an object cut off by the end of the buffer may be
+                # completed by reading on
+                if eof or not _truncated(exc, buffer):
+                    raise CommandError("Invalid JSON at character %d: %s" % (
+                        offset + exc.pos, exc.msg))
+        # A number at the end of the buffer may go on (after "1.", "1e+")
+        if end is not None and (len(buffer) - end > 2 or eof):
+            pos = end
+            yield obj
+            continue
+        if eof:
+            raise CommandError("Truncated JSON input")
+        data = fh.read(chunk_size)
+        eof = not data
+        offset += pos
+        buffer = buffer[pos:] + data
+        pos = 0
+
+
+def _truncated(exc, buffer):
+    """Whether a JSON decoding error may be due to the end of the
+    buffer: within a string, or within a literal or escape (of at most
+    five characters)"""
+    return exc.msg.startswith('Unterminated string') or len(buffer) - exc.pos <= 5
+
+
+def iter_csv(fh):
+    """Iterate over CSV rows, as nested event dicts"""
+
+    for row in csv.DictReader(fh):
+        record = {'impact': {}, 'synthesis': {}}
+        season = {}
+        for key, value in row.items():
+            prefix, _, field = key.partition('_')
+            if prefix in ('impact', 'synthesis') and field:
+                record[prefix][field] = value
+            elif prefix == 'season' and field in ('start', 'end'):
+                season[field] = value
+            else:
+                record[key] = value
+        if any(season.values()):
+            record['seasons'] = [season]
+        yield record
+
+
+def build(model, data, exclude):
+    """Create and validate (but do not save) a model instance"""
+    if not isinstance(data, dict):
+        raise ValidationError("%s should be an object" % model._meta.verbose_name)
+    fields = {field.name for field in model._meta.concrete_fields
+              if not field.is_relation and not field.primary_key}
+    obj = model(**{key: value for key, value in data.items() if key in fields})
+    obj.full_clean(exclude=exclude, validate_unique=False)
+    return obj
+
+
+class Batch:
+    """Validated objects of a number of events, to be inserted together"""
+
+    def __init__(self):
+        self.events = []
+        self.seasons = []
+        self.obsdatasets = []
+        self.fits = []
+        self.returntimes = []
+        self.modeldatasets = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, record, regions):
+        """Validate a record, and add its objects to the batch"""
+
+        event = build(models.Event, record, exclude=['region', 'impact', 'synthesis'])
+        event.set_enddate()
+        try:
+            event.region_id = regions[record.get('region')]
+        except KeyError:
+            raise ValidationError("Unknown region %r" % record.get('region'))
+        event.impact = build(models.Impact, record.get('impact'), exclude=[])
+        event.synthesis = build(models.Synthesis, record.get('synthesis'), exclude=[])
+
+        seasons = []
+        for data in record.get('seasons', []):
+            season = build(models.Season, data, exclude=['event'])
+            season.set_unwrapped_end()
+            seasons.append((event, season))
+        modeldatasets = [(event, build(models.ModelDataset, data, exclude=['event']))
+                         for data in record.get('model_datasets', [])]
+        obsdatasets, fits, returntimes = [], [], []
+        for data in record.get('obs_datasets', []):
+            dataset = build(models.ObsDataset, data, exclude=['event'])
+            obsdatasets.append((event, dataset))
+            fits.extend((dataset, build(models.FitParameters, fit, exclude=['obsdataset']))
+                        for fit in data.get('fit_parameters', []))
+            returntimes.extend((dataset, build(models.ReturnTime, rt, exclude=['obsdataset']))
+                               for rt in data.get('return_times', []))
+
+        self.events.append(event)
+        self.seasons.extend(seasons)
+        self.modeldatasets.extend(modeldatasets)
+        self.obsdatasets.extend(obsdatasets)
+        self.fits.extend(fits)
+        self.returntimes.extend(returntimes)
+
+    @staticmethod
+    def _link(pairs, attname):
+        objs = []
+        for parent, obj in pairs:
+            setattr(obj, attname, parent.pk)
+            objs.append(obj)
+        return objs
+
+    def save(self, batch_size):
+        """Insert all objects; returns the number of rows inserted"""
+
+        bulk_insert(models.Impact, [event.impact for event in self.events], batch_size)
+        bulk_insert(models.Synthesis, [event.synthesis for event in self.events], batch_size)
+        for event in self.events:
+            event.impact_id = event.impact.pk
+            event.synthesis_id = event.synthesis.pk
+        bulk_insert(models.Event, self.events, batch_size)
+        bulk_insert(models.Season, self._link(self.seasons, 'event_id'), batch_size)
+        bulk_insert(models.ModelDataset, self._link(self.modeldatasets, 'event_id'), batch_size)
+        bulk_insert(models.ObsDataset, self._link(self.obsdatasets, 'event_id'), batch_size)
+        bulk_insert(models.FitParameters, self._link(self.fits, 'obsdataset_id'), batch_size)
+        bulk_insert(models.ReturnTime, self._link(self.returntimes, 'obsdataset_id'), batch_size)
+        return (3 * len(self.events) + len(self.seasons) + len(self.modeldatasets) +
+                len(self.obsdatasets) + len(self.fits) + len(self.returntimes))
+
+
+class Command(BaseCommand):
+    help = "Import events, with their impact, synthesis, seasons and datasets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for standard input")
+        parser.add_argument('--format', choices=['json', 'csv'],
+                            help="Input format; by default guessed from the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of events inserted per transaction")
+        parser.add_argument('--strict', action='store_true',
+                            help="Stop at the first invalid event, "
+                            "instead of skipping it")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("The batch size should be positive")
+        regions = dict(models.Region.objects.values_list('name', 'pk'))
+
+        fh = sys.stdin if path == '-' else open(path, newline='' if fmt == 'csv' else None)
+        records = iter_csv(fh) if fmt == 'csv' else iter_json(fh)
+
+        self.groups = set()
+        nevents = nrows = nerrors = 0
+        start = time.perf_counter()
+        batch = Batch()
+        try:
+            for i, record in enumerate(records, 1):
+                try:
+                    batch.add(record, regions)
+                except (ValidationError, TypeError, AttributeError) as exc:
+                    nerrors += 1
+                    message = "Event %d: %s" % (i, '; '.join(getattr(exc, 'messages', [str(exc)])))
+                    if options['strict']:
+                        raise CommandError(message)
+                    self.stderr.write(message)
+                    continue
+                if len(batch) >= batch_size:
+                    nevents, nrows = self.save(batch, batch_size, nevents, nrows, start)
+                    batch = Batch()
+            if len(batch):
+                nevents, nrows = self.save(batch, batch_size, nevents, nrows, start)
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+            # Also when stopped by an error, for the batches saved before
+            summaries.refresh(self.groups)
+        elapsed = time.perf_counter() - start
+        self.stdout.write("Imported %d events (%d rows) in %.1f s: %.0f rows/s; %d invalid events"
+                          % (nevents, nrows, elapsed, nrows / elapsed if elapsed else 0, nerrors))
+
+    def save(self, batch, batch_size, nevents, nrows, start):
+        with transaction.atomic():
+            nrows += batch.save(batch_size)
+        nevents += len(batch)
+        self.update_derived(batch)
+        if self.verbosity >= 2:
+            elapsed = time.perf_counter() - start
+            self.stdout.write("%d events, %d rows: %.0f rows/s" % (nevents, nrows, nrows / elapsed))
+        return nevents, nrows
+
+    def update_derived(self, batch):
+        """Update the data derived from the inserted objects, which bulk
+        inserts do not signal
+
+        The statistics groups are collected, and refreshed once at the end.
+
+        """
+
+        invalidate_tiles({event.region_id for event in batch.events})
+        search.update([event.pk for event in batch.events])
+        cache.invalidate(*(cache.model_tag(model) for model in (
+            models.Event, models.Impact, models.Synthesis, models.Season, models.ObsDataset,
+            models.ModelDataset, models.FitParameters, models.ReturnTime)))
+        seasons = {}
+        for event, season in batch.seasons:
+            seasons.setdefault(event.pk, []).append((season.start, season.end))
+        for event in batch.events:
+            for dimension, key in summaries.event_keys(event.variable, event.region_id,
+                                                       event.startdate, seasons.get(event.pk, [])):
+                self.groups.update((source, dimension, key) for source in summaries.SOURCES)
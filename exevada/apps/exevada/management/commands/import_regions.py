@@ -0,0 +1,65 @@
+"""Import regions from vector files (zipped shapefiles, GeoJSON, ...)
+
+Every feature becomes a region, named after one of its attributes.
+Features are read one at a time, and saved in batches of one
+transaction each.
+
+"""
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ... import areas, models
+
+
+class Command(BaseCommand):
+    help = "Import regions from vector files, one region per feature"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path')
+        parser.add_argument('--name-field', default='name',
+                            help="Feature attribute with the region name (default: name)")
+        parser.add_argument('--layer', default=0,
+                            help="Layer name or index (default: the first layer)")
+        parser.add_argument('--update', action='store_true',
+                            help="Replace the areas of existing regions, instead of skipping them")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Number of regions per transaction")
+
+    def handle(self, *args, **options):
+        layer = options['layer']
+        if isinstance(layer, str) and layer.isdigit():
+            layer = int(layer)
+        start = time.monotonic()
+        counts = {'created': 0, 'updated': 0, 'skipped': 0}
+        for path in options['paths']:
+            try:
+                features = areas.iter_features(path, options['name_field'], layer)
+                batch = []
+                for name, area in features:
+                    batch.append((name, area))
+                    if len(batch) >= options['batch_size']:
+                        self.save(batch, options['update'], counts)
+                        batch = []
+                self.save(batch, options['update'], counts)
+            except areas.AreaError as exc:
+                raise CommandError("%s: %s" % (path, exc))
+        self.stdout.write("Created %(created)d, updated %(updated)d and skipped %(skipped)d "
+                          "regions" % counts + " in %.1f s" % (time.monotonic() - start))
+
+    def save(self, batch, update, counts):
+        existing = models.Region.objects.filter(
+            name__in=[name for name, area in batch if name]).in_bulk(field_name='name')
+        with transaction.atomic():
+            for name, area in batch:
+                if not name:
+                    self.stderr.write("Skipping a feature without a name")
+                    counts['skipped'] += 1
+                elif name in existing and not update:
+                    counts['skipped'] += 1
+                else:
+                    region = existing.get(name) or models.Region(name=name)
+                    counts['updated' if region.pk else 'created'] += 1
+                    region.area = area
+                    region.save()
+                    existing[name] = region
@@ -0,0 +1,69 @@
+"""Load test running servers with concurrent clients
+
+Every target (a base URL, such as http://localhost:8000) is given the
+same requests at each concurrency level, so a WSGI and an ASGI server
+of the same project and database can be compared directly:
+
+    gunicorn project.wsgi -b :8000 -w 1 --threads 1
+    uvicorn project.asgi:application --port 8001 --workers 1
+    ./manage.py loadtest http://localhost:8000 http://localhost:8001
+
+By default, the paths are those of the read-only views for a typical
+event and region of the configured database (which should be the one
+the servers use); --path gives others.
+
+"""
+
+import asyncio
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ... import benchmarks, models
+
+
+# Benchmark cases that are not read paths, or too large to repeat
+EXCLUDE = benchmarks.ONCE | {'add-event', 'add-region'}
+
+
+class Command(BaseCommand):
+    help = "Measure the throughput and latency of running servers under concurrent clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='base-url')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Path to request (repeatable; default: the read-only views)")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50],
+                            help="Numbers of concurrent clients")
+        parser.add_argument('--requests', type=int, default=500,
+                            help="Number of requests per target and concurrency")
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Timeout per request, in seconds")
+        parser.add_argument('-o', '--output', help="Store the results as JSON")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        results = {'paths': paths, 'targets': {}}
+        self.stdout.write("%-32s %6s %9s %9s %9s %9s %7s" % (
+            'target', 'conc.', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'errors'))
+        for target in options['targets']:
+            urls = [target.rstrip('/') + path for path in paths]
+            results['targets'][target] = []
+            for concurrency in options['concurrency']:
+                result = asyncio.run(benchmarks.load_test(
+                    urls, concurrency, options['requests'], options['timeout']))
+                results['targets'][target].append(result)
+                self.stdout.write("%-32s %6d %9.1f %9.1f %9.1f %9.1f %7d" % (
+                    target, concurrency, result['throughput'], result['p50'],
+                    result['p90'], result['p99'], result['errors']))
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+    def default_paths(self):
+        count = models.Event.objects.count()
+        if not count:
+            raise CommandError("No events to request; load some (see generate_data), "
+                               "or give --path")
+        event = models.Event.objects.select_related('region').order_by('pk')[count // 2]
+        return [url for name, url in benchmarks.view_urls(event, event.region)
+                if name not in EXCLUDE]
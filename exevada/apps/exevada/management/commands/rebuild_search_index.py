@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from ... import search
+
+
+class Command(BaseCommand):
+    help = "Recreate the full-text search documents of all events"
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write("Indexed %d events" % count)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from ... import summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute all summary statistics"
+
+    def handle(self, *args, **options):
+        count = summaries.rebuild()
+        self.stdout.write("Computed %d statistics" % count)
@@ -0,0 +1,86 @@
+"""Run the background jobs (see `jobs`) in a pool of worker processes
+
+    ./manage.py run_workers --processes 4
+
+The command runs until it gets SIGINT or SIGTERM, after which the
+workers finish their current job. Workers that die are replaced, and
+the jobs of workers that stopped responding (on any host) are queued
+again. With --burst, the workers stop once no job is due, as for
+running the queue from cron.
+
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from ... import jobs
+
+
+def _worker(stop, poll, burst):
+    # Stopping is up to the parent, through the event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        jobs.work(stop, poll=poll, burst=burst)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run the background jobs in worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Number of worker processes (default: number of CPUs)")
+        parser.add_argument('--poll', type=float, default=1,
+                            help="Seconds between looks at an empty queue")
+        parser.add_argument('--burst', action='store_true',
+                            help="Stop once no job is due")
+
+    def handle(self, *args, **options):
+        # Forked, the workers start with the app registry set up
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        stopping = threading.Event()
+
+        def shutdown(signum, frame):
+            stop.set()
+            stopping.set()
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write("Queued %d stale jobs again" % requeued)
+        # The workers should not share the connections of this process
+        connections.close_all()
+
+        def start():
+            process = context.Process(
+                target=_worker, args=(stop, options['poll'], options['burst']))
+            process.start()
+            return process
+
+        processes = [start() for i in range(options['processes'])]
+        next_check = time.monotonic() + settings.EXEVADA_JOBS_TIMEOUT / 4
+        self.stdout.write("Started %d workers" % len(processes))
+        while processes:
+            stopping.wait(options['poll'])
+            for process in list(processes):
+                if process.is_alive():
+                    continue
+                processes.remove(process)
+                if process.exitcode != 0 and not stop.is_set():
+                    self.stderr.write("Worker %d exited with %s; restarting" % (
+                        process.pid, process.exitcode))
+                    processes.append(start())
+            if not stop.is_set() and time.monotonic() >= next_check:
+                jobs.requeue_stale()
+                connections.close_all()
+                next_check = time.monotonic() + settings.EXEVADA_JOBS_TIMEOUT / 4
+        self.stdout.write("Workers stopped")
@@ -0,0 +1,83 @@
+"""Bring this database up to date with another exevada site, through
+its change feed (see `changes`)
+
+    ./manage.py sync_from https://example.org/exevada/ --state sync.json
+
+The cursor is stored in the state file after each page, so an
+interrupted sync continues where it stopped, and a sync run regularly
+(from cron) only transfers what changed since the previous run. The
+summary statistics are rebuilt at the end, if anything changed.
+
+"""
+
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from ... import changes, summaries
+
+
+class Command(BaseCommand):
+    help = "Apply the changes of another site to this database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Base URL of the other site")
+        parser.add_argument('--state', default='exevada-sync.json',
+                            help="File keeping the cursor between runs")
+        parser.add_argument('--limit', type=int, default=changes.DEFAULT_LIMIT,
+                            help="Objects per page")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--timeout', type=float, default=60,
+                            help="Timeout per page, in seconds")
+
+    def handle(self, *args, **options):
+        # The feed has the same path on the other site
+        url = urllib.parse.urljoin(options['url'].rstrip('/') + '/',
+                                   reverse('exevada:api-changes').lstrip('/'))
+        state = self.load_state(options['state'])
+        total = 0
+        pages = 0
+        while True:
+            query = {'limit': options['limit']}
+            if state.get('cursor'):
+                query['cursor'] = state['cursor']
+            page = self.fetch(url + '?' + urllib.parse.urlencode(query), options['timeout'])
+            count = changes.apply(page, batch_size=options['batch_size'])
+            total += count
+            pages += 1
+            state['cursor'] = page['cursor']
+            state['changed'] = state.get('changed', False) or count > 0
+            self.save_state(options['state'], state)
+            if self.verbosity >= 2:
+                self.stdout.write("Page %d: %d changes" % (pages, count))
+            if not page['more']:
+                break
+
+        if state['changed']:
+            self.stdout.write("Computed %d statistics" % summaries.rebuild())
+            state['changed'] = False
+            self.save_state(options['state'], state)
+        self.stdout.write("Applied %d changes in %d pages" % (total, pages))
+
+    def fetch(self, url, timeout):
+        request = urllib.request.Request(url, headers={'Accept': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.load(response)
+        except (urllib.error.URLError, OSError, ValueError) as exc:
+            raise CommandError("Cannot read %s: %s" % (url, exc))
+
+    def load_state(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def save_state(self, path, state):
+        # Replace the file at once, so an interrupted run leaves a valid one
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
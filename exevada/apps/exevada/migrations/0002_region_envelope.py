@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+def set_envelopes(apps, schema_editor):
+    Region = apps.get_model('exevada', 'Region')
+    for region in Region.objects.all():
+        region.xmin, region.ymin, region.xmax, region.ymax = region.area.extent
+        region.save(update_fields=['xmin', 'ymin', 'xmax', 'ymax'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='xmin',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Envelope western bound'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='ymin',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Envelope southern bound'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='xmax',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Envelope eastern bound'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='ymax',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Envelope northern bound'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_envelopes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+from apps.exevada.geometry import SIMPLIFY_LEVELS, simplify
+
+
+def create_simplified(apps, schema_editor):
+    Region = apps.get_model('exevada', 'Region')
+    SimplifiedRegion = apps.get_model('exevada', 'SimplifiedRegion')
+    for region in Region.objects.all():
+        SimplifiedRegion.objects.bulk_create(
+            SimplifiedRegion(region=region, level=level, tolerance=tolerance,
+                             area=simplify(region.area, tolerance))
+            for level, (tolerance, maxzoom) in enumerate(SIMPLIFY_LEVELS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0002_region_envelope'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimplifiedRegion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField(help_text='Simplification level')),
+                ('tolerance', models.FloatField(help_text='Simplification tolerance, in degrees')),
+                ('area', django.contrib.gis.db.models.fields.MultiPolygonField(help_text='Simplified area', srid=4326)),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='simplified', to='exevada.Region')),
+            ],
+            options={
+                'unique_together': {('level', 'region')},
+            },
+        ),
+        migrations.RunPython(create_simplified, migrations.RunPython.noop),
+    ]
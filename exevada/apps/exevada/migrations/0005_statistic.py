@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0004_event_startdate_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Statistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Model the values are taken from', max_length=32)),
+                ('quantity', models.CharField(help_text='Quantity (field) summarized', max_length=32)),
+                ('dimension', models.CharField(help_text='Dimension the events are grouped by', max_length=32)),
+                ('key', models.CharField(blank=True, help_text='Group key', max_length=255)),
+                ('count', models.PositiveIntegerField(help_text='Number of values')),
+                ('mean', models.FloatField(help_text='Mean')),
+                ('stddev', models.FloatField(help_text='Standard deviation')),
+                ('minimum', models.FloatField(help_text='Minimum')),
+                ('maximum', models.FloatField(help_text='Maximum')),
+                ('quantiles', models.TextField(help_text='Quantiles, as JSON')),
+                ('histogram', models.TextField(help_text='Histogram bin edges and counts, as JSON')),
+            ],
+            options={
+                'unique_together': {('source', 'quantity', 'dimension', 'key')},
+            },
+        ),
+    ]
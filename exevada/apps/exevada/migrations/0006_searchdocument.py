@@ -0,0 +1,40 @@
+from django.db import migrations, models
+import django.db.models.deletion
+from apps.exevada.fulltext import create_index, drop_index, iter_documents
+
+
+def populate(apps, schema_editor):
+    Event = apps.get_model('exevada', 'Event')
+    SearchDocument = apps.get_model('exevada', 'SearchDocument')
+    SearchDocument.objects.bulk_create(
+        (SearchDocument(event=event, **fields)
+         for event, fields in iter_documents(Event.objects.all())),
+        batch_size=500)
+
+
+def forwards(apps, schema_editor):
+    create_index(schema_editor.connection)
+
+
+def backwards(apps, schema_editor):
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0005_statistic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='exevada.Event')),
+                ('title', models.TextField(help_text='Event name and variable')),
+                ('body', models.TextField(help_text='Conclusions, impact and dataset comments')),
+            ],
+        ),
+        migrations.RunPython(forwards, backwards),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0006_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['variable', 'startdate', 'id'], name='event_variable_startdate'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['region', 'startdate', 'id'], name='event_region_startdate'),
+        ),
+        migrations.AddIndex(
+            model_name='synthesis',
+            index=models.Index(fields=['pr', 'id'], name='synthesis_pr_id'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+import datetime
+from django.db import migrations, models
+
+
+def set_enddates(apps, schema_editor):
+    Event = apps.get_model('exevada', 'Event')
+    events = []
+    for event in Event.objects.only('startdate', 'duration').iterator(chunk_size=1000):
+        event.enddate = event.startdate + datetime.timedelta(days=max(event.duration - 1, 0))
+        events.append(event)
+        if len(events) >= 1000:
+            Event.objects.bulk_update(events, ['enddate'])
+            events = []
+    Event.objects.bulk_update(events, ['enddate'])
+
+
+def set_unwrapped_ends(apps, schema_editor):
+    Season = apps.get_model('exevada', 'Season')
+    Season.objects.filter(end__gte=models.F('start')).update(unwrapped_end=models.F('end'))
+    Season.objects.filter(end__lt=models.F('start')).update(unwrapped_end=models.F('end') + 12)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='enddate',
+            field=models.DateField(blank=True, default=datetime.date(1, 1, 1), editable=False, help_text='Last day of the event (from the duration)'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='season',
+            name='unwrapped_end',
+            field=models.IntegerField(blank=True, default=0, editable=False, help_text='Ending month, plus 12 for seasons running past December'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_enddates, migrations.RunPython.noop),
+        migrations.RunPython(set_unwrapped_ends, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['enddate', 'startdate'], name='event_enddate_startdate'),
+        ),
+        migrations.AddIndex(
+            model_name='season',
+            index=models.Index(fields=['start', 'unwrapped_end'], name='season_months'),
+        ),
+    ]
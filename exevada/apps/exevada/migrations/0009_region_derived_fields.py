@@ -0,0 +1,53 @@
+from django.db import migrations, models
+from apps.exevada.geometry import geodesic_area
+
+
+def set_derived_fields(apps, schema_editor):
+    Region = apps.get_model('exevada', 'Region')
+    pks = list(Region.objects.values_list('pk', flat=True))
+    # A chunk of areas at a time
+    for start in range(0, len(pks), 100):
+        for region in Region.objects.filter(pk__in=pks[start:start + 100]):
+            region.centroid_x, region.centroid_y = region.area.centroid.coords
+            region.num_vertices = region.area.num_coords
+            region.area_km2 = geodesic_area(region.area)
+            region.save(update_fields=['centroid_x', 'centroid_y', 'num_vertices', 'area_km2'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0008_event_enddate_season_months'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='region',
+            options={'base_manager_name': 'objects'},
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='centroid_x',
+            field=models.FloatField(default=0, editable=False, help_text='Centroid longitude'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='centroid_y',
+            field=models.FloatField(default=0, editable=False, help_text='Centroid latitude'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='num_vertices',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of vertices'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='area_km2',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Area in km²'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_derived_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,120 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0009_region_derived_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='season',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='season',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='impact',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='impact',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='synthesis',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='synthesis',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='fitparameters',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='fitparameters',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='returntime',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='returntime',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='obsdataset',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='obsdataset',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.AddField(
+            model_name='modeldataset',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Creation time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='modeldataset',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last modification time'),
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='Model name of the deleted object', max_length=32)),
+                ('object_id', models.PositiveIntegerField(help_text='Primary key of the deleted object')),
+                ('deleted', models.DateTimeField(auto_now_add=True, db_index=True, help_text='Deletion time')),
+            ],
+        ),
+    ]
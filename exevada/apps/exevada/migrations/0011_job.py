@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0010_timestamps_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(help_text='Name of the task (see jobs.TASKS)', max_length=64)),
+                ('arguments', models.TextField(default='[]', help_text='Task arguments, as JSON')),
+                ('key', models.CharField(help_text='Identity of the work, for deduplication', max_length=64)),
+                ('priority', models.SmallIntegerField(default=0, help_text='Jobs with higher priorities run first')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('run_after', models.DateTimeField(help_text='Earliest start time (for retries)')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, help_text='Number of runs started')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3)),
+                ('progress', models.FloatField(default=0, help_text='Fraction done, between 0 and 1')),
+                ('message', models.TextField(blank=True, help_text='Progress message, or the error')),
+                ('worker', models.CharField(blank=True, help_text='Worker running the job', max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat', models.DateTimeField(blank=True, help_text='Last sign of life of the running job', null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', '-priority', 'run_after'], name='job_queue'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(status='queued'), fields=('task', 'key'), name='job_queued_unique'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from apps.exevada.geometry import geohash
+
+
+def set_geohashes(apps, schema_editor):
+    Region = apps.get_model('exevada', 'Region')
+    regions = []
+    for region in Region.objects.only('centroid_x', 'centroid_y').iterator(chunk_size=1000):
+        region.geohash = geohash(region.centroid_x, region.centroid_y)
+        regions.append(region)
+    Region.objects.bulk_update(regions, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, help_text='Geohash of the centroid, for clustering', max_length=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_sums(apps, schema_editor):
+    Statistic = apps.get_model('exevada', 'Statistic')
+    Statistic.objects.update(
+        total=F('mean') * F('count'),
+        total_squares=F('count') * (F('stddev') * F('stddev') + F('mean') * F('mean')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exevada', '0012_region_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statistic',
+            name='total',
+            field=models.FloatField(default=0, help_text='Sum of the values'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='statistic',
+            name='total_squares',
+            field=models.FloatField(default=0, help_text='Sum of the squared values'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_sums, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,163 @@
+import datetime
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import Polygon
+from django.contrib.gis.measure import D
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import Q
+from django.db.models.functions import Substr
+from django.urls import reverse
+from .geometry import (GEOHASH_PRECISION, SIMPLIFY_LEVELS, expand_envelope, geodesic_area,
+                       geohash, geohash_cover, geohash_range, level_for_zoom, simplify)
 
 
 PR_VALIDATOR = [MinValueValidator(0), MaxValueValidator(1)]
 
 
-class Region(models.Model):
+class Timestamped(models.Model):
+    """Creation and modification times, for the change feed (`changes`)
+
+    Bulk updates should set `updated` themselves.
+
+    """
+
+    created = models.DateTimeField(auto_now_add=True, help_text="Creation time")
+    updated = models.DateTimeField(auto_now=True, db_index=True,
+                                   help_text="Last modification time")
+
+    class Meta:
+        abstract = True
+
+
+class RegionQuerySet(models.QuerySet):
+    def envelope_intersects(self, bbox):
+        """Prefilter on the stored envelopes, using their indexes"""
+        xmin, ymin, xmax, ymax = bbox
+        return self.filter(xmin__lte=xmax, xmax__gte=xmin,
+                           ymin__lte=ymax, ymax__gte=ymin)
+
+    def containing(self, point):
+        return self.envelope_intersects(point.extent).filter(area__intersects=point)
+
+    def intersecting(self, bbox):
+        return self.envelope_intersects(bbox).filter(
+            area__intersects=Polygon.from_bbox(bbox))
+
+    def within_distance(self, point, radius):
+        """Regions within `radius` km of `point`"""
+        bbox = expand_envelope(point.extent, point.y, radius)
+        return self.envelope_intersects(bbox).filter(
+            area__distance_lte=(point, D(km=radius)))
+
+    def with_area(self):
+        """Load the areas, which `Region.objects` defers"""
+        return self.defer(None)
+
+    def simplified_areas(self, level):
+        """(id, name, area) of the regions, with the areas simplified
+        for a level
+
+        Areas not simplified yet (until the job doing so has run) are
+        simplified here.
+
+        """
+        rows = list(SimplifiedRegion.objects.filter(
+            level=level, region__in=self.values('pk')).values_list(
+                'region_id', 'region__name', 'area'))
+        missing = self.exclude(simplified__level=level).values_list('pk', 'name', 'area')
+        tolerance = SIMPLIFY_LEVELS[level][0]
+        rows.extend((pk, name, simplify(area, tolerance)) for pk, name, area in missing)
+        return rows
+
+
+class RegionManager(models.Manager.from_queryset(RegionQuerySet)):
+    """Defers the area, which can be megabytes per region; lists and
+    joins use the stored envelope, centroid, vertex count and size"""
+
+    def get_queryset(self):
+        return super().get_queryset().defer('area')
+
+
+class Region(Timestamped):
     name = models.CharField(max_length=255, unique=True,
                             help_text="Region name")
-    area = models.MultiPolygonField(help_text="One or more polygons making up the region")
+    area = models.MultiPolygonField(spatial_index=True,
+                                    help_text="One or more polygons making up the region")
     #event = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='')
+    xmin = models.FloatField(db_index=True, editable=False, help_text="Envelope western bound")
+    ymin = models.FloatField(db_index=True, editable=False, help_text="Envelope southern bound")
+    xmax = models.FloatField(db_index=True, editable=False, help_text="Envelope eastern bound")
+    ymax = models.FloatField(db_index=True, editable=False, help_text="Envelope northern bound")
+    centroid_x = models.FloatField(editable=False, help_text="Centroid longitude")
+    centroid_y = models.FloatField(editable=False, help_text="Centroid latitude")
+    num_vertices = models.PositiveIntegerField(editable=False, help_text="Number of vertices")
+    area_km2 = models.FloatField(db_index=True, editable=False, help_text="Area in km²")
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, db_index=True, editable=False,
+                               help_text="Geohash of the centroid, for clustering")
+
+    objects = RegionManager()
+
+    class Meta:
+        # Also for related objects, as in event.region
+        base_manager_name = 'objects'
+
+    def __str__(self):
+        return self.name
 
+    def set_derived_fields(self):
+        """Set the envelope, centroid (and its geohash), vertex count and
+        size from the area"""
+        self.xmin, self.ymin, self.xmax, self.ymax = self.area.extent
+        self.centroid_x, self.centroid_y = self.area.centroid.coords
+        self.geohash = geohash(self.centroid_x, self.centroid_y)
+        self.num_vertices = self.area.num_coords
+        self.area_km2 = geodesic_area(self.area)
+
+    def save(self, *args, **kwargs):
+        self.set_derived_fields()
+        super().save(*args, **kwargs)
+
+    def update_simplified(self):
+        """(Re)generate the simplified geometries for all levels
+
+        Queued as a job whenever the area changes (see `signals`).
+
+        """
+        self.simplified.all().delete()
+        SimplifiedRegion.objects.bulk_create(
+            SimplifiedRegion(region=self, level=level, tolerance=tolerance,
+                             area=simplify(self.area, tolerance))
+            for level, (tolerance, maxzoom) in enumerate(SIMPLIFY_LEVELS))
+
+    def area_for_zoom(self, zoom):
+        """The region area, simplified as appropriate for a map zoom level"""
+        level = level_for_zoom(zoom)
+        if level is None:
+            return self.area
+        simplified = self.simplified.filter(level=level).first()
+        if simplified is None:
+            # Until the job simplifying the area has run
+            return simplify(self.area, SIMPLIFY_LEVELS[level][0])
+        return simplified.area
+
+
+class SimplifiedRegion(models.Model):
+    """Simplified version of a region area, for a range of map zoom levels
+
+    The levels and their tolerances are given by
+    `geometry.SIMPLIFY_LEVELS`.
 
-class Season(models.Model):
+    """
+
+    region = models.ForeignKey('Region', on_delete=models.CASCADE, related_name='simplified')
+    level = models.PositiveSmallIntegerField(help_text="Simplification level")
+    tolerance = models.FloatField(help_text="Simplification tolerance, in degrees")
+    area = models.MultiPolygonField(help_text="Simplified area")
+
+    class Meta:
+        unique_together = [['level', 'region']]
+
+
+class Season(Timestamped):
     """Season given by a starting and ending month
 
     Not the usual djf, mam, jja or son seasons
@@ -36,29 +181,158 @@ class Season(models.Model):
 
     start = models.IntegerField(choices=MONTHS, help_text="Starting month")
     end = models.IntegerField(choices=MONTHS, help_text="Ending month")
+    unwrapped_end = models.IntegerField(
+        blank=True, editable=False,
+        help_text="Ending month, plus 12 for seasons running past December")
     event = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='season')
 
-
-class Event(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['start', 'unwrapped_end'], name='season_months'),
+        ]
+
+    @staticmethod
+    def unwrap(start, end):
+        return end + 12 if end < start else end
+
+    def set_unwrapped_end(self):
+        self.unwrapped_end = self.unwrap(self.start, self.end)
+
+    def save(self, *args, **kwargs):
+        self.set_unwrapped_end()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def overlapping(cls, start, end):
+        """Filter for the seasons sharing a month with the months `start`
+        to `end` (which may run past December)
+
+        Months are compared as ranges on (`start`, `unwrapped_end`); a
+        season and the months overlap if the ranges do, or if they do
+        with the months a year earlier or later.
+
+        """
+
+        end = cls.unwrap(start, end)
+        condition = Q()
+        for shift in (-12, 0, 12):
+            condition |= Q(start__lte=end + shift, unwrapped_end__gte=start + shift)
+        return condition
+
+
+class EventQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Fetch the related objects shown in event lists up front"""
+        return self.select_related('region', 'impact', 'synthesis').defer(
+            'region__area').prefetch_related(
+                'season', 'observational_datasets', 'model_datasets')
+
+    def active_between(self, start, end):
+        """Events lasting into the period from `start` to `end` (dates,
+        inclusive; either may be None)"""
+        queryset = self
+        if end is not None:
+            queryset = queryset.filter(startdate__lte=end)
+        if start is not None:
+            queryset = queryset.filter(enddate__gte=start)
+        return queryset
+
+    def in_months(self, start, end):
+        """Events with a season sharing a month with the months `start`
+        to `end` (which may run past December, as in 12 to 2)"""
+        return self.filter(pk__in=Season.objects.filter(
+            Season.overlapping(start, end)).values('event_id'))
+
+    def clusters(self, bbox, precision):
+        """Clusters of the events whose region centroid lies in `bbox`,
+        one per geohash cell of `precision` characters
+
+        A single aggregate query, grouped by cell and variable; it reads
+        the regions through ranges of their (indexed) geohashes. Returns
+        dicts with the cell 'geohash', the 'count' of events, their mean
+        centroid ('x', 'y'), the 'variable' of most of them, and their
+        'pr_min' and 'pr_max'.
+
+        """
+
+        xmin, ymin, xmax, ymax = bbox
+        cover = Q()
+        for cell in geohash_cover(bbox):
+            low, high = geohash_range(cell)
+            condition = Q(region__geohash__gte=low)
+            if high is not None:
+                condition &= Q(region__geohash__lt=high)
+            cover |= condition
+        rows = self.filter(
+            cover, region__centroid_x__gte=xmin, region__centroid_x__lte=xmax,
+            region__centroid_y__gte=ymin, region__centroid_y__lte=ymax,
+        ).annotate(cell=Substr('region__geohash', 1, precision)).values(
+            'cell', 'variable').annotate(
+                count=models.Count('pk'), x=models.Avg('region__centroid_x'),
+                y=models.Avg('region__centroid_y'), pr_min=models.Min('synthesis__pr'),
+                pr_max=models.Max('synthesis__pr')).order_by()
+
+        clusters = {}
+        for row in rows:
+            cluster = clusters.setdefault(row['cell'], {
+                'geohash': row['cell'], 'count': 0, 'x': 0, 'y': 0, 'variable': None,
+                'variable_count': 0, 'pr_min': None, 'pr_max': None})
+            count = row['count']
+            cluster['x'] += row['x'] * count
+            cluster['y'] += row['y'] * count
+            cluster['count'] += count
+            best = cluster['variable_count']
+            if count > best or (count == best and row['variable'] < cluster['variable']):
+                cluster['variable'], cluster['variable_count'] = row['variable'], count
+            for name, pick in (('pr_min', min), ('pr_max', max)):
+                values = [value for value in (cluster[name], row[name]) if value is not None]
+                cluster[name] = pick(values) if values else None
+        for cluster in clusters.values():
+            cluster['x'] /= cluster['count']
+            cluster['y'] /= cluster['count']
+            del cluster['variable_count']
+        return sorted(clusters.values(), key=lambda cluster: cluster['geohash'])
+
+
+class Event(Timestamped):
     name = models.CharField(max_length=512,
                             help_text="Short, descriptive name or title for this event")
     region = models.ForeignKey('Region', on_delete=models.CASCADE)
     startdate = models.DateField(help_text="Event starting date")
     duration = models.PositiveIntegerField(help_text="Duration of the event "
                                            "in number of (whole) days")
+    enddate = models.DateField(blank=True, editable=False,
+                               help_text="Last day of the event (from the duration)")
     variable = models.CharField(max_length=255, help_text="Event variable")
     fitted_distribution = models.CharField(max_length=512, help_text="Distribution fitted")
     impact = models.OneToOneField('Impact', on_delete=models.CASCADE)
     synthesis = models.OneToOneField('Synthesis', on_delete=models.CASCADE)
 
+    objects = EventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['startdate', 'id'], name='event_startdate_id'),
+            models.Index(fields=['variable', 'startdate', 'id'], name='event_variable_startdate'),
+            models.Index(fields=['region', 'startdate', 'id'], name='event_region_startdate'),
+            models.Index(fields=['enddate', 'startdate'], name='event_enddate_startdate'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def set_enddate(self):
+        self.enddate = self.startdate + datetime.timedelta(days=max(self.duration - 1, 0))
+
+    def save(self, *args, **kwargs):
+        self.set_enddate()
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
-            return reverse('event', args=[self.pk])
+        return reverse('exevada:event', args=[self.pk])
 
 
-class Impact(models.Model):
+class Impact(Timestamped):
     deaths = models.DecimalField(max_digits=12, decimal_places=2, help_text="Number of deaths")
     affected = models.DecimalField(max_digits=12, decimal_places=2, help_text="Number of people affected")
     request = models.CharField(max_length=1024, help_text="Request for attribution")
@@ -68,7 +342,7 @@ class Impact(models.Model):
         return self.comments[:80]
 
 
-class Synthesis(models.Model):
+class Synthesis(Timestamped):
     pr = models.FloatField(validators=PR_VALIDATOR,
                            help_text="Probability ratio")
     delta_i = models.FloatField(help_text="Change in intensity")
@@ -80,12 +354,15 @@ class Synthesis(models.Model):
 
     class Meta:
         verbose_name_plural = 'syntheses'
+        indexes = [
+            models.Index(fields=['pr', 'id'], name='synthesis_pr_id'),
+        ]
 
     def __str__(self):
         return self.conclusions[:80]
 
 
-class FitParameters(models.Model):
+class FitParameters(Timestamped):
     obsdataset = models.ForeignKey('ObsDataset', on_delete=models.CASCADE,
                                    related_name="best_fit_value")
     mu = models.FloatField(help_text="Mu value")
@@ -97,7 +374,7 @@ class FitParameters(models.Model):
         verbose_name_plural = 'fit parameters'
 
 
-class ReturnTime(models.Model):
+class ReturnTime(Timestamped):
     obsdataset = models.ForeignKey('ObsDataset', on_delete=models.CASCADE,
                                    related_name="return_period")
     value = models.FloatField(help_text="Best fit value")
@@ -107,7 +384,7 @@ class ReturnTime(models.Model):
 
 
 
-class ObsDataset(models.Model):
+class ObsDataset(Timestamped):
     event = models.ForeignKey('Event', on_delete=models.CASCADE,
                               related_name='observational_datasets')
     value = models.FloatField(help_text="Variable value")
@@ -121,7 +398,7 @@ class ObsDataset(models.Model):
         verbose_name = "observational dataset"
 
 
-class ModelDataset(models.Model):
+class ModelDataset(Timestamped):
     event = models.ForeignKey('Event', on_delete=models.CASCADE,
                               related_name='model_datasets')
     model_type = models.CharField(max_length=512,
@@ -131,3 +408,91 @@ class ModelDataset(models.Model):
     pr = models.FloatField(validators=PR_VALIDATOR,
                            help_text="Probability ratio")
     delta_i = models.FloatField(help_text="Change in intensity")
+
+
+class Statistic(models.Model):
+    """Summary statistics of a quantity over a group of events
+
+    Maintained by the `summaries` module.
+
+    """
+
+    source = models.CharField(max_length=32, help_text="Model the values are taken from")
+    quantity = models.CharField(max_length=32, help_text="Quantity (field) summarized")
+    dimension = models.CharField(max_length=32, help_text="Dimension the events are grouped by")
+    key = models.CharField(max_length=255, blank=True, help_text="Group key")
+    count = models.PositiveIntegerField(help_text="Number of values")
+    total = models.FloatField(help_text="Sum of the values")
+    total_squares = models.FloatField(help_text="Sum of the squared values")
+    mean = models.FloatField(help_text="Mean")
+    stddev = models.FloatField(help_text="Standard deviation")
+    minimum = models.FloatField(help_text="Minimum")
+    maximum = models.FloatField(help_text="Maximum")
+    quantiles = models.TextField(help_text="Quantiles, as JSON")
+    histogram = models.TextField(help_text="Histogram bin edges and counts, as JSON")
+
+    class Meta:
+        unique_together = [['source', 'quantity', 'dimension', 'key']]
+
+
+class SearchDocument(models.Model):
+    """Searchable text of an event
+
+    Maintained by the `search` module, which also manages the full-text
+    index of the database backend.
+
+    """
+
+    event = models.OneToOneField('Event', on_delete=models.CASCADE, primary_key=True,
+                                 related_name='search_document')
+    title = models.TextField(help_text="Event name and variable")
+    body = models.TextField(help_text="Conclusions, impact and dataset comments")
+
+
+class Tombstone(models.Model):
+    """Deletion of an object, for the change feed (`changes`)"""
+
+    model = models.CharField(max_length=32, help_text="Model name of the deleted object")
+    object_id = models.PositiveIntegerField(help_text="Primary key of the deleted object")
+    deleted = models.DateTimeField(auto_now_add=True, db_index=True, help_text="Deletion time")
+
+
+class Job(models.Model):
+    """Background job, run by the workers of `manage.py run_workers`
+
+    Maintained by the `jobs` module.
+
+    """
+
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    task = models.CharField(max_length=64, help_text="Name of the task (see jobs.TASKS)")
+    arguments = models.TextField(default='[]', help_text="Task arguments, as JSON")
+    key = models.CharField(max_length=64, help_text="Identity of the work, for deduplication")
+    priority = models.SmallIntegerField(default=0, help_text="Jobs with higher priorities run first")
+    status = models.CharField(max_length=16, choices=STATUSES, default=QUEUED)
+    run_after = models.DateTimeField(help_text="Earliest start time (for retries)")
+    attempts = models.PositiveSmallIntegerField(default=0, help_text="Number of runs started")
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    progress = models.FloatField(default=0, help_text="Fraction done, between 0 and 1")
+    message = models.TextField(blank=True, help_text="Progress message, or the error")
+    worker = models.CharField(max_length=255, blank=True, help_text="Worker running the job")
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True,
+                                     help_text="Last sign of life of the running job")
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'], name='job_queue'),
+        ]
+        constraints = [
+            # At most one queued job for the same work
+            models.UniqueConstraint(fields=['task', 'key'], condition=Q(status='queued'),
+                                    name='job_queued_unique'),
+        ]
+
+    def __str__(self):
+        return '%s %s (%s)' % (self.task, self.key, self.status)
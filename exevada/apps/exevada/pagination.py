@@ -0,0 +1,170 @@
+"""Keyset (cursor) pagination for list views
+
+Instead of counting and skipping rows with OFFSET, each page continues
+after the sort key of the last row of the previous page, so fetching a
+page costs the same regardless of its position in the list.
+
+`EstimatedCountPaginator` is a regular paginator, for the admin, that
+takes the number of rows of large unfiltered tables from the database
+statistics instead of counting them.
+
+"""
+
+import base64
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime.date) else value
+              for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor; returns None if it is invalid"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_filter(fields, values):
+    """Filter for the rows sorting after `values` for ordering `fields`"""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        condition |= equal & Q(**{name + lookup: value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def sort_key(obj, fields):
+    values = []
+    for field in fields:
+        value = obj
+        for attr in field.lstrip('-').split('__'):
+            value = getattr(value, attr)
+        values.append(value)
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, querydict):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.querydict = querydict
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def next_query(self):
+        """Query string for the next page"""
+        query = self.querydict.copy()
+        query['after'] = self.next_cursor
+        return query.urlencode()
+
+    def first_query(self):
+        """Query string for the first page"""
+        query = self.querydict.copy()
+        query.pop('after', None)
+        return query.urlencode()
+
+    def sort_query(self):
+        """Query string for the first page without the sort order, to be
+        followed by a `sort` parameter (so ending in '&' unless empty)"""
+        query = self.querydict.copy()
+        query.pop('after', None)
+        query.pop('sort', None)
+        return query.urlencode() + '&' if query else ''
+
+
+class KeysetPaginationMixin:
+    """Keyset pagination for a ListView
+
+    `orderings` maps the allowed values of the `sort` query parameter
+    to the fields to order by; the last field should be unique (the
+    primary key), so that the order is total. The page position is
+    given by the `after` query parameter.
+
+    """
+
+    paginate_by = 50
+    orderings = {}
+    default_ordering = None
+
+    def get_ordering(self):
+        sort = self.request.GET.get('sort')
+        return self.orderings.get(sort, self.orderings[self.default_ordering])
+
+    def paginate_queryset(self, queryset, page_size):
+        fields = self.get_ordering()
+        values = decode_cursor(self.request.GET.get('after', ''))
+        if values and len(values) == len(fields):
+            try:
+                queryset = queryset.filter(keyset_filter(fields, values))
+            except (ValueError, TypeError, ValidationError):
+                pass
+        object_list = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            next_cursor = encode_cursor(sort_key(object_list[-1], fields))
+        page = KeysetPage(object_list, next_cursor, self.request.GET)
+        return (None, page, object_list, page.has_next() or 'after' in self.request.GET)
+
+
+def estimated_count(model):
+    """Number of rows of the table of `model` according to the database
+    statistics (of the last ANALYZE); None if there are none"""
+
+    connection = connections[router.db_for_read(model)]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            if 'sqlite_stat1' not in connection.introspection.table_names(cursor):
+                return None
+            # The first number of every entry of a table is its row count
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses `estimated_count` for unfiltered querysets of
+    more than `threshold` rows
+
+    The page links of the last pages may then be slightly off, which is
+    acceptable for browsing, but not for exact totals.
+
+    """
+
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > self.threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,342 @@
+"""Opt-in request profiling
+
+With `EXEVADA_PROFILE` set, `ProfilingMiddleware` profiles requests
+that carry the `X-Exevada-Profile` header, if they are made by a staff
+user or the header has the value of `EXEVADA_PROFILE_TOKEN`, and a
+random fraction `EXEVADA_PROFILE_SAMPLE_RATE` of all other requests.
+The middleware has to come after the authentication middleware, and
+handles both sync and async requests. A profile holds
+
+- the SQL queries: their number and total time, and the queries run
+  more than once with the same parameters (duplicates) or with other
+  parameters (similar; often an N+1 pattern)
+- the time spent rendering templates and in GEOS calls
+- stack samples of the threads doing the work of the request, taken
+  every `EXEVADA_PROFILE_INTERVAL` seconds by a separate thread
+
+Profiled responses get a `Server-Timing` header, and the last
+`EXEVADA_PROFILE_HISTORY` profiles are kept in the process for
+`stats`. Without `EXEVADA_PROFILE`, the middleware removes itself
+and nothing is instrumented.
+
+The profile of a request is found through a context variable, so the
+work of async views (see `asyncviews`) is included: the pools of those
+views run their functions in a copy of the request's context, through
+`sampled`, which also has their threads sampled.
+
+"""
+
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .routers import iscoroutinefunction, markcoroutinefunction
+
+
+HEADER = 'HTTP_X_EXEVADA_PROFILE'
+
+_current = contextvars.ContextVar('exevada_profile', default=None)
+_history = deque()
+_lock = threading.Lock()
+_instrumented = False
+
+
+class Profile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = None
+        self.view = None
+        self.queries = []
+        self.render = 0
+        self.geos = 0
+        self.geos_calls = 0
+        self.samples = Counter()
+        # Identifiers of the threads working for the request
+        self.threads = set()
+
+    def record_query(self, sql, params, duration):
+        try:
+            key = (sql, repr(params))
+        except Exception:
+            key = (sql, None)
+        self.queries.append((key, duration))
+
+    def query_summary(self):
+        by_sql = Counter(key[0] for key, duration in self.queries)
+        exact = Counter(key for key, duration in self.queries)
+        duplicates = sum(count - 1 for count in exact.values())
+        return {
+            'count': len(self.queries),
+            'time': sum(duration for key, duration in self.queries),
+            'duplicates': duplicates,
+            'similar': sum(count - 1 for count in by_sql.values()) - duplicates,
+            'repeated': [{'sql': sql, 'count': count}
+                         for sql, count in by_sql.most_common() if count > 1][:5],
+        }
+
+    def summary(self, top=10):
+        return {
+            'view': self.view,
+            'total': self.total,
+            'sql': self.query_summary(),
+            'render': self.render,
+            'geos': self.geos,
+            'geos_calls': self.geos_calls,
+            'samples': self.samples.most_common(top),
+        }
+
+    def server_timing(self):
+        sql = self.query_summary()
+        return ', '.join([
+            'sql;dur=%.1f;desc="%d queries, %d duplicates, %d similar"' % (
+                sql['time'] * 1000, sql['count'], sql['duplicates'], sql['similar']),
+            'render;dur=%.1f' % (self.render * 1000),
+            'geos;dur=%.1f;desc="%d calls"' % (self.geos * 1000, self.geos_calls),
+            'total;dur=%.1f' % (self.total * 1000),
+        ])
+
+
+def _timed(attribute, count=None):
+    """Wrap a function to add its duration to the current profile"""
+
+    def wrap(function):
+        def timed(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                setattr(profile, attribute,
+                        getattr(profile, attribute) + time.perf_counter() - start)
+                if count:
+                    setattr(profile, count, getattr(profile, count) + 1)
+        timed.__wrapped__ = function
+        return timed
+    return wrap
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper adding queries to the current profile"""
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, params, time.perf_counter() - start)
+
+
+def watch_queries(sender, connection, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def instrument():
+    """Time the queries, template rendering and GEOS calls of profiled
+    requests
+
+    Done once, and only when profiling is enabled; the wrappers only
+    look up the current profile for other requests. Queries are timed
+    on every connection, including those of the threads of async
+    views.
+
+    """
+
+    global _instrumented
+    if _instrumented:
+        return
+    from django.contrib.gis.geos.prototypes.threadsafe import GEOSFunc
+    from django.template.backends.django import Template
+    Template.render = _timed('render')(Template.render)
+    GEOSFunc.__call__ = _timed('geos', 'geos_calls')(GEOSFunc.__call__)
+    connection_created.connect(watch_queries, dispatch_uid='exevada-profiling')
+    for connection in connections.all():
+        watch_queries(None, connection)
+    _instrumented = True
+
+
+def sampled(function, *args, **kwargs):
+    """Call `function`, with the current thread sampled for the current
+    profile (if any)"""
+    profile = _current.get()
+    if profile is None:
+        return function(*args, **kwargs)
+    thread = threading.get_ident()
+    profile.threads.add(thread)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.threads.discard(thread)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s:%s:%d' % (os.path.relpath(code.co_filename, settings.BASE_DIR)
+                         if code.co_filename.startswith(settings.BASE_DIR)
+                         else os.path.basename(code.co_filename),
+                         code.co_name, frame.f_lineno)
+
+
+class Sampler(threading.Thread):
+    """Samples the stacks of a set of threads: the innermost frame of
+    the project's code, and the innermost frame overall if it is
+    elsewhere"""
+
+    def __init__(self, threads, samples, interval):
+        super().__init__(daemon=True)
+        self.threads = threads
+        self.samples = samples
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in list(self.threads):
+                leaf = frames.get(thread)
+                frame = leaf
+                while frame is not None and not frame.f_code.co_filename.startswith(
+                        settings.BASE_DIR):
+                    frame = frame.f_back
+                if leaf is None:
+                    continue
+                if frame is None or frame is leaf:
+                    self.samples[_frame_name(leaf)] += 1
+                else:
+                    self.samples['%s > %s' % (_frame_name(frame), _frame_name(leaf))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'EXEVADA_PROFILE', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rate = settings.EXEVADA_PROFILE_SAMPLE_RATE
+        self.token = settings.EXEVADA_PROFILE_TOKEN
+        self.interval = settings.EXEVADA_PROFILE_INTERVAL
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        instrument()
+
+    def requested(self, request):
+        """Whether the request asks for a profile, and may have one"""
+        header = request.META.get(HEADER)
+        if header is None:
+            return False
+        user = getattr(request, 'user', None)
+        return bool(self.token and header == self.token) or bool(user and user.is_staff)
+
+    def sampled(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def start(self):
+        profile = Profile()
+        token = _current.set(profile)
+        sampler = Sampler(profile.threads, profile.samples, self.interval)
+        sampler.start()
+        return profile, token, sampler
+
+    def stop(self, token, sampler):
+        sampler.stop()
+        _current.reset(token)
+
+    def finish(self, profile, response):
+        profile.total = time.perf_counter() - profile.start
+        response['Server-Timing'] = profile.server_timing()
+        store(profile)
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not (self.sampled() or self.requested(request)):
+            return self.get_response(request)
+
+        profile, token, sampler = self.start()
+        try:
+            # Streaming responses are only timed up to their start
+            response = sampled(self.get_response, request)
+        finally:
+            self.stop(token, sampler)
+        return self.finish(profile, response)
+
+    async def __acall__(self, request):
+        # Looking up the user may query the database
+        if not (self.sampled() or (HEADER in request.META and
+                                   await sync_to_async(self.requested)(request))):
+            return await self.get_response(request)
+
+        # The event loop thread works for every request, so only the
+        # threads of the pools of async views are sampled
+        profile, token, sampler = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(token, sampler)
+        return self.finish(profile, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current.get()
+        if profile is not None and request.resolver_match:
+            profile.view = request.resolver_match.view_name
+
+
+def store(profile):
+    with _lock:
+        _history.append(profile.summary())
+        while len(_history) > settings.EXEVADA_PROFILE_HISTORY:
+            _history.popleft()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+def stats(top=20):
+    """Statistics of the kept profiles, per view"""
+
+    with _lock:
+        history = list(_history)
+    views = {}
+    for summary in history:
+        views.setdefault(summary['view'] or '(unresolved)', []).append(summary)
+    result = {}
+    for view, summaries in views.items():
+        totals = [summary['total'] * 1000 for summary in summaries]
+        samples = Counter()
+        for summary in summaries:
+            samples.update(dict(summary['samples']))
+        result[view] = {
+            'requests': len(summaries),
+            'total_ms': {'mean': sum(totals) / len(totals), 'p50': _percentile(totals, 50),
+                         'p95': _percentile(totals, 95), 'max': max(totals)},
+            'sql_queries': sum(s['sql']['count'] for s in summaries) / len(summaries),
+            'sql_ms': sum(s['sql']['time'] for s in summaries) * 1000 / len(summaries),
+            'duplicate_queries': sum(s['sql']['duplicates'] for s in summaries) / len(summaries),
+            'similar_queries': sum(s['sql']['similar'] for s in summaries) / len(summaries),
+            'render_ms': sum(s['render'] for s in summaries) * 1000 / len(summaries),
+            'geos_ms': sum(s['geos'] for s in summaries) * 1000 / len(summaries),
+            'repeated_sql': summaries[-1]['sql']['repeated'],
+            'samples': samples.most_common(top),
+        }
+    return {'profiles': len(history), 'views': result}
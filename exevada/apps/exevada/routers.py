@@ -0,0 +1,170 @@
+"""Primary/replica database routing
+
+With replicas listed in `EXEVADA_REPLICAS` (aliases of `DATABASES`),
+`PrimaryReplicaRouter` sends the reads of requests to a replica, chosen
+at random once per request so that its reads see a single state of the
+data, and all writes to the primary ('default'). Reads go to the
+primary instead
+
+- outside requests (management commands, shells), and inside
+  transactions on the primary
+- for the rest of a request, once it has written anything (run an
+  INSERT, UPDATE, DELETE or schema statement on the primary)
+- for `EXEVADA_REPLICA_LAG` seconds after a request that wrote, through
+  a cookie, so that users see their own changes (read-your-writes)
+
+`ReplicaPinningMiddleware` keeps track of this per request, and sets
+the cookie; it handles both sync and async requests. Without replicas,
+everything uses the primary.
+
+"""
+
+import asyncio
+import contextvars
+import random
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:
+    # asgiref < 3.6, with Django < 4.1
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+
+COOKIE = 'exevada_primary'
+
+# Routing state of the current request: a dict with 'pinned' (read
+# from the primary), 'wrote' and 'replica' (the alias of its replica);
+# None outside requests. The dict is
+# shared with copies of the context, such as those of async views.
+_state = contextvars.ContextVar('exevada_routing', default=None)
+
+
+def uses_replicas():
+    """Whether reads in the current context may go to a replica"""
+    state = _state.get()
+    return bool(settings.EXEVADA_REPLICAS) and state is not None and not state['pinned']
+
+
+def read_alias():
+    """Database alias for reads in the current context"""
+    if not uses_replicas() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return _state.get()['replica']
+
+
+# Statements that change the primary
+WRITES = ('INSERT', 'UPDATE', 'DELETE', 'CREATE', 'ALTER', 'DROP', 'TRUNCATE')
+
+
+def record_writes(execute, sql, params, many, context):
+    """Execute wrapper pinning the request to the primary once it writes
+
+    Routing a model for writing is not enough: querysets do so for
+    lookups that only read (`select_for_update`, `get_or_create`).
+
+    """
+
+    state = _state.get()
+    if state is not None and not state['wrote'] and sql.lstrip()[:8].upper().startswith(WRITES):
+        state['pinned'] = state['wrote'] = True
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def watch_writes(sender, connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS and record_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_writes)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.EXEVADA_REPLICAS:
+            return False
+        return None
+
+
+def keep_routing(iterable):
+    """Iterate with the routing state of the current request
+
+    For the content of streaming responses, which is produced after
+    the middleware has returned.
+
+    """
+
+    state = _state.get()
+
+    def iterate(iterator):
+        while True:
+            token = _state.set(state)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _state.reset(token)
+            yield item
+    return iterate(iter(iterable))
+
+
+class ReplicaPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        return {
+            'pinned': request.method not in ('GET', 'HEAD', 'OPTIONS') or
+                      COOKIE in request.COOKIES,
+            'wrote': False,
+            'replica': (random.choice(settings.EXEVADA_REPLICAS)
+                        if settings.EXEVADA_REPLICAS else None),
+        }
+
+    def finish(self, state, response):
+        if state['wrote'] and settings.EXEVADA_REPLICAS:
+            response.set_cookie(COOKIE, '1', max_age=settings.EXEVADA_REPLICA_LAG,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
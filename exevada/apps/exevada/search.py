@@ -0,0 +1,151 @@
+"""Full-text search over the events
+
+Each event has a `SearchDocument` with its searchable text: a title
+(name and variable), ranked higher, and a body (synthesis conclusions,
+impact request and comments, and observational dataset comments). The
+documents are updated by the signal handlers in `signals` whenever one
+of these objects changes; `rebuild` recreates all of them.
+
+The index depends on the database backend:
+
+- PostgreSQL: a GIN index on the weighted tsvector of the document,
+  queried with `websearch_to_tsquery` (PostgreSQL 11 or later), ranked
+  with `ts_rank` and highlighted with `ts_headline`
+- SQLite (SpatiaLite): an FTS5 table on the documents (with stemming),
+  kept in sync by triggers, ranked with `bm25` and highlighted with
+  `snippet`
+- others: no index; the documents are scanned with `icontains`
+
+The index and the documents are defined in `fulltext`, which the
+migrations use as well.
+
+Queries are words, all of which should match, and "quoted phrases".
+
+"""
+
+import re
+from django.db import connections, router, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from . import models
+from .fulltext import CONFIG, FTS_TABLE, VECTOR, iter_documents
+
+
+# Highlighting markers, replaced by HTML after escaping the snippets
+START, STOP = '\x02', '\x03'
+ELLIPSIS = '…'
+
+
+def update(event_ids):
+    """Recreate the documents of the events (ids, or a queryset of ids)
+
+    Ids of deleted events are ignored.
+
+    """
+
+    if isinstance(event_ids, (list, tuple, set)):
+        # Keep the number of query parameters within the backend limits
+        event_ids = list(event_ids)
+        for i in range(0, len(event_ids), 500):
+            _update(event_ids[i:i + 500])
+    else:
+        _update(event_ids)
+
+
+def _update(event_ids):
+    events = models.Event.objects.filter(pk__in=event_ids)
+    with transaction.atomic():
+        models.SearchDocument.objects.filter(event__in=event_ids).delete()
+        models.SearchDocument.objects.bulk_create(
+            models.SearchDocument(event=event, **fields)
+            for event, fields in iter_documents(events))
+
+
+def rebuild(chunk_size=500):
+    """Recreate all documents and the index; returns their number"""
+
+    count = 0
+    with transaction.atomic():
+        models.SearchDocument.objects.all().delete()
+        documents = []
+        for event, fields in iter_documents(models.Event.objects.all(), chunk_size):
+            documents.append(models.SearchDocument(event=event, **fields))
+            if len(documents) >= chunk_size:
+                count += len(models.SearchDocument.objects.bulk_create(documents))
+                documents = []
+        count += len(models.SearchDocument.objects.bulk_create(documents))
+        connection = connections[router.db_for_write(models.SearchDocument)]
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+    return count
+
+
+def parse(query):
+    """Words and quoted phrases of a query"""
+    return [phrase or word for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query)
+            if (phrase or word).strip()]
+
+
+def highlight(snippet):
+    """HTML of a snippet, with the matches marked"""
+    return mark_safe(escape(snippet).replace(START, '<mark>').replace(STOP, '</mark>'))
+
+
+def _search_postgresql(cursor, query, limit):
+    options = 'StartSel=%s, StopSel=%s, MaxFragments=2, FragmentDelimiter=" %s "' % (
+        START, STOP, ELLIPSIS)
+    cursor.execute(
+        "SELECT event_id, ts_rank({vector}, query) AS rank, "
+        "ts_headline('{config}', body, query, %s) "
+        "FROM exevada_searchdocument, websearch_to_tsquery('{config}', %s) AS query "
+        "WHERE {vector} @@ query ORDER BY rank DESC, event_id LIMIT %s".format(
+            vector=VECTOR, config=CONFIG),
+        [options, query, limit])
+    return cursor.fetchall()
+
+
+def _search_sqlite(cursor, query, limit):
+    # Every term quoted, to match it literally instead of as FTS5 syntax
+    match = ' '.join('"%s"' % term.replace('"', '') for term in parse(query))
+    cursor.execute(
+        "SELECT rowid, -bm25({fts}, 10.0, 1.0) AS rank, "
+        "snippet({fts}, -1, %s, %s, %s, 24) "
+        "FROM {fts} WHERE {fts} MATCH %s ORDER BY rank DESC, rowid LIMIT %s".format(
+            fts=FTS_TABLE),
+        [START, STOP, ELLIPSIS, match, limit])
+    return cursor.fetchall()
+
+
+def _search_scan(query, limit):
+    documents = models.SearchDocument.objects.all()
+    terms = parse(query)
+    for term in terms:
+        documents = documents.filter(title__icontains=term) | documents.filter(
+            body__icontains=term)
+    results = []
+    for pk, body in documents.order_by('pk').values_list('pk', 'body')[:limit]:
+        for term in terms:
+            body = re.sub(re.escape(term), lambda match: START + match.group() + STOP,
+                          body, flags=re.IGNORECASE)
+        results.append((pk, 0, body))
+    return results
+
+
+def search(query, limit=100):
+    """Events matching a query, best first
+
+    Returns (event id, rank, snippet HTML) tuples.
+
+    """
+
+    if not parse(query):
+        return []
+    connection = connections[router.db_for_read(models.SearchDocument)]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        function = _search_postgresql if connection.vendor == 'postgresql' else _search_sqlite
+        with connection.cursor() as cursor:
+            rows = function(cursor, query, limit)
+    else:
+        rows = _search_scan(query, limit)
+    return [(pk, rank, highlight(snippet)) for pk, rank, snippet in rows]
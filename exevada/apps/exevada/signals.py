@@ -0,0 +1,211 @@
+"""Signal handlers keeping derived data in sync with the models
+
+Cached tiles and responses are invalidated once the transaction
+commits: before that, other requests still read the old rows, and
+would cache them again under the new versions.
+
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import cache, jobs, models, search, summaries, tiles
+
+
+def region_envelopes(region_ids):
+    return models.Region.objects.filter(pk__in=region_ids).values_list(
+        'xmin', 'ymin', 'xmax', 'ymax')
+
+
+def invalidate_envelopes(envelopes):
+    """Remove the cached tiles overlapping the envelopes, on commit"""
+    envelopes = [bbox for bbox in envelopes if bbox]
+
+    def invalidate():
+        for bbox in envelopes:
+            tiles.invalidate(bbox)
+    transaction.on_commit(invalidate)
+
+
+def invalidate_tiles(region_ids):
+    invalidate_envelopes(list(region_envelopes(region_ids)))
+
+
+@receiver(pre_save, sender=models.Region)
+def remember_envelope(sender, instance, update_fields=None, **kwargs):
+    instance._old_envelope = next(iter(region_envelopes([instance.pk])), None)
+    changed = update_fields is None or 'area' in update_fields
+    if changed and instance.pk is not None and instance.area is not None:
+        changed = not models.Region.objects.filter(
+            pk=instance.pk, area__equals=instance.area).exists()
+    instance._area_changed = changed
+
+
+@receiver(post_save, sender=models.Region)
+@receiver(post_delete, sender=models.Region)
+def region_changed(sender, instance, **kwargs):
+    invalidate_envelopes([getattr(instance, '_old_envelope', None),
+                          (instance.xmin, instance.ymin, instance.xmax, instance.ymax)])
+
+
+@receiver(post_save, sender=models.Region)
+def simplify_region(sender, instance, created, **kwargs):
+    if not instance._area_changed:
+        return
+    # Until the job has run, the views simplify the new area themselves
+    if not created:
+        instance.simplified.all().delete()
+    jobs.enqueue('simplify-region', instance.pk)
+
+
+@receiver(pre_save, sender=models.Event)
+def remember_region(sender, instance, **kwargs):
+    instance._old_region_id = models.Event.objects.filter(pk=instance.pk).values_list(
+        'region_id', flat=True).first()
+
+
+@receiver(post_save, sender=models.Event)
+@receiver(post_delete, sender=models.Event)
+def event_changed(sender, instance, **kwargs):
+    invalidate_tiles({instance.region_id, getattr(instance, '_old_region_id', None)})
+
+
+@receiver(post_save, sender=models.Synthesis)
+def synthesis_changed(sender, instance, **kwargs):
+    invalidate_tiles(models.Event.objects.filter(synthesis=instance).values('region_id'))
+
+
+def related_tags(instance):
+    """Tags of the objects whose pages show (part of) an instance"""
+
+    Event = models.Event
+    if isinstance(instance, models.Event):
+        return [cache.object_tag(models.Region, instance.region_id)]
+    if isinstance(instance, (models.Season, models.ObsDataset, models.ModelDataset)):
+        return [cache.object_tag(Event, instance.event_id)]
+    if isinstance(instance, (models.FitParameters, models.ReturnTime)):
+        event_ids = models.ObsDataset.objects.filter(
+            pk=instance.obsdataset_id).values_list('event_id', flat=True)
+        return ([cache.object_tag(models.ObsDataset, instance.obsdataset_id)] +
+                [cache.object_tag(Event, pk) for pk in event_ids])
+    if isinstance(instance, (models.Impact, models.Synthesis)):
+        field = 'impact' if isinstance(instance, models.Impact) else 'synthesis'
+        event_ids = Event.objects.filter(**{field: instance.pk}).values_list('pk', flat=True)
+        return [cache.object_tag(Event, pk) for pk in event_ids]
+    return []
+
+
+def invalidate_cache(sender, instance, **kwargs):
+    # The related objects are looked up now, while they exist
+    tags = [cache.model_tag(sender), cache.object_tag(sender, instance.pk),
+            *related_tags(instance)]
+    transaction.on_commit(lambda: cache.invalidate(*tags))
+
+
+# Simplified regions are left out: they only change with their region, and
+# without receivers they can be deleted without loading them first
+for model in (models.Region, models.Season, models.Event,
+              models.Impact, models.Synthesis, models.FitParameters, models.ReturnTime,
+              models.ObsDataset, models.ModelDataset):
+    post_save.connect(invalidate_cache, sender=model, dispatch_uid='cache-%s' % model.__name__)
+    post_delete.connect(invalidate_cache, sender=model, dispatch_uid='cache-%s' % model.__name__)
+
+
+class StatisticsChanges:
+    """Changes to the statistics in a transaction
+
+    `values` holds the `summaries.contributions` applied so far (None
+    once removed), so that a value reached through several objects,
+    such as a dataset deleted with its event, is only applied once.
+    The distributions of the changed `groups` are refreshed once the
+    transaction commits, by a job per group, so that a queued job is
+    shared by later changes to its group.
+
+    """
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.groups = set()
+
+    @classmethod
+    def current(cls):
+        connection = transaction.get_connection()
+        changes = getattr(connection, 'exevada_statistics', None)
+        # A rolled back transaction leaves its changes without the callback
+        if changes is None or not any(entry[1] == changes.commit
+                                      for entry in connection.run_on_commit):
+            changes = connection.exevada_statistics = cls()
+            transaction.on_commit(changes.commit)
+        return changes
+
+    def commit(self):
+        if self.groups:
+            cache.invalidate(cache.model_tag(models.Statistic))
+        for group in sorted(self.groups):
+            jobs.enqueue('refresh-distributions', [group],
+                         delay=settings.EXEVADA_STATISTICS_DELAY)
+
+
+def remember_values(sender, instance, **kwargs):
+    instance._statistic_values = summaries.contributions(instance)
+    if transaction.get_connection().in_atomic_block:
+        changes = StatisticsChanges.current()
+        for identity, value in instance._statistic_values.items():
+            changes.values.setdefault(identity, value)
+
+
+def update_statistics(sender, instance, **kwargs):
+    before = getattr(instance, '_statistic_values', {})
+    in_transaction = transaction.get_connection().in_atomic_block
+    changes = StatisticsChanges.current() if in_transaction else StatisticsChanges(before)
+    after = summaries.contributions(instance)
+    identities = set(before) | set(after)
+    applied = {identity: changes.values[identity] for identity in identities
+               if changes.values.get(identity) is not None}
+    changes.groups |= summaries.apply_changes(applied, after)
+    changes.values.update((identity, after.get(identity)) for identity in identities)
+    if not in_transaction:
+        changes.commit()
+
+
+for model in (models.Event, models.Season, models.Synthesis, models.ObsDataset,
+              models.ModelDataset):
+    uid = 'statistics-%s' % model.__name__
+    pre_save.connect(remember_values, sender=model, dispatch_uid=uid)
+    pre_delete.connect(remember_values, sender=model, dispatch_uid=uid)
+    post_save.connect(update_statistics, sender=model, dispatch_uid=uid)
+    post_delete.connect(update_statistics, sender=model, dispatch_uid=uid)
+
+
+def search_events(instance):
+    """Events whose search document includes (part of) an instance"""
+    if isinstance(instance, models.Event):
+        return [instance.pk]
+    if isinstance(instance, models.ObsDataset):
+        return [instance.event_id]
+    field = 'impact' if isinstance(instance, models.Impact) else 'synthesis'
+    return models.Event.objects.filter(**{field: instance.pk}).values('pk')
+
+
+def update_search(sender, instance, **kwargs):
+    search.update(search_events(instance))
+
+
+# Deleted events (also through their impact or synthesis) take their
+# document with them
+for model in (models.Event, models.Impact, models.Synthesis):
+    post_save.connect(update_search, sender=model, dispatch_uid='search-%s' % model.__name__)
+post_save.connect(update_search, sender=models.ObsDataset, dispatch_uid='search-ObsDataset')
+post_delete.connect(update_search, sender=models.ObsDataset, dispatch_uid='search-ObsDataset')
+
+
+def record_deletion(sender, instance, **kwargs):
+    models.Tombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk)
+
+
+# Deletions for the change feed, including those of cascades
+for model in (models.Region, models.Season, models.Event,
+              models.Impact, models.Synthesis, models.FitParameters, models.ReturnTime,
+              models.ObsDataset, models.ModelDataset):
+    post_delete.connect(record_deletion, sender=model, dispatch_uid='tombstone-%s' % model.__name__)
@@ -0,0 +1,279 @@
+"""Summary statistics of probability ratios and intensity changes
+
+The statistics are stored per group in the `Statistic` table: for each
+source (event syntheses, observational and model datasets), quantity
+(pr, delta_i) and dimension (all events, or per variable, region,
+season or year), with one row per key of that dimension.
+
+Each statistic keeps the running count, sum and sum of squares of its
+values. Changes to a value, or to the event it belongs to, add their
+difference to those of the groups the value was and is part of
+(`apply_changes`), which keeps the count, mean and standard deviation
+up to date. Only the distribution (extremes, quantiles, histogram)
+needs all values of a group; it is recomputed for the changed groups
+(`refresh_distributions`) by a job per group, which is delayed by
+`EXEVADA_STATISTICS_DELAY` seconds so that the changes made meanwhile
+share it. `refresh` recomputes everything of some groups, for values
+changed without signals (bulk imports), and `rebuild` computes all
+groups in a single pass over each source.
+
+"""
+
+import json
+import math
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Q
+from . import cache, models
+
+
+SOURCES = {
+    'synthesis': (models.Synthesis, 'event__'),
+    'obsdataset': (models.ObsDataset, 'event__'),
+    'modeldataset': (models.ModelDataset, 'event__'),
+}
+QUANTITIES = ['pr', 'delta_i']
+DIMENSIONS = ['all', 'variable', 'region', 'season', 'year']
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+BINS = 10
+# Fixed histogram ranges; other quantities use the range of the group
+RANGES = {'pr': (0, 1)}
+# Statistic fields that need all values of a group
+DISTRIBUTION = ['minimum', 'maximum', 'quantiles', 'histogram']
+
+
+def season_key(start, end):
+    return '%d-%d' % (start, end)
+
+
+def event_keys(variable, region_id, startdate, seasons):
+    """(dimension, key) pairs of an event"""
+    keys = [('all', ''), ('variable', variable), ('region', str(region_id)),
+            ('year', str(startdate.year))]
+    keys.extend(('season', season_key(start, end)) for start, end in set(seasons))
+    return keys
+
+
+def _rows(source, **filters):
+    """(event id, variable, region id, start date, id, *quantities) of
+    the values of a source with an event"""
+    model, prefix = SOURCES[source]
+    return model.objects.filter(**{prefix + 'isnull': False}, **filters).values_list(
+        prefix + 'pk', prefix + 'variable', prefix + 'region_id', prefix + 'startdate', 'pk',
+        *QUANTITIES)
+
+
+def _scopes(instance):
+    """(source, filters) of the values a model instance is part of"""
+
+    if isinstance(instance, models.Season):
+        # The season may move to another event
+        event_ids = {instance.event_id} | set(models.Season.objects.filter(
+            pk=instance.pk).values_list('event_id', flat=True))
+        return [(source, {prefix + 'pk__in': event_ids})
+                for source, (model, prefix) in SOURCES.items()]
+    if instance.pk is None:
+        return []
+    if isinstance(instance, models.Event):
+        return [(source, {prefix + 'pk': instance.pk})
+                for source, (model, prefix) in SOURCES.items()]
+    return [(source, {'pk': instance.pk})
+            for source, (model, prefix) in SOURCES.items() if isinstance(instance, model)]
+
+
+def contributions(instance):
+    """Values a model instance is part of, according to the database
+
+    A dict by (source, id, event id) of the (dimension, key) groups of
+    the value and its quantities.
+
+    """
+
+    rows = [(source, row) for source, filters in _scopes(instance)
+            for row in _rows(source, **filters)]
+    seasons = defaultdict(list)
+    for event_id, start, end in models.Season.objects.filter(
+            event__in={row[0] for source, row in rows}).values_list('event_id', 'start', 'end'):
+        seasons[event_id].append((start, end))
+    values = {}
+    for source, (event_id, variable, region_id, startdate, pk, *quantities) in rows:
+        groups = frozenset(event_keys(variable, region_id, startdate, seasons[event_id]))
+        values[source, pk, event_id] = (groups, tuple(quantities))
+    return values
+
+
+def _filter(dimension, key):
+    if dimension == 'all':
+        return {}
+    if dimension == 'variable':
+        return {'variable': key}
+    if dimension == 'region':
+        return {'region_id': int(key)}
+    if dimension == 'year':
+        return {'startdate__year': int(key)}
+    start, end = key.split('-')
+    events = models.Season.objects.filter(start=int(start), end=int(end)).values('event_id')
+    return {'pk__in': events}
+
+
+def _values(source, dimension, key, quantity):
+    model, prefix = SOURCES[source]
+    lookups = {prefix + name: value for name, value in _filter(dimension, key).items()}
+    # Values without an event (e.g. a synthesis being created) do not count
+    lookups[prefix + 'isnull'] = False
+    return model.objects.filter(**lookups).values_list(quantity, flat=True)
+
+
+def describe(values, quantity):
+    """Statistics of a list of values, as Statistic fields"""
+
+    values = sorted(values)
+    count = len(values)
+    total = sum(values)
+    mean = total / count
+    stddev = math.sqrt(sum((value - mean) ** 2 for value in values) / count)
+
+    def quantile(q):
+        pos = q * (count - 1)
+        low = int(pos)
+        high = min(low + 1, count - 1)
+        return values[low] + (values[high] - values[low]) * (pos - low)
+
+    low, high = RANGES.get(quantity, (values[0], values[-1]))
+    width = (high - low) / BINS or 1
+    counts = [0] * BINS
+    for value in values:
+        counts[min(max(int((value - low) / width), 0), BINS - 1)] += 1
+    return {
+        'count': count, 'total': total, 'total_squares': sum(value ** 2 for value in values),
+        'mean': mean, 'stddev': stddev,
+        'minimum': values[0], 'maximum': values[-1],
+        'quantiles': json.dumps({str(q): quantile(q) for q in QUANTILES}),
+        'histogram': json.dumps({'edges': [low + i * width for i in range(BINS + 1)],
+                                 'counts': counts}),
+    }
+
+
+def _sums(statistic):
+    """Set the mean and standard deviation from the running sums"""
+    statistic.mean = statistic.total / statistic.count
+    variance = statistic.total_squares / statistic.count - statistic.mean ** 2
+    statistic.stddev = math.sqrt(max(variance, 0))
+
+
+def apply_changes(before, after):
+    """Add the differences between two sets of `contributions` to the
+    running sums of their groups; returns the changed (source,
+    dimension, key) groups"""
+
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for identity in set(before) | set(after):
+        if before.get(identity) == after.get(identity):
+            continue
+        source = identity[0]
+        for values, sign in ((before, -1), (after, 1)):
+            groups, quantities = values.get(identity, ((), ()))
+            for dimension, key in groups:
+                for quantity, value in zip(QUANTITIES, quantities):
+                    delta = deltas[source, dimension, key, quantity]
+                    delta[0] += sign
+                    delta[1] += sign * value
+                    delta[2] += sign * value ** 2
+    if not deltas:
+        return set()
+
+    lookup = Q()
+    for source, dimension, key, quantity in deltas:
+        lookup |= Q(source=source, dimension=dimension, key=key, quantity=quantity)
+    statistics = {(statistic.source, statistic.dimension, statistic.key, statistic.quantity):
+                  statistic for statistic in models.Statistic.objects.filter(lookup)}
+    changed, created, emptied = [], [], []
+    for (source, dimension, key, quantity), (count, total, squares) in deltas.items():
+        statistic = statistics.get((source, dimension, key, quantity))
+        if statistic is None:
+            # Its extremes, quantiles and histogram come with the refresh
+            statistic = models.Statistic(
+                source=source, quantity=quantity, dimension=dimension, key=key,
+                count=0, total=0, total_squares=0, minimum=0, maximum=0,
+                quantiles='{}', histogram='{}')
+            created.append(statistic)
+        else:
+            changed.append(statistic)
+        statistic.count += count
+        statistic.total += total
+        statistic.total_squares += squares
+        if statistic.count > 0:
+            _sums(statistic)
+        elif statistic.pk:
+            emptied.append(statistic.pk)
+    models.Statistic.objects.bulk_update(
+        [statistic for statistic in changed if statistic.count > 0],
+        ['count', 'total', 'total_squares', 'mean', 'stddev'])
+    models.Statistic.objects.bulk_create(
+        [statistic for statistic in created if statistic.count > 0])
+    models.Statistic.objects.filter(pk__in=emptied).delete()
+    return {(source, dimension, key) for source, dimension, key, quantity in deltas}
+
+
+def refresh(groups):
+    """Recompute the statistics of (source, dimension, key) groups"""
+
+    if not groups:
+        return
+    with transaction.atomic():
+        for source, dimension, key in groups:
+            for quantity in QUANTITIES:
+                values = list(_values(source, dimension, key, quantity))
+                lookup = dict(source=source, quantity=quantity, dimension=dimension, key=key)
+                if values:
+                    models.Statistic.objects.update_or_create(
+                        defaults=describe(values, quantity), **lookup)
+                else:
+                    models.Statistic.objects.filter(**lookup).delete()
+    cache.invalidate(cache.model_tag(models.Statistic))
+
+
+def refresh_distributions(groups):
+    """Recompute the extremes, quantiles and histograms of (source,
+    dimension, key) groups; `apply_changes` keeps the rest"""
+
+    if not groups:
+        return
+    with transaction.atomic():
+        for source, dimension, key in groups:
+            for quantity in QUANTITIES:
+                values = list(_values(source, dimension, key, quantity))
+                # Emptied groups are removed by apply_changes
+                if values:
+                    fields = describe(values, quantity)
+                    models.Statistic.objects.filter(
+                        source=source, quantity=quantity, dimension=dimension, key=key,
+                    ).update(**{name: fields[name] for name in DISTRIBUTION})
+    cache.invalidate(cache.model_tag(models.Statistic))
+
+
+def rebuild():
+    """Recompute all statistics, in one pass over each source"""
+
+    seasons = defaultdict(list)
+    for event_id, start, end in models.Season.objects.values_list('event_id', 'start', 'end'):
+        seasons[event_id].append((start, end))
+
+    statistics = []
+    for source in SOURCES:
+        values = defaultdict(lambda: defaultdict(list))
+        for event_id, variable, region_id, startdate, pk, *quantities in _rows(source).iterator():
+            for group in event_keys(variable, region_id, startdate, seasons[event_id]):
+                for quantity, value in zip(QUANTITIES, quantities):
+                    values[group][quantity].append(value)
+        for (dimension, key), group in values.items():
+            for quantity, data in group.items():
+                statistics.append(models.Statistic(
+                    source=source, quantity=quantity, dimension=dimension, key=key,
+                    **describe(data, quantity)))
+
+    with transaction.atomic():
+        models.Statistic.objects.all().delete()
+        models.Statistic.objects.bulk_create(statistics, batch_size=1000)
+    cache.invalidate(cache.model_tag(models.Statistic))
+    return len(statistics)
@@ -0,0 +1,110 @@
+"""Synthetic regions and events, for benchmarks
+
+Regions are star-shaped polygons with irregular, smooth outlines and
+a configurable number of vertices, some with an island; events are
+records in the `import_events` JSON format, so they are loaded through
+the regular import. The same seed always gives the same data.
+
+"""
+
+import datetime
+import math
+import random
+from django.contrib.gis.geos import MultiPolygon, Polygon
+
+
+VARIABLES = ['TX3x', 'TN', 'RX1day', 'RX3day', 'wind', 'drought']
+DISTRIBUTIONS = ['GEV shift fit', 'GEV scale fit', 'Gaussian shift fit']
+
+
+def outline(rng, x, y, radius, vertices):
+    """Closed ring of `vertices` points around (x, y)"""
+
+    # A few harmonics with random phases give a coastline-like wobble
+    harmonics = [(k, rng.uniform(0, 0.3 / k), rng.uniform(0, 2 * math.pi))
+                 for k in range(2, 12)]
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * (1 + sum(a * math.sin(k * angle + phase) for k, a, phase in harmonics))
+        r *= 1 + rng.uniform(-0.01, 0.01)
+        ring.append((x + r * math.cos(angle), y + r * math.sin(angle)))
+    ring.append(ring[0])
+    return ring
+
+
+def region_area(rng, vertices):
+    radius = rng.uniform(0.5, 8)
+    x = rng.uniform(-170 + 2 * radius, 170 - 2 * radius)
+    y = rng.uniform(-60 + 2 * radius, 70 - 2 * radius)
+    polygons = [Polygon(outline(rng, x, y, radius, vertices))]
+    if rng.random() < 0.2:
+        # An island, clear of the main outline
+        angle = rng.uniform(0, 2 * math.pi)
+        polygons.append(Polygon(outline(
+            rng, x + 2.4 * radius * math.cos(angle), y + 2.4 * radius * math.sin(angle),
+            0.3 * radius, max(vertices // 10, 8))))
+    return MultiPolygon(polygons, srid=4326)
+
+
+def iter_regions(count, vertices=1000, seed=0):
+    """(name, area) pairs; the vertex counts vary from half to twice
+    `vertices`"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield 'Synthetic region %d' % i, region_area(
+            rng, rng.randint(max(vertices // 2, 4), max(vertices * 2, 4)))
+
+
+def _dataset_values(rng):
+    return {'pr': round(rng.uniform(0, 1), 4), 'delta_i': round(rng.gauss(1.5, 1), 3)}
+
+
+def event_record(rng, i, regions, obsdatasets=2, modeldatasets=2):
+    """Event in the import format, with on average `obsdatasets`
+    observational and `modeldatasets` model datasets"""
+
+    variable = rng.choice(VARIABLES)
+    start = datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(70 * 365))
+    season = rng.randint(1, 12)
+    obs = []
+    for j in range(rng.randint(0, 2 * obsdatasets)):
+        mu = rng.uniform(10, 40)
+        sigma = rng.uniform(0.5, 5)
+        value = mu + sigma * rng.uniform(1, 5)
+        obs.append(dict(_dataset_values(rng), value=round(value, 2),
+                        doi='10.0000/obs.%d.%d' % (i, j),
+                        comments="Observed %s in station series %d" % (variable, j),
+                        fit_parameters=[{'mu': round(mu, 3), 'sigma': round(sigma, 3),
+                                         'xi': round(rng.uniform(-0.4, 0.2), 3),
+                                         'alpha': round(rng.uniform(0, 2), 3)}],
+                        return_times=[{'value': 100, 'lower': 20, 'upper': 1000}]))
+    return {
+        'name': "Synthetic %s event %d" % (variable, i),
+        'region': rng.choice(regions),
+        'startdate': start.isoformat(),
+        'duration': rng.randint(1, 30),
+        'variable': variable,
+        'fitted_distribution': rng.choice(DISTRIBUTIONS),
+        'impact': {'deaths': rng.randrange(1000), 'affected': rng.randrange(100000),
+                   'request': "Attribution request %d" % i,
+                   'comments': "Impacts of the %s event" % variable},
+        'synthesis': dict(_dataset_values(rng),
+                          conclusions="The %s event was made more likely by climate change"
+                          % variable,
+                          contact='synthetic@example.org', webpage='https://example.org/%d' % i,
+                          doi='10.0000/synthesis.%d' % i),
+        'seasons': [{'start': season, 'end': (season + rng.randint(0, 2) - 1) % 12 + 1}],
+        'obs_datasets': obs,
+        'model_datasets': [
+            dict(_dataset_values(rng), model_type=rng.choice(['CMIP5', 'CORDEX', 'HadGEM3-A']),
+                 period='1-in-%d years' % rng.choice([10, 50, 100]), trend='positive')
+            for j in range(rng.randint(0, 2 * modeldatasets))],
+    }
+
+
+def iter_events(count, regions, seed=0, **kwargs):
+    """Event records, in random regions (given by name)"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield event_record(rng, i, regions, **kwargs)
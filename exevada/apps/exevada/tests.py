@@ -1,3 +1,1337 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import math
+import re
+import struct
+import threading
+import unittest
+import zipfile
+from unittest import mock
+import django
+import numpy as np
+from asgiref.sync import async_to_sync
+from django import test
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Point, Polygon
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from . import (api, asyncviews, benchmarks, bootstrap, cache, changes, export, gev, jobs,
+               models, pagination, profiling, routers, search, summaries, tiles, views)
+from .bulk import bulk_insert
+from .forms import SpatialSearchForm
+from .geometry import (KM_PER_DEGREE, SIMPLIFY_LEVELS, expand_envelope, geohash,
+                       level_for_zoom, simplify)
+from .management.commands.import_events import iter_json
 
-# Create your tests here.
+
+class TestCase(test.TestCase):
+    """Test case starting with an empty response cache
+
+    Cached responses are invalidated when a transaction commits, which
+    the transactions of a TestCase never do.
+
+    """
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        cache.get_cache().clear()
+
+
+def create_event(name='Heatwave', region=None):
+    if region is None:
+        region = models.Region.objects.create(
+            name=name, area=MultiPolygon(Polygon.from_bbox((0, 50, 10, 55)), srid=4326))
+    impact = models.Impact.objects.create(deaths=0, affected=0, request='', comments='')
+    synthesis = models.Synthesis.objects.create(
+        pr=0.5, delta_i=1, conclusions='', contact='', webpage='https://example.org', doi='')
+    return models.Event.objects.create(
+        name=name, region=region, startdate=datetime.date(2019, 7, 20), duration=5,
+        variable='TX3x', fitted_distribution='GEV', impact=impact, synthesis=synthesis)
+
+
+def create_obsdataset(event):
+    dataset = models.ObsDataset.objects.create(
+        event=event, value=40, doi='', pr=0.5, delta_i=1, comments='')
+    models.FitParameters.objects.create(obsdataset=dataset, mu=30, sigma=2, xi=-0.2, alpha=1)
+    models.ReturnTime.objects.create(obsdataset=dataset, value=100, lower=20, upper=1000)
+    return dataset
+
+
+# Query counts are those of uncached responses
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class EventDatasetsTest(TestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_obsdatasets_are_event_scoped(self):
+        event = create_event()
+        dataset = create_obsdataset(event)
+        create_obsdataset(create_event('Other'))
+        response = self.client.get(reverse('exevada:obsdata', args=[event.pk]))
+        self.assertEqual(list(response.context['datasets']), [dataset])
+
+    def test_obsdatasets_query_count(self):
+        event = create_event()
+        url = reverse('exevada:obsdata', args=[event.pk])
+        create_obsdataset(event)
+        few = self.count_queries(url)
+        for i in range(10):
+            create_obsdataset(event)
+        self.assertEqual(self.count_queries(url), few)
+        # Event, datasets, fit parameters and return times
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_modeldatasets_query_count(self):
+        event = create_event()
+        url = reverse('exevada:modeldata', args=[event.pk])
+        for i in range(10):
+            models.ModelDataset.objects.create(
+                event=event, model_type='', period='', trend='', pr=0.5, delta_i=1)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_unknown_event(self):
+        response = self.client.get(reverse('exevada:obsdata', args=[1000]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ApiTest(TestCase):
+    def test_api_limit(self):
+        first = create_event('Event 0')
+        create_event('Event 1')
+        for limit in (0, -5):
+            response = self.client.get(reverse('exevada:api-events'), {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual([event['id'] for event in data['results']], [first.pk])
+            self.assertIn('after=%d' % first.pk, data['next'])
+
+    def test_conditional_requests(self):
+        event = create_event()
+        url = reverse('exevada:api-events-detail', args=[event.pk])
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(last_modified, http_date(event.updated.timestamp()))
+
+        # Answered from the validators alone, cached or not
+        for clear in (False, True):
+            if clear:
+                cache.get_cache().clear()
+            with mock.patch.object(api.ResourceDetail, 'get_data') as get_data:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['Last-Modified'], last_modified)
+            get_data.assert_not_called()
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(
+            event.updated.timestamp() - 3600))
+        self.assertEqual(response.status_code, 200)
+        # Done by the signal handlers when the transaction commits
+        cache.invalidate(cache.object_tag(models.Event, event.pk))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['name'], event.name)
+
+        # Deletions count as modifications
+        models.Tombstone.objects.create(model='season', object_id=1)
+        deleted = models.Tombstone.objects.get().deleted
+        cache.get_cache().clear()
+        response = self.client.get(url)
+        self.assertEqual(response['Last-Modified'], http_date(deleted.timestamp()))
+
+
+def sequential_scans(plan, tables):
+    """Tables scanned in full according to a query plan (PostgreSQL
+    or SQLite); scans in index order are fine"""
+    return [table for table in tables
+            if re.search(r'Seq Scan on %s\b|\bSCAN (TABLE )?%s\b(?! USING)' % (table, table), plan)]
+
+
+class QueryPlanTest(TestCase):
+    """The main listing queries use indexes, on enough data for the
+    query planner to prefer them"""
+
+    events = 5000
+    tables = ['exevada_event', 'exevada_synthesis']
+
+    @classmethod
+    def setUpTestData(cls):
+        regions = [
+            models.Region(name='Region %d' % i,
+                          area=MultiPolygon(Polygon.from_bbox((i, 0, i + 1, 1)), srid=4326))
+            for i in range(50)]
+        for region in regions:
+            region.set_derived_fields()
+        regions = bulk_insert(models.Region, regions)
+        impacts = bulk_insert(models.Impact, [
+            models.Impact(deaths=0, affected=0, request='', comments='')
+            for i in range(cls.events)])
+        syntheses = bulk_insert(models.Synthesis, [
+            models.Synthesis(pr=i / cls.events, delta_i=1, conclusions='', contact='',
+                             webpage='https://example.org', doi='')
+            for i in range(cls.events)])
+        variables = ['TX3x', 'TN', 'RX1day', 'RX3day', 'wind']
+        events = [
+            models.Event(name='Event %d' % i, region=regions[i % len(regions)],
+                         startdate=datetime.date(1950, 1, 1) + datetime.timedelta(days=5 * i),
+                         duration=3, variable=variables[i % len(variables)],
+                         fitted_distribution='GEV', impact=impacts[i], synthesis=syntheses[i])
+            for i in range(cls.events)]
+        for event in events:
+            event.set_enddate()
+        bulk_insert(models.Event, events)
+        cls.region = regions[3]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertIndexed(self, queryset):
+        plan = queryset.explain()
+        self.assertEqual(sequential_scans(plan, self.tables), [], plan)
+
+    def events_queryset(self, query):
+        view = views.Events()
+        view.setup(RequestFactory().get('/', query))
+        return view.get_queryset()[:view.paginate_by + 1]
+
+    def test_events(self):
+        queries = [
+            {},
+            {'sort': 'startdate'},
+            {'variable': 'TX3x'},
+            {'start': '2000-01-01', 'end': '2001-01-01'},
+            {'region': self.region.pk, 'start': '1970-01-01', 'end': '1990-01-01'},
+            {'sort': '-pr'},
+            {'sort': 'pr', 'variable': 'TN'},
+            {'active_from': '1980-07-10', 'active_until': '1980-07-20'},
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertIndexed(self.events_queryset(query))
+
+    def test_index(self):
+        view = views.Index()
+        view.setup(RequestFactory().get('/'))
+        self.assertIndexed(view.get_queryset())
+
+
+class EventPeriodTest(TestCase):
+    def create_event(self, name, startdate, duration, seasons=()):
+        event = create_event(name, region=self.region)
+        event.startdate, event.duration = startdate, duration
+        event.save()
+        for start, end in seasons:
+            models.Season.objects.create(event=event, start=start, end=end)
+        return event
+
+    def setUp(self):
+        self.region = create_event('Other').region
+        self.july = self.create_event('July', datetime.date(2019, 7, 18), 5, [(7, 7)])
+        self.winter = self.create_event('Winter', datetime.date(2018, 12, 20), 30, [(12, 2)])
+        self.summer = self.create_event('Summer', datetime.date(2018, 6, 1), 92, [(6, 8)])
+
+    def names(self, queryset):
+        return sorted(queryset.exclude(name='Other').values_list('name', flat=True))
+
+    def test_enddate(self):
+        self.assertEqual(self.july.enddate, datetime.date(2019, 7, 22))
+        self.assertEqual(self.winter.enddate, datetime.date(2019, 1, 18))
+
+    def test_active_between(self):
+        events = models.Event.objects
+        self.assertEqual(self.names(events.active_between(
+            datetime.date(2019, 7, 10), datetime.date(2019, 7, 20))), ['July'])
+        self.assertEqual(self.names(events.active_between(
+            datetime.date(2019, 1, 1), datetime.date(2019, 1, 5))), ['Winter'])
+        self.assertEqual(self.names(events.active_between(datetime.date(2019, 7, 23), None)), [])
+
+    def test_in_months(self):
+        events = models.Event.objects
+        self.assertEqual(self.names(events.in_months(6, 8)), ['July', 'Summer'])
+        self.assertEqual(self.names(events.in_months(1, 1)), ['Winter'])
+        self.assertEqual(self.names(events.in_months(11, 12)), ['Winter'])
+        self.assertEqual(self.names(events.in_months(8, 6)), ['Summer', 'Winter'])
+        self.assertEqual(self.names(events.in_months(3, 5)), [])
+
+    def test_filter_form(self):
+        response = self.client.get(reverse('exevada:events'), {'season_start': 1})
+        self.assertEqual([event.name for event in response.context['events']], ['Winter'])
+
+    def test_sort_links(self):
+        response = self.client.get(reverse('exevada:events'),
+                                   {'variable': 'TX3x', 'sort': 'startdate', 'after': 'x'})
+        self.assertContains(response, 'href="?variable=TX3x&amp;sort=-pr"')
+        response = self.client.get(reverse('exevada:events'))
+        self.assertContains(response, 'href="?sort=startdate"')
+
+    def test_invalid_cursor(self):
+        for values in (['x', [1]], [{}, 1], ['2000-01-01']):
+            response = self.client.get(reverse('exevada:events'),
+                                       {'after': pagination.encode_cursor(values)})
+            self.assertEqual(response.status_code, 200)
+
+
+class RegionTest(TestCase):
+    def setUp(self):
+        self.region = create_event().region
+
+    def test_derived_fields(self):
+        region = self.region
+        self.assertEqual((region.xmin, region.ymin, region.xmax, region.ymax), (0, 50, 10, 55))
+        self.assertAlmostEqual(region.centroid_x, 5)
+        self.assertAlmostEqual(region.centroid_y, 52.5)
+        self.assertEqual(region.num_vertices, 5)
+        # About 10 degrees of longitude by 5 of latitude at 52.5 N
+        self.assertAlmostEqual(region.area_km2, 111.2 ** 2 * 50 * math.cos(math.radians(52.5)),
+                               delta=1000)
+
+    def test_area_deferred(self):
+        region = models.Region.objects.get(pk=self.region.pk)
+        self.assertIn('area', region.get_deferred_fields())
+        event = models.Event.objects.get(region=region)
+        self.assertIn('area', event.region.get_deferred_fields())
+        region = models.Region.objects.with_area().get(pk=self.region.pk)
+        self.assertNotIn('area', region.get_deferred_fields())
+
+    def test_regions_query_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('exevada:regions'), {'sort': '-area'})
+        self.assertContains(response, 'km²')
+
+    def test_shapes(self):
+        url = reverse('exevada:region-shape', args=[self.region.pk, 'wkb'])
+        response = self.client.get(url, {'zoom': 20})
+        self.assertEqual(GEOSGeometry(memoryview(response.content)), self.region.area)
+        url = reverse('exevada:region-shape', args=[self.region.pk, 'twkb'])
+        response = self.client.get(url, {'zoom': 20, 'precision': 0})
+        # MultiPolygon, 1 polygon, 1 ring, 5 points: (0, 50), then the deltas
+        self.assertEqual(response.content, bytes([
+            0x06, 0, 1, 1, 5, 0, 100, 0, 10, 20, 0, 0, 9, 19, 0]))
+        url = reverse('exevada:region-shape', args=[self.region.pk, 'svg'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_shape_collection(self):
+        shape = self.client.get(reverse('exevada:region-shape', args=[self.region.pk, 'twkb']),
+                                {'precision': 0}).content
+        response = self.client.get(reverse('exevada:region-shapes'), {'precision': 0})
+        # Collection with ids, of one region
+        self.assertEqual(response.content[:3], bytes([0x07, 0x04, 1]))
+        self.assertTrue(response.content.endswith(shape))
+
+    def test_invalid_area(self):
+        url = reverse('exevada:add-region')
+        response = self.client.post(url, {'name': 'Invalid', 'area_0': '', 'area_1': 'POLYGON ((0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['area'])
+        self.assertContains(response, 'POLYGON ((0')
+        upload = SimpleUploadedFile('area.wkt', b'not an area')
+        response = self.client.post(url, {'name': 'Invalid', 'area_0': upload, 'area_1': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['area'])
+
+    def test_upload_types(self):
+        url = reverse('exevada:add-region')
+        vrt = (b'<OGRVRTDataSource><OGRVRTLayer name="area">'
+               b'<SrcDataSource>/etc/passwd</SrcDataSource></OGRVRTLayer></OGRVRTDataSource>')
+        upload = SimpleUploadedFile('area.vrt', vrt)
+        response = self.client.post(url, {'name': 'VRT', 'area_0': upload, 'area_1': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Unsupported file type .vrt", response.context['form'].errors['area'][0])
+        # Nor inside a zip archive
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('area.vrt', vrt)
+        upload = SimpleUploadedFile('area.zip', archive.getvalue())
+        response = self.client.post(url, {'name': 'VRT', 'area_0': upload, 'area_1': ''})
+        self.assertIn("Unsupported file type .vrt", response.context['form'].errors['area'][0])
+        self.assertFalse(models.Region.objects.filter(name='VRT').exists())
+
+
+@override_settings(EXEVADA_CHANGES_SETTLE=0)
+# The invalidations wait for the transaction to commit
+class InvalidationTest(TransactionTestCase):
+    def test_invalidate_on_commit(self):
+        region = create_event().region
+        with mock.patch.object(cache, 'invalidate') as invalidate, \
+                mock.patch.object(tiles, 'invalidate') as invalidate_tiles:
+            with transaction.atomic():
+                region.name = 'Renamed'
+                region.save()
+                invalidate.assert_not_called()
+                invalidate_tiles.assert_not_called()
+            invalidate.assert_called_once_with(
+                cache.model_tag(models.Region), cache.object_tag(models.Region, region.pk))
+            self.assertTrue(invalidate_tiles.called)
+            for call in invalidate_tiles.call_args_list:
+                self.assertEqual(call, mock.call((0, 50, 10, 55)))
+
+
+def read_varints(data):
+    """Integers of a packed buffer of varints"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def read_message(data):
+    """(field, value) pairs of a protocol buffers message: integers for
+    varints, bytes for the other wire types"""
+    fields = []
+    pos = 0
+
+    def varint():
+        nonlocal pos
+        start = pos
+        while data[pos] & 0x80:
+            pos += 1
+        pos += 1
+        return read_varints(data[start:pos])[0]
+
+    while pos < len(data):
+        key = varint()
+        field, wiretype = key >> 3, key & 7
+        if wiretype == 0:
+            value = varint()
+        elif wiretype == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length = varint()
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((field, value))
+    return fields
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_commands(commands):
+    """Rings of absolute tile coordinates from geometry commands"""
+    rings = []
+    x = y = i = 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == tiles.CLOSEPATH:
+            rings[-1].append(rings[-1][0])
+            continue
+        if command == tiles.MOVETO:
+            rings.append([])
+        for j in range(count):
+            x, y = x + unzigzag(commands[i]), y + unzigzag(commands[i + 1])
+            i += 2
+            rings[-1].append((x, y))
+    return rings
+
+
+def decode_tile(data):
+    """Layers of a vector tile by name, as dicts"""
+    layers = {}
+    for field, layer_data in read_message(data):
+        layer = {'keys': [], 'values': [], 'features': []}
+        for name, value in read_message(layer_data):
+            if name == 1:
+                layers[value.decode()] = layer
+            elif name == 2:
+                layer['features'].append(dict(read_message(value)))
+            elif name == 3:
+                layer['keys'].append(value.decode())
+            elif name == 4:
+                (kind, value), = read_message(value)
+                layer['values'].append(
+                    value.decode() if kind == 1 else struct.unpack('<d', value)[0]
+                    if kind == 3 else unzigzag(value) if kind == 6 else value)
+            elif name == 5:
+                layer['extent'] = value
+            elif name == 15:
+                layer['version'] = value
+        for feature in layer['features']:
+            tags = read_varints(feature[2])
+            feature['properties'] = {layer['keys'][key]: layer['values'][value]
+                                     for key, value in zip(tags[::2], tags[1::2])}
+            feature['rings'] = decode_commands(read_varints(feature[4]))
+    return layers
+
+
+def ring_area(ring):
+    """Twice the signed area of a closed ring"""
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+
+
+def circle(x, y, radius, points):
+    """Closed ring approximating a circle"""
+    ring = [(x + radius * math.cos(2 * math.pi * i / points),
+             y + radius * math.sin(2 * math.pi * i / points)) for i in range(points)]
+    return ring + ring[:1]
+
+
+class GeometryTest(SimpleTestCase):
+    def test_level_for_zoom(self):
+        self.assertIsNone(level_for_zoom(None))
+        levels = [level_for_zoom(zoom) for zoom in range(12)]
+        self.assertEqual(levels, [0, 0, 0, 0, 1, 1, 1, 2, 2, 2, None, None])
+        # Each level is used up to its zoom level
+        for level, (tolerance, maxzoom) in enumerate(SIMPLIFY_LEVELS):
+            self.assertEqual(level_for_zoom(maxzoom), level)
+        self.assertIsNone(level_for_zoom(tiles.MAXZOOM))
+
+    def test_simplify(self):
+        polygon = Polygon(circle(5, 50, 5, 3600), srid=4326)
+        previous = polygon.num_coords
+        for tolerance, maxzoom in SIMPLIFY_LEVELS[::-1]:
+            simplified = simplify(polygon, tolerance)
+            self.assertEqual((simplified.geom_type, simplified.srid), ('MultiPolygon', 4326))
+            # Fewer vertices at larger tolerances, for about the same area
+            self.assertLess(simplified.num_coords, previous)
+            self.assertAlmostEqual(simplified.area / polygon.area, 1, delta=0.03)
+            previous = simplified.num_coords
+        self.assertLess(simplify(polygon, 0.1).num_coords, 100)
+
+    def test_simplify_topology(self):
+        # A hole closer to the shell than the tolerance
+        polygon = MultiPolygon(Polygon(circle(5, 50, 5, 720), circle(9.8, 50, 0.1, 72)),
+                               srid=4326)
+        simplified = simplify(polygon, 0.5)
+        self.assertTrue(simplified.valid)
+        self.assertEqual(len(simplified), 1)
+        self.assertEqual(len(simplified[0]), 2)
+        self.assertTrue(polygon.buffer(0.5).contains(simplified))
+        # Separate parts stay separate
+        parts = MultiPolygon(Polygon(circle(0, 0, 1, 360)), Polygon(circle(2.05, 0, 1, 360)),
+                             srid=4326)
+        simplified = simplify(parts, 0.1)
+        self.assertTrue(simplified.valid)
+        self.assertEqual(len(simplified), 2)
+        self.assertFalse(simplified[0].intersects(simplified[1]))
+
+
+class TilesTest(SimpleTestCase):
+    def test_zigzag(self):
+        for value, encoded in [(0, 0), (-1, 1), (1, 2), (-2, 3), (2, 4),
+                               (2 ** 31 - 1, 2 ** 32 - 2), (-2 ** 31, 2 ** 32 - 1)]:
+            self.assertEqual(tiles._zigzag(value), encoded)
+            self.assertEqual(unzigzag(encoded), value)
+
+    def test_ring_commands(self):
+        square = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+        cursor = [0, 0]
+        # MoveTo(1), LineTo(3), ClosePath(1), with zigzag deltas
+        self.assertEqual(tiles._ring_commands(square, True, cursor),
+                         [9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15])
+        self.assertEqual(cursor, [0, 10])
+        # Relative to the end of the previous ring
+        commands = tiles._ring_commands(square, True, cursor)
+        self.assertEqual(commands[:3], [9, 0, 19])
+        # Repeated points are dropped, and degenerate rings left out
+        repeated = [(0, 0), (10, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+        self.assertEqual(tiles._ring_commands(repeated, True, [0, 0]),
+                         [9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15])
+        self.assertEqual(tiles._ring_commands([(0, 0), (5, 5), (0, 0)], True, [0, 0]), [])
+        self.assertEqual(tiles._ring_commands([(0, 0), (5, 5), (9, 9)], True, [0, 0]), [])
+
+    def test_winding(self):
+        project = tiles._projector(0, 0, 0)
+        # Exterior and hole, both given counterclockwise and clockwise
+        exterior = ((-40, -40), (40, -40), (40, 40), (-40, 40), (-40, -40))
+        hole = ((-10, -10), (10, -10), (10, 10), (-10, 10), (-10, -10))
+        for rings in [(exterior, hole), (exterior[::-1], hole[::-1])]:
+            with self.subTest(rings=rings):
+                commands = tiles.geometry_commands(Polygon(*rings), project)
+                outer, inner = decode_commands(commands)
+                # Clockwise exterior in tile coordinates (y down)
+                self.assertGreater(ring_area(outer), 0)
+                self.assertLess(ring_area(inner), 0)
+
+    def test_clip(self):
+        # The east half of the world, down to the equator
+        z, x, y = 1, 1, 0
+        xmin, ymin, xmax, ymax = tiles.tile_bounds(z, x, y, tiles.BUFFER)
+        self.assertAlmostEqual(xmin, -180 * tiles.BUFFER / tiles.EXTENT)
+        area = MultiPolygon(Polygon.from_bbox((-10, 10, 10, 20)), srid=4326)
+        clipped = tiles.clip(area, z, x, y)
+        for actual, expected in zip(clipped.extent, (xmin, 10, 10, 20)):
+            self.assertAlmostEqual(actual, expected)
+        inside = MultiPolygon(Polygon.from_bbox((10, 10, 20, 20)), srid=4326)
+        self.assertIs(tiles.clip(inside, z, x, y), inside)
+        outside = MultiPolygon(Polygon.from_bbox((-100, 10, -90, 20)), srid=4326)
+        self.assertIsNone(tiles.clip(outside, z, x, y))
+        # Within the buffer of the tile
+        ring, = decode_commands(tiles.geometry_commands(clipped, tiles._projector(z, x, y)))
+        self.assertEqual(min(px for px, py in ring), -tiles.BUFFER)
+
+    def test_round_trip(self):
+        area = MultiPolygon(Polygon.from_bbox((0, 50, 10, 55)), srid=4326)
+        z = 4
+        (x, _), (y, _) = tiles.tile_range(area.extent, z)
+        properties = {'name': 'Region', 'events': 2, 'change': -3, 'pr': 0.5, 'missing': None}
+        layers = decode_tile(tiles.encode_regions([(7, area, properties)], z, x, y))
+        self.assertEqual(list(layers), ['regions'])
+        layer = layers['regions']
+        self.assertEqual((layer['version'], layer['extent']), (2, tiles.EXTENT))
+        feature, = layer['features']
+        self.assertEqual((feature[1], feature[3]), (7, tiles.POLYGON))
+        self.assertEqual(feature['properties'],
+                         {'name': 'Region', 'events': 2, 'change': -3, 'pr': 0.5})
+        ring, = feature['rings']
+        project = tiles._projector(z, x, y)
+        self.assertEqual(set(ring), {project(*point) for point in area[0][0]})
+        self.assertGreater(ring_area(ring), 0)
+
+
+class SpatialTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def region(name, polygon):
+            return models.Region.objects.create(name=name, area=MultiPolygon(polygon, srid=4326))
+        cls.west = region('West', Polygon.from_bbox((0, 50, 10, 55)))
+        cls.east = region('East', Polygon.from_bbox((20, 50, 30, 55)))
+        # Its envelope covers points outside of it
+        cls.corner = region('Corner', Polygon(
+            ((40, 0), (50, 0), (50, 1), (41, 1), (41, 10), (40, 10), (40, 0))))
+        create_event('Heatwave', region=cls.west)
+
+    def names(self, queryset):
+        return sorted(region.name for region in queryset)
+
+    def test_containing(self):
+        regions = models.Region.objects
+        self.assertEqual(self.names(regions.containing(Point(5, 52, srid=4326))), ['West'])
+        self.assertEqual(self.names(regions.containing(Point(40.5, 5, srid=4326))), ['Corner'])
+        self.assertEqual(self.names(regions.containing(Point(45, 5, srid=4326))), [])
+
+    def test_within_distance(self):
+        # About 135 km east of West, at 52.5 N
+        point = Point(12, 52.5, srid=4326)
+        regions = models.Region.objects
+        self.assertEqual(self.names(regions.within_distance(point, 100)), [])
+        self.assertEqual(self.names(regions.within_distance(point, 200)), ['West'])
+        self.assertEqual(self.names(regions.within_distance(point, 1000)), ['East', 'West'])
+
+    def test_intersecting(self):
+        regions = models.Region.objects
+        self.assertEqual(self.names(regions.intersecting((9, 54, 21, 56))), ['East', 'West'])
+        self.assertEqual(self.names(regions.intersecting((11, 50, 19, 55))), [])
+        self.assertEqual(self.names(regions.intersecting((42, 2, 48, 8))), [])
+
+    def test_expand_envelope(self):
+        self.assertEqual(expand_envelope((0, 0, 1, 1), 0, 0), (0, 0, 1, 1))
+        xmin, ymin, xmax, ymax = expand_envelope((0, 0, 1, 1), 0, KM_PER_DEGREE)
+        self.assertAlmostEqual(ymin, -1)
+        self.assertAlmostEqual(ymax, 2)
+        # Wider by a degree at the latitude reached (1 N)
+        self.assertAlmostEqual(xmin, -1 / math.cos(math.radians(1)))
+        # Twice as wide at 59 N, by the latitude reached
+        bbox = expand_envelope((0, 58, 1, 59), 59, KM_PER_DEGREE)
+        self.assertAlmostEqual(bbox[2], 1 + 2)
+        self.assertAlmostEqual(bbox[3], 60)
+        # All longitudes near the poles, and latitudes clamped
+        xmin, ymin, xmax, ymax = expand_envelope((0, 89, 1, 89.5), 89.5, 200)
+        self.assertEqual((xmin, xmax, ymax), (-180, 180, 90))
+        self.assertAlmostEqual(ymin, 89 - 200 / KM_PER_DEGREE)
+        self.assertEqual(expand_envelope((-179.5, 0, 179.5, 1), 0, 500)[::2], (-180, 180))
+
+    def test_search_view(self):
+        url = reverse('exevada:search-events')
+        response = self.client.get(url, {'lon': 5, 'lat': 52})
+        self.assertEqual([event.name for event in response.context['events']], ['Heatwave'])
+        response = self.client.get(url, {'bbox': '20,50,21,51'})
+        self.assertEqual(list(response.context['events']), [])
+        response = self.client.get(url, {'lon': 5})
+        self.assertEqual(list(response.context['events']), [])
+        self.assertTrue(response.context['form'].errors)
+
+
+class SpatialSearchFormTest(SimpleTestCase):
+    def test_point_or_bbox(self):
+        valid = [{'lon': 5, 'lat': 52}, {'lon': 5, 'lat': 52, 'radius': 10},
+                 {'bbox': '0,50,10,55'}]
+        invalid = [{}, {'lon': 5}, {'lon': 5, 'lat': 52, 'bbox': '0,50,10,55'},
+                   {'bbox': '0,50,10,55', 'radius': 10}, {'lon': 181, 'lat': 0},
+                   {'lon': 0, 'lat': -91}, {'lon': 5, 'lat': 52, 'radius': -1}]
+        for data in valid:
+            with self.subTest(data=data):
+                self.assertTrue(SpatialSearchForm(data).is_valid())
+        for data in invalid:
+            with self.subTest(data=data):
+                self.assertFalse(SpatialSearchForm(data).is_valid())
+
+    def test_bbox(self):
+        form = SpatialSearchForm({'bbox': '0,50,10,55'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['bbox'], (0, 50, 10, 55))
+        for bbox in ('0,50,nan,55', '-inf,50,10,55', '0,50,10,inf', '0,50,10', '10,50,0,55'):
+            with self.subTest(bbox=bbox):
+                self.assertFalse(SpatialSearchForm({'bbox': bbox}).is_valid())
+
+
+class SearchTest(TestCase):
+    def create_event(self, name, conclusions):
+        event = create_event(name)
+        event.synthesis.conclusions = conclusions
+        event.synthesis.save()
+        return event
+
+    def search(self, query):
+        return [pk for pk, _, _ in search.search(query)]
+
+    def test_search(self):
+        heatwave = self.create_event('Heatwave', "Climate change made the heat and drought "
+                                     "more likely.")
+        drought = self.create_event('Drought', "The heat made the drought worse.")
+        self.assertEqual(self.search('heatwave'), [heatwave.pk])
+        self.assertEqual(self.search('climate heat'), [heatwave.pk])
+        self.assertEqual(self.search('heat flood'), [])
+        # Stemmed words match, and titles rank higher than bodies
+        self.assertEqual(self.search('droughts'), [drought.pk, heatwave.pk])
+        self.assertEqual(set(self.search('heat')), {heatwave.pk, drought.pk})
+        [(_, _, snippet)] = search.search('likely')
+        self.assertIn('<mark>likely</mark>', snippet)
+        self.assertEqual(search.search('""'), [])
+
+    def test_phrase(self):
+        change = self.create_event('Heatwave', "Climate change made it more likely.")
+        climate = self.create_event('Drought', "A change in the climate made it more likely.")
+        self.assertEqual(set(self.search('climate change')), {change.pk, climate.pk})
+        self.assertEqual(self.search('"climate change"'), [change.pk])
+        self.assertEqual(self.search('"change climate"'), [])
+        self.assertEqual(search.parse('heat "climate change" "" wave'),
+                         ['heat', 'climate change', 'wave'])
+
+    def test_index_updates(self):
+        event = self.create_event('Heatwave', "Made more likely.")
+        self.assertEqual(self.search('heatwave'), [event.pk])
+        event.name = 'Hot spell'
+        event.save()
+        self.assertEqual(self.search('heatwave'), [])
+        self.assertEqual(self.search('spell'), [event.pk])
+        event.impact.comments = "Crops failed."
+        event.impact.save()
+        self.assertEqual(self.search('crops'), [event.pk])
+        dataset = create_obsdataset(event)
+        dataset.comments = "Station records"
+        dataset.save()
+        self.assertEqual(self.search('station'), [event.pk])
+        dataset.delete()
+        self.assertEqual(self.search('station'), [])
+        event.delete()
+        self.assertEqual(self.search('spell'), [])
+        self.assertFalse(models.SearchDocument.objects.exists())
+
+    def test_rebuild(self):
+        event = self.create_event('Heatwave', "Made more likely.")
+        models.SearchDocument.objects.all().delete()
+        self.assertEqual(self.search('heatwave'), [])
+        self.assertEqual(search.rebuild(), 1)
+        self.assertEqual(self.search('heatwave'), [event.pk])
+
+
+class ChangesTest(TestCase):
+    def setUp(self):
+        self.event = create_event()
+        self.dataset = create_obsdataset(self.event)
+        models.Season.objects.create(event=self.event, start=12, end=2)
+
+    def read_feed(self, cursor=None, limit=2):
+        """All pages of a sweep, through JSON as a mirror gets them"""
+        pages = []
+        while True:
+            response = self.client.get(reverse('exevada:api-changes'),
+                                       {'limit': limit, 'cursor': cursor or ''})
+            pages.append(response.json())
+            cursor = pages[-1]['cursor']
+            if not pages[-1]['more']:
+                return pages
+
+    def test_feed(self):
+        pages = self.read_feed()
+        ids = {}
+        for page in pages:
+            for name, objs in page['changes'].items():
+                ids.setdefault(name, []).extend(obj['id'] for obj in objs)
+        self.assertEqual(ids['events'], [self.event.pk])
+        self.assertEqual(ids['regions'], [self.event.region_id])
+        self.assertEqual(ids['obsdatasets'], [self.dataset.pk])
+        self.assertEqual(len(ids['fitparameters']), 1)
+        self.assertIn('area', pages[0]['changes']['regions'][0])
+
+        # Only the changes since, including deletions
+        self.dataset.comments = 'Updated'
+        self.dataset.save()
+        models.ReturnTime.objects.all().delete()
+        pages = self.read_feed(pages[-1]['cursor'], limit=100)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(list(pages[0]['changes']), ['obsdatasets'])
+        self.assertEqual(pages[0]['changes']['obsdatasets'][0]['comments'], 'Updated')
+        self.assertEqual(len(pages[0]['deleted']['returntimes']), 1)
+        self.assertEqual(self.read_feed(pages[-1]['cursor'])[0]['changes'], {})
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('exevada:api-changes'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_apply(self):
+        page = self.read_feed(limit=1000)[0]
+        region = models.Region.objects.with_area().get()
+        models.Region.objects.all().delete()
+        self.assertFalse(models.ObsDataset.objects.exists())
+
+        self.assertEqual(changes.apply(page), 8)
+        event = models.Event.objects.get(pk=self.event.pk)
+        self.assertEqual(event.enddate, self.event.enddate)
+        self.assertEqual(event.region.name, region.name)
+        self.assertEqual(models.Region.objects.with_area().get().area, region.area)
+        self.assertEqual(models.Season.objects.get().unwrapped_end, 14)
+        self.assertEqual(models.ReturnTime.objects.get().obsdataset_id, self.dataset.pk)
+        self.assertTrue(models.SearchDocument.objects.filter(event=event).exists())
+
+        # Applying again updates in place
+        page['changes']['syntheses'][0]['pr'] = 0.25
+        changes.apply(page)
+        self.assertEqual(models.Synthesis.objects.get().pr, 0.25)
+        self.assertEqual(models.Event.objects.count(), 1)
+
+
+class ClusterTest(TestCase):
+    def setUp(self):
+        # Two events in one region, one in a neighbouring region
+        self.region = create_event('Heatwave 1').region
+        create_event('Heatwave 2', region=self.region)
+        other = models.Region.objects.create(
+            name='Other', area=MultiPolygon(Polygon.from_bbox((10, 50, 11, 51)), srid=4326))
+        event = create_event('Drought', region=other)
+        event.variable = 'PR'
+        event.save()
+        event.synthesis.pr = 0.9
+        event.synthesis.save()
+
+    def clusters(self, **params):
+        response = self.client.get(reverse('exevada:event-clusters'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['clusters']
+
+    def test_geohash(self):
+        self.assertEqual(geohash(-5.6, 42.6, 5), 'ezs42')
+        self.assertEqual(self.region.geohash, geohash(5, 52.5))
+
+    def test_clusters(self):
+        clusters = self.clusters(zoom=0)
+        self.assertEqual(len(clusters), 1)
+        cluster = clusters[0]
+        self.assertEqual((cluster['geohash'], cluster['count']), ('u', 3))
+        self.assertEqual(cluster['variable'], 'TX3x')
+        self.assertEqual((cluster['pr_min'], cluster['pr_max']), (0.5, 0.9))
+        self.assertAlmostEqual(cluster['x'], (5 + 5 + 10.5) / 3)
+        # Apart at higher zooms
+        self.assertEqual([cluster['count'] for cluster in self.clusters(zoom=8)], [1, 2])
+        self.assertEqual(self.clusters(zoom=8, bbox='9,49,12,52')[0]['variable'], 'PR')
+        self.assertEqual(self.clusters(zoom=8, bbox='-10,-10,0,0'), [])
+
+    def test_invalid(self):
+        response = self.client.get(reverse('exevada:event-clusters'), {'zoom': 2, 'bbox': '1,2'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StatisticsTest(TestCase):
+    def statistic(self, source='synthesis', dimension='all', key=''):
+        return models.Statistic.objects.get(source=source, quantity='pr',
+                                            dimension=dimension, key=key)
+
+    def test_running_sums(self):
+        first = create_event('Event 1')
+        second = create_event('Event 2', region=first.region)
+        second.synthesis.pr = 0.9
+        second.synthesis.save()
+        models.Season.objects.create(event=second, start=6, end=8)
+        statistic = self.statistic()
+        self.assertEqual(statistic.count, 2)
+        self.assertAlmostEqual(statistic.mean, 0.7)
+        self.assertAlmostEqual(statistic.stddev, 0.2)
+        self.assertEqual(self.statistic(dimension='season', key='6-8').count, 1)
+        # As computed from all values
+        summaries.refresh({('synthesis', 'all', '')})
+        refreshed = self.statistic()
+        for field in ('count', 'total', 'total_squares', 'mean', 'stddev'):
+            self.assertAlmostEqual(getattr(refreshed, field), getattr(statistic, field))
+
+    def test_cascade(self):
+        event = create_event()
+        create_obsdataset(event)
+        create_obsdataset(event)
+        self.assertEqual(self.statistic('obsdataset').count, 2)
+        create_event('Other')
+        event.region.delete()
+        # The datasets are removed once, with the event
+        self.assertFalse(models.Statistic.objects.filter(source='obsdataset').exists())
+        self.assertEqual(self.statistic().count, 1)
+
+    def test_incremental(self):
+        first = create_event('Event 1')
+        second = create_event('Event 2')
+        third = create_event('Event 3', region=first.region)
+        create_obsdataset(first)
+        dataset = create_obsdataset(second)
+        models.ModelDataset.objects.create(event=third, model_type='', period='', trend='',
+                                           pr=0.3, delta_i=2)
+        models.Season.objects.create(event=first, start=6, end=8)
+        season = models.Season.objects.create(event=second, start=6, end=8)
+        second.synthesis.pr = 0.9
+        second.synthesis.save()
+        dataset.delta_i = -1
+        dataset.save()
+        first.variable = 'RX1day'
+        first.startdate = datetime.date(2020, 1, 1)
+        first.save()
+        season.delete()
+        third.delete()
+
+        def statistics():
+            return {(statistic.source, statistic.quantity, statistic.dimension, statistic.key):
+                    statistic for statistic in models.Statistic.objects.all()}
+
+        incremental = statistics()
+        summaries.refresh_distributions({
+            (source, dimension, key) for source, quantity, dimension, key in incremental})
+        refreshed = statistics()
+        summaries.rebuild()
+        rebuilt = statistics()
+        self.assertEqual(set(incremental), set(rebuilt))
+        for group, statistic in rebuilt.items():
+            with self.subTest(group=group):
+                for field in ('count', 'total', 'total_squares', 'mean', 'stddev'):
+                    self.assertAlmostEqual(getattr(incremental[group], field),
+                                           getattr(statistic, field))
+                for field in summaries.DISTRIBUTION:
+                    self.assertEqual(getattr(refreshed[group], field), getattr(statistic, field))
+
+
+class ExportTest(TestCase):
+    def get_export(self, fmt, **params):
+        response = self.client.get(reverse('exevada:export-events', kwargs={'fmt': fmt}), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], export.FORMATS[fmt])
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        for name in ('Heatwave', 'Drought', 'Flood'):
+            create_obsdataset(create_event(name))
+        rows = list(csv.reader(io.StringIO(self.get_export('csv'), newline='')))
+        self.assertEqual(rows[0], [name for name, _ in export.COLUMNS])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([row[1] for row in rows[1:]], ['Heatwave', 'Drought', 'Flood'])
+        self.assertEqual(len(json.loads(rows[1][-2])), 1)
+
+    def test_filtered_geojson(self):
+        create_event('Heatwave')
+        event = create_event('Drought')
+        event.variable = 'PR'
+        event.save()
+        collection = json.loads(self.get_export('geojson', variable='PR'))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        [feature] = collection['features']
+        self.assertEqual(feature['type'], 'Feature')
+        self.assertEqual(feature['id'], event.pk)
+        self.assertEqual(feature['properties']['name'], 'Drought')
+        self.assertEqual(feature['geometry']['type'], 'MultiPolygon')
+        self.assertEqual(GEOSGeometry(json.dumps(feature['geometry'])).extent, (0, 50, 10, 55))
+        self.assertEqual(json.loads(self.get_export('geojson', variable='SPI')),
+                         {'type': 'FeatureCollection', 'features': []})
+
+    def test_invalid_filter(self):
+        response = self.client.get(reverse('exevada:export-events', kwargs={'fmt': 'csv'}),
+                                   {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.org', 'admin')
+        self.client.force_login(user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_event_changelist_query_count(self):
+        url = reverse('admin:exevada_event_changelist')
+        create_event('Event 0')
+        few = self.count_queries(url)
+        for i in range(1, 10):
+            create_event('Event %d' % i)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_region_change_form(self):
+        region = create_event().region
+        url = reverse('admin:exevada_region_change', args=[region.pk])
+        response = self.client.get(url)
+        self.assertContains(response, '<svg')
+        self.assertNotContains(response, region.area.geojson)
+        # Without a new area, the current one is kept
+        response = self.client.post(url, {'name': 'Renamed', 'area_0': '', 'area_1': ''})
+        self.assertEqual(response.status_code, 302)
+        region.refresh_from_db()
+        self.assertEqual(region.name, 'Renamed')
+        self.assertEqual(region.area.extent, (0, 50, 10, 55))
+        # An invalid area shows the form again
+        response = self.client.post(url, {'name': 'Renamed', 'area_0': '', 'area_1': 'POINT (0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['adminform'].form.errors['area'])
+
+    def test_estimated_count(self):
+        for i in range(5):
+            create_event('Event %d' % i)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.assertEqual(pagination.estimated_count(models.Event), 5)
+        paginator = pagination.EstimatedCountPaginator(models.Event.objects.order_by('pk'), 2)
+        paginator.threshold = 0
+        self.assertEqual(paginator.count, 5)
+        filtered = pagination.EstimatedCountPaginator(
+            models.Event.objects.filter(name='Event 1').order_by('pk'), 2)
+        filtered.threshold = 0
+        self.assertEqual(filtered.count, 1)
+
+
+@override_settings(EXEVADA_JOBS_EAGER=False)
+class JobsTest(TestCase):
+    def run_jobs(self):
+        return jobs.work(threading.Event(), burst=True)
+
+    def test_region_simplified_by_job(self):
+        region = create_event().region
+        self.assertFalse(region.simplified.exists())
+        self.assertEqual(region.area_for_zoom(2).num_coords, 5)
+        job = models.Job.objects.get(task='simplify-region')
+        self.run_jobs()
+        self.assertEqual(region.simplified.count(), len(SIMPLIFY_LEVELS))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (models.Job.DONE, 1))
+
+    def test_region_before_job(self):
+        region = create_event().region
+        url = reverse('exevada:regions-geojson')
+        features = self.client.get(url, {'zoom': 2}).json()['features']
+        self.assertEqual([feature['properties']['id'] for feature in features], [region.pk])
+        self.run_jobs()
+        # A new area replaces the simplified ones right away
+        region = models.Region.objects.with_area().get(pk=region.pk)
+        region.area = MultiPolygon(Polygon.from_bbox((20, 50, 30, 55)), srid=4326)
+        region.save()
+        self.assertFalse(region.simplified.exists())
+        self.assertEqual(region.area_for_zoom(2).extent, (20, 50, 30, 55))
+        # Unlike a new name
+        self.run_jobs()
+        region.name = 'Renamed'
+        region.save()
+        self.assertEqual(region.simplified.count(), len(SIMPLIFY_LEVELS))
+
+    def test_deduplication(self):
+        first = jobs.enqueue('rebuild-statistics')
+        second = jobs.enqueue('rebuild-statistics', priority=5)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(models.Job.objects.get().priority, 5)
+        self.assertNotEqual(jobs.enqueue('compute-return-times', [1]).pk, first.pk)
+        # Work queued while the same work runs is queued anew
+        self.assertEqual(jobs.claim('test').pk, first.pk)
+        self.assertNotEqual(jobs.enqueue('rebuild-statistics').pk, first.pk)
+
+    def test_priorities(self):
+        low = jobs.enqueue('rebuild-search-index', priority=-1)
+        high = jobs.enqueue('rebuild-statistics', priority=1)
+        self.assertEqual(jobs.claim('test').pk, high.pk)
+        self.assertEqual(jobs.claim('test').pk, low.pk)
+        self.assertIsNone(jobs.claim('test'))
+
+    def test_retries(self):
+        def fail(progress):
+            progress.report(0.5, "Halfway")
+            raise ValueError("Failed")
+        with mock.patch.dict(jobs.TASKS, {'fail': (fail, 0)}):
+            job = jobs.enqueue('fail', max_attempts=2)
+            self.assertEqual(self.run_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.progress), (models.Job.QUEUED, 1, 0.5))
+            self.assertIn("ValueError", job.message)
+            # Not due before the retry delay
+            self.assertEqual(self.run_jobs(), 0)
+            models.Job.objects.update(run_after=timezone.now())
+            self.assertEqual(self.run_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (models.Job.FAILED, 2))
+
+    def test_stale_jobs(self):
+        job = jobs.enqueue('rebuild-statistics')
+        jobs.claim('test')
+        self.assertEqual(jobs.requeue_stale(), 0)
+        models.Job.objects.update(heartbeat=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.QUEUED)
+
+
+@override_settings(EXEVADA_PROFILE=True, EXEVADA_PROFILE_TOKEN='secret',
+                   EXEVADA_PROFILE_SAMPLE_RATE=0)
+class ProfilingTest(TestCase):
+    @staticmethod
+    def view(request):
+        for pk in (1, 1, 1, 2):
+            list(models.Region.objects.filter(pk=pk))
+        return HttpResponse()
+
+    def get(self, user=None, **headers):
+        request = RequestFactory().get('/', **headers)
+        request.user = user or AnonymousUser()
+        return profiling.ProfilingMiddleware(self.view)(request)
+
+    def test_server_timing(self):
+        response = self.get(HTTP_X_EXEVADA_PROFILE='secret')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'sql;dur=[\d.]+;desc="4 queries, 2 duplicates, 1 similar"')
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+
+    def test_access(self):
+        self.assertNotIn('Server-Timing', self.get())
+        self.assertNotIn('Server-Timing', self.get(HTTP_X_EXEVADA_PROFILE='guess'))
+        staff = get_user_model()(username='staff', is_staff=True)
+        self.assertIn('Server-Timing', self.get(staff, HTTP_X_EXEVADA_PROFILE='1'))
+        with override_settings(EXEVADA_PROFILE_TOKEN=''):
+            self.assertNotIn('Server-Timing', self.get(HTTP_X_EXEVADA_PROFILE=''))
+
+
+@override_settings(EXEVADA_REPLICAS=['replica'])
+class RouterTest(SimpleTestCase):
+    def request(self, request, write=False):
+        """Database alias of the reads of a request, and its response"""
+        aliases = []
+
+        def view(request):
+            routers.PrimaryReplicaRouter().db_for_write(models.Event)
+            if write:
+                routers.record_writes(lambda *args: None, 'INSERT INTO exevada_event', (),
+                                      False, {})
+            aliases.append(routers.read_alias())
+            return HttpResponse()
+        response = routers.ReplicaPinningMiddleware(view)(request)
+        return aliases[0], response
+
+    def test_outside_requests(self):
+        self.assertEqual(routers.read_alias(), 'default')
+
+    def test_reads(self):
+        alias, response = self.request(RequestFactory().get('/'))
+        self.assertEqual(alias, 'replica')
+        self.assertNotIn(routers.COOKIE, response.cookies)
+
+    @override_settings(EXEVADA_REPLICAS=['replica', 'other'])
+    def test_one_replica(self):
+        aliases = set()
+
+        def view(request):
+            aliases.update(routers.read_alias() for i in range(20))
+            return HttpResponse()
+        routers.ReplicaPinningMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(len(aliases), 1)
+
+    def test_writes(self):
+        alias, response = self.request(RequestFactory().post('/'), write=True)
+        self.assertEqual(alias, 'default')
+        self.assertIn(routers.COOKIE, response.cookies)
+        request = RequestFactory().get('/')
+        request.COOKIES[routers.COOKIE] = '1'
+        self.assertEqual(self.request(request)[0], 'default')
+
+    def test_streaming(self):
+        def view(request):
+            return StreamingHttpResponse(routers.keep_routing(
+                routers.read_alias() for i in range(2)))
+        response = routers.ReplicaPinningMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(list(response.streaming_content), [b'replica', b'replica'])
+
+    @unittest.skipIf(django.VERSION < (3, 1), "Async middleware needs Django 3.1")
+    def test_async(self):
+        aliases = []
+
+        async def view(request):
+            aliases.append(routers.read_alias())
+            routers.record_writes(lambda *args: None, 'UPDATE exevada_event', (), False, {})
+            aliases.append(routers.read_alias())
+            return HttpResponse()
+        middleware = routers.ReplicaPinningMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(aliases, ['replica', 'default'])
+        self.assertIn(routers.COOKIE, response.cookies)
+
+
+class SyntheticDataTest(TestCase):
+    def test_generate_data(self):
+        call_command('generate_data', regions=3, vertices=50, events=20, stdout=io.StringIO())
+        self.assertEqual(models.Region.objects.count(), 3)
+        self.assertEqual(models.Event.objects.count(), 20)
+        for region in models.Region.objects.all():
+            self.assertTrue(region.area.valid)
+            self.assertGreaterEqual(region.area.num_coords, 25)
+
+    def test_percentile(self):
+        self.assertEqual(benchmarks.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(benchmarks.percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertEqual(benchmarks.percentile([1, 2, 3, 4], 100), 4)
+
+
+class GevTest(SimpleTestCase):
+    def test_cdf(self):
+        # Gumbel: exp(-exp(-z))
+        self.assertAlmostEqual(float(gev.cdf(10, 10, 2, 0)), math.exp(-1))
+        self.assertAlmostEqual(float(gev.cdf(12, 10, 2, 0)), math.exp(-math.exp(-1)))
+        # exp(-(1 + xi z) ** (-1 / xi))
+        self.assertAlmostEqual(float(gev.cdf(2, 0, 1, 0.5)), math.exp(-0.25))
+        self.assertAlmostEqual(float(gev.cdf(1, 0, 1, -0.5)), math.exp(-0.25))
+        # Outside the support
+        self.assertEqual(float(gev.cdf(-3, 0, 1, 0.5)), 0)
+        self.assertEqual(float(gev.cdf(3, 0, 1, -0.5)), 1)
+
+    def test_quantile(self):
+        self.assertAlmostEqual(float(gev.quantile(math.exp(-1), 10, 2, 0)), 10)
+        self.assertAlmostEqual(float(gev.quantile(math.exp(-0.25), 0, 1, 0.5)), 2)
+        self.assertAlmostEqual(float(gev.quantile(math.exp(-0.25), 0, 1, -0.5)), 1)
+        p = np.linspace(0.01, 0.99, 5)
+        np.testing.assert_allclose(gev.cdf(gev.quantile(p, 30, 2, -0.2), 30, 2, -0.2), p)
+
+    def test_evaluate(self):
+        # At the location, a Gumbel is exceeded with probability 1 - 1/e
+        p1 = 1 - math.exp(-1)
+        shifted = gev.evaluate(10, 10, 1, 0, alpha=1, scale=False, delta_t=1)
+        self.assertAlmostEqual(float(shifted['return_period']), 1 / p1)
+        # The past location is 9
+        self.assertAlmostEqual(float(shifted['pr']), p1 / (1 - math.exp(-math.exp(-1))))
+        self.assertAlmostEqual(float(shifted['delta_i']), 1)
+        scaled = gev.evaluate(10, 10, 1, 0.1, alpha=2, scale=True, delta_t=1)
+        # The past location is 10 exp(-2 / 10), and as rare an event in
+        # the past reaches it
+        self.assertAlmostEqual(float(scaled['delta_i']), (math.exp(0.2) - 1) * 100)
+        both = gev.evaluate([10, 10], 10, 1, [0, 0.1], [1, 2], [False, True], delta_t=1)
+        self.assertAlmostEqual(float(both['delta_i'][1]), float(scaled['delta_i']))
+
+
+class BootstrapTest(SimpleTestCase):
+    def test_gamma(self):
+        values = [0.3, 0.5, 1, 1.5, 2.5, 5.2, -0.5, -1.5]
+        for value, result in zip(values, bootstrap.gamma(values)):
+            self.assertAlmostEqual(result / math.gamma(value), 1, places=12)
+
+    def test_fit_lmoments(self):
+        # Evenly spread quantiles of known distributions, one per row
+        fits = [(30, 2, -0.2), (10, 3, 0.1), (5, 1, 0)]
+        p = (np.arange(20000) + 0.5) / 20000
+        samples = np.array([gev.quantile(p, *fit) for fit in fits])
+        for fit, mu, sigma, xi in zip(fits, *bootstrap.fit_lmoments(samples)):
+            self.assertAlmostEqual(mu, fit[0], places=2)
+            self.assertAlmostEqual(sigma, fit[1], places=2)
+            self.assertAlmostEqual(xi, fit[2], places=2)
+
+    def test_bounds(self):
+        period = 1 / (1 - gev.cdf(33, 30, 2, -0.2))
+        lower, upper = bootstrap.bounds(1, 33, 30, 2, -0.2)
+        self.assertLess(lower, period)
+        self.assertGreater(upper, period)
+        # The stream of a dataset only depends on the seed and its id
+        self.assertEqual(bootstrap.bounds(1, 33, 30, 2, -0.2), (lower, upper))
+        self.assertNotEqual(bootstrap.bounds(2, 33, 30, 2, -0.2), (lower, upper))
+
+
+class ImportEventsTest(TestCase):
+    def test_invalid_json_line(self):
+        fh = io.StringIO('{"name": "Heatwave"}\n\n{"name": \n')
+        with self.assertRaisesRegex(CommandError, "line 3"):
+            list(iter_json(fh))
+
+    def test_invalid_json_object(self):
+        # Reported without reading on
+        fh = io.StringIO('[{"name": "Heatwave"}, {"name": x}, ' + '{"name": "Flood"}, ' * 1000 + ']')
+        with self.assertRaisesRegex(CommandError, "character 32"):
+            list(iter_json(fh, chunk_size=64))
+        self.assertEqual(fh.tell(), 64)
+        self.assertEqual(list(iter_json(io.StringIO('[{"a": 1}, -2.5e+3, "b"]'), chunk_size=1)),
+                         [{'a': 1}, -2.5e3, 'b'])
+
+    def test_strict(self):
+        models.Region.objects.create(
+            name='Region', area=MultiPolygon(Polygon.from_bbox((0, 50, 10, 55)), srid=4326))
+        event = {'name': 'Heatwave', 'region': 'Region', 'startdate': '2019-07-20', 'duration': 5,
+                 'variable': 'TX3x', 'fitted_distribution': 'GEV',
+                 'impact': {'deaths': 0, 'affected': 0, 'request': 'x', 'comments': 'x'},
+                 'synthesis': {'pr': 0.5, 'delta_i': 1, 'conclusions': 'x', 'contact': 'x',
+                               'webpage': 'https://example.org', 'doi': 'x'}}
+        lines = '%s\n%s\n' % (json.dumps(event), json.dumps(dict(event, region='Nowhere')))
+        with mock.patch('sys.stdin', io.StringIO(lines)), \
+                self.assertRaisesRegex(CommandError, "Event 2"):
+            call_command('import_events', '-', strict=True, batch_size=1, stdout=io.StringIO())
+        # The statistics include the events imported before the error
+        self.assertEqual(models.Statistic.objects.get(
+            source='synthesis', quantity='pr', dimension='all').count, 1)
+
+
+# The async views query in other threads, so the data must be committed
+@unittest.skipIf(django.VERSION < (3, 1), "Async views need Django 3.1")
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class AsyncViewsTest(TransactionTestCase):
+    def get(self, view, path, **kwargs):
+        request = RequestFactory().get(path)
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_same_responses(self):
+        event = create_event()
+        region = event.region
+        cases = [
+            (views.Events, reverse('exevada:events'), {}),
+            (views.Event, reverse('exevada:event', args=[event.pk]), {'event_id': event.pk}),
+            (views.RegionGeoJSON, reverse('exevada:region-geojson', args=[region.pk]),
+             {'region_id': region.pk}),
+        ]
+        for view_class, path, kwargs in cases:
+            with self.subTest(view=view_class.__name__):
+                response = self.get(asyncviews.as_view(view_class), path, **kwargs)
+                expected = view_class.as_view()(RequestFactory().get(path), **kwargs)
+                if hasattr(expected, 'render'):
+                    expected.render()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+
+    def test_not_found(self):
+        with self.assertRaises(Http404):
+            self.get(asyncviews.as_view(views.RegionGeoJSON), '/', region_id=1)
+
+    @override_settings(EXEVADA_PROFILE=True, EXEVADA_PROFILE_TOKEN='secret')
+    def test_profile(self):
+        # The queries run in the database pool
+        create_event()
+        middleware = profiling.ProfilingMiddleware(asyncviews.as_view(views.Events))
+        request = RequestFactory().get(reverse('exevada:events'), HTTP_X_EXEVADA_PROFILE='secret')
+        response = async_to_sync(middleware)(request)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries')
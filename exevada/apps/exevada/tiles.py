@@ -0,0 +1,289 @@
+"""Mapbox vector tiles for the region areas
+
+Tiles are in the usual web mercator (XYZ) tiling scheme. The encoding
+follows version 2.1 of the vector tile specification, and is done
+here directly, since it only needs a small subset of protocol
+buffers.
+
+Encoded tiles are cached on disk, in `settings.EXEVADA_TILE_CACHE_DIR`,
+as z/x/y.mvt files; `invalidate` removes the cached tiles overlapping
+an envelope.
+
+"""
+
+import math
+import os
+import struct
+import tempfile
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+
+
+EXTENT = 4096
+# Tile buffer, in tile pixels, to avoid edge artefacts
+BUFFER = 64
+MAXZOOM = 22
+MAXLAT = 85.0511287798
+
+CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+POLYGON = 3
+MOVETO, LINETO, CLOSEPATH = 1, 2, 7
+
+
+def tile_bounds(z, x, y, buffer=0):
+    """Envelope (xmin, ymin, xmax, ymax) in degrees of a tile
+
+    `buffer` extends the envelope by a number of tile pixels.
+
+    """
+
+    n = 2 ** z
+    pad = buffer / EXTENT
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (max((x - pad) / n * 360 - 180, -180), max(lat(y + 1 + pad), -90),
+            min((x + 1 + pad) / n * 360 - 180, 180), min(lat(y - pad), 90))
+
+
+def tile_range(bbox, z):
+    """Range of tile columns and rows covering an envelope at zoom `z`"""
+
+    n = 2 ** z
+    xmin, ymin, xmax, ymax = bbox
+
+    def column(lon):
+        return min(max(int((lon + 180) / 360 * n), 0), n - 1)
+
+    def row(lat):
+        lat = math.radians(min(max(lat, -MAXLAT), MAXLAT))
+        y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n
+        return min(max(int(y), 0), n - 1)
+
+    return (column(xmin), column(xmax)), (row(ymax), row(ymin))
+
+
+def _projector(z, x, y):
+    n = 2 ** z
+
+    def project(lon, lat):
+        lat = math.radians(min(max(lat, -MAXLAT), MAXLAT))
+        px = ((lon + 180) / 360 * n - x) * EXTENT
+        py = ((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n - y) * EXTENT
+        return round(px), round(py)
+
+    return project
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _ring_commands(points, exterior, cursor):
+    # Drop repeated points and the closing point
+    ring = []
+    for point in points:
+        if not ring or point != ring[-1]:
+            ring.append(point)
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    if len(ring) < 3:
+        return []
+
+    # Exterior rings have a positive area in tile coordinates (y down)
+    area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+    if area == 0:
+        return []
+    if (area > 0) != exterior:
+        ring.reverse()
+
+    commands = [MOVETO | (1 << 3)]
+    for i, (px, py) in enumerate(ring):
+        if i == 1:
+            commands.append(LINETO | ((len(ring) - 1) << 3))
+        commands.extend((_zigzag(px - cursor[0]), _zigzag(py - cursor[1])))
+        cursor[:] = px, py
+    commands.append(CLOSEPATH | (1 << 3))
+    return commands
+
+
+def geometry_commands(geom, project):
+    """Vector tile geometry commands for a (multi)polygon"""
+
+    if geom.geom_type == 'Polygon':
+        polygons = [geom]
+    elif geom.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        polygons = [part for part in geom if part.geom_type == 'Polygon']
+    else:
+        polygons = []
+
+    commands = []
+    cursor = [0, 0]
+    for polygon in polygons:
+        rings = list(polygon)
+        exterior = _ring_commands([project(*point[:2]) for point in rings[0]], True, cursor)
+        if not exterior:
+            continue
+        commands.extend(exterior)
+        for ring in rings[1:]:
+            commands.extend(_ring_commands([project(*point[:2]) for point in ring],
+                                           False, cursor))
+    return commands
+
+
+def _varint(value):
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def _key(field, wiretype):
+    return _varint((field << 3) | wiretype)
+
+
+def _bytes(field, data):
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _packed(field, values):
+    return _bytes(field, b''.join(_varint(value) for value in values))
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        if value < 0:
+            return _key(6, 0) + _varint(_zigzag(value))
+        return _key(5, 0) + _varint(value)
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)
+    return _bytes(1, str(value).encode('utf-8'))
+
+
+def encode_layer(name, features):
+    """Encode a layer from (id, geometry commands, properties) tuples
+
+    Properties with a None value are left out.
+
+    """
+
+    keys, values = {}, {}
+    data = bytearray()
+    for fid, commands, properties in features:
+        if not commands:
+            continue
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        feature = (_key(1, 0) + _varint(fid) + _packed(2, tags) +
+                   _key(3, 0) + _varint(POLYGON) + _packed(4, commands))
+        data += _bytes(2, feature)
+
+    layer = bytearray(_key(15, 0) + _varint(2) + _bytes(1, name.encode('utf-8')))
+    layer += data
+    for key in keys:
+        layer += _bytes(3, key.encode('utf-8'))
+    for (_, value) in values:
+        layer += _bytes(4, _value(value))
+    layer += _key(5, 0) + _varint(EXTENT)
+    return _bytes(3, bytes(layer))
+
+
+def clip(geom, z, x, y):
+    """Clip a geometry to a tile (including its buffer)
+
+    Returns None when nothing of the geometry falls inside the tile.
+
+    """
+
+    bounds = Polygon.from_bbox(tile_bounds(z, x, y, BUFFER))
+    bounds.srid = geom.srid
+    if bounds.contains(geom):
+        return geom
+    clipped = geom.intersection(bounds)
+    return None if clipped.empty else clipped
+
+
+def encode_regions(rows, z, x, y):
+    """Encode a tile with a single 'regions' layer
+
+    `rows` are (id, area, properties) tuples.
+
+    """
+
+    project = _projector(z, x, y)
+    features = []
+    for pk, area, properties in rows:
+        area = clip(area, z, x, y)
+        if area is not None:
+            features.append((pk, geometry_commands(area, project), properties))
+    return encode_layer('regions', features)
+
+
+def cache_path(z, x, y):
+    return os.path.join(settings.EXEVADA_TILE_CACHE_DIR, str(z), str(x), '%d.mvt' % y)
+
+
+def cached(z, x, y):
+    """Cached tile data, or None"""
+    try:
+        with open(cache_path(z, x, y), 'rb') as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return None
+
+
+def store(z, x, y, data):
+    path = cache_path(z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first, so readers never see a partial tile
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmppath, path)
+
+
+def _numbered(path):
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in names:
+        number = name.split('.')[0]
+        if number.isdigit():
+            yield int(number), os.path.join(path, name)
+
+
+def invalidate(bbox):
+    """Remove all cached tiles overlapping an envelope
+
+    Only the cached files are visited, so this does not depend on the
+    number of possible tiles at high zoom levels.
+
+    """
+
+    for z, zpath in _numbered(settings.EXEVADA_TILE_CACHE_DIR):
+        if z > MAXZOOM:
+            continue
+        (x0, x1), (y0, y1) = tile_range(bbox, z)
+        # Include neighbouring tiles, since tiles are clipped with a buffer
+        for x, xpath in _numbered(zpath):
+            if x0 - 1 <= x <= x1 + 1:
+                for y, ypath in _numbered(xpath):
+                    if y0 - 1 <= y <= y1 + 1:
+                        try:
+                            os.remove(ypath)
+                        except FileNotFoundError:
+                            pass
@@ -1,18 +1,48 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+
+if settings.EXEVADA_ASYNC:
+    from .asyncviews import as_view as read_view
+else:
+    def read_view(view_class, **initkwargs):
+        return view_class.as_view(**initkwargs)
 
 
 app_name = 'exevada'
 urlpatterns = [
-    path('', views.Index.as_view(), name='index'),
-    path('event/', views.Events.as_view(), name='events'),
-    path('event/<int:event_id>/', views.Event.as_view(), name='event'),
-    path('event/<int:event_id>/obs-data/', views.ObsDatasets.as_view(), name='obsdata'),
-    path('event/<int:event_id>/model-data/', views.ModelDatasets.as_view(), name='modeldata'),
+    path('', read_view(views.Index), name='index'),
+    path('event/', read_view(views.Events), name='events'),
+    path('event/search/', read_view(views.SearchEvents), name='search-events'),
+    path('event/clusters/', read_view(views.EventClusters), name='event-clusters'),
+    path('search/', read_view(views.TextSearch), name='search'),
+    path('event/<int:event_id>/', read_view(views.Event), name='event'),
+    path('event/<int:event_id>/obs-data/', read_view(views.ObsDatasets), name='obsdata'),
+    path('event/<int:event_id>/model-data/', read_view(views.ModelDatasets), name='modeldata'),
     path('event/add/', views.CreateEvent.as_view(), name='add-event'),
+    path('export/events.<str:fmt>', views.ExportEvents.as_view(), name='export-events'),
 
-    path('region/', views.Regions.as_view(), name='regions'),
-    path('region/<int:region_id>/', views.Region.as_view(), name='region'),
-    path('region/add/', views.CreateRegion.as_view(), name='add-region'),
+    path('statistics/', read_view(views.Statistics), name='statistics'),
+    path('api/v1/changes/', views.Changes.as_view(), name='api-changes'),
+    path('api/v1/events/<int:pk>/gev/', read_view(api.GevEvaluation), name='api-events-gev'),
+    path('profile/stats/', views.ProfileStats.as_view(), name='profile-stats'),
 
+    path('region/', read_view(views.Regions), name='regions'),
+    path('region/geojson/', read_view(views.RegionsGeoJSON), name='regions-geojson'),
+    path('region/tiles/<int:z>/<int:x>/<int:y>.mvt', read_view(views.RegionTile), name='region-tile'),
+    path('region/<int:region_id>/', read_view(views.Region), name='region'),
+    path('region/<int:region_id>/geojson/', read_view(views.RegionGeoJSON), name='region-geojson'),
+    path('region/shapes.twkb', read_view(views.RegionShapes), name='region-shapes'),
+    path('region/<int:region_id>/shape.<str:fmt>', read_view(views.RegionShape),
+         name='region-shape'),
+    path('region/add/', views.CreateRegion.as_view(), name='add-region'),
 ]
+
+for name in api.RESOURCES:
+    urlpatterns += [
+        path('api/v1/%s/' % name, read_view(api.ResourceList, resource=name),
+             name='api-%s' % name),
+        path('api/v1/%s/<int:pk>/' % name, read_view(api.ResourceDetail, resource=name),
+             name='api-%s-detail' % name),
+    ]
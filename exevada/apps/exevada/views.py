@@ -1,34 +1,159 @@
-from django.shortcuts import render
+import json
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db.models import Count, OuterRef, Subquery
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse_lazy
-from django.views.generic.base import TemplateView
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.generic.base import TemplateView, View
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView
+from . import models
 from .models import Event, ObsDataset, ModelDataset, Region
 from .forms import EventForm, RegionForm, ObsDatasetForm, ModelDatasetForm
+from .forms import ClusterForm, EventFilterForm, SpatialSearchForm, TextSearchForm
+from .geometry import (cluster_precision, feature_collection, level_for_zoom, twkb,
+                       twkb_collection)
+from .cache import CachedViewMixin
+from .pagination import KeysetPaginationMixin
+from . import changes, export, profiling, routers, search, tiles
+from .api import BadRequest
 
 
-class Index(ListView):
+class Index(CachedViewMixin, ListView):
     template_name = 'exevada/index.html'
-    model = Event
+    cache_tags = ['event', 'region']
+    context_object_name = 'events'
+    latest = 10
+
+    def get_queryset(self):
+        return models.Event.objects.for_listing().order_by('-startdate', '-pk')[:self.latest]
 
 
-class Events(ListView):
+class Events(CachedViewMixin, KeysetPaginationMixin, ListView):
     template_name = 'exevada/events.html'
+    cache_tags = ['event', 'region', 'synthesis']
     model = Event
     context_object_name = 'events'
+    orderings = {
+        'startdate': ('startdate', 'pk'),
+        '-startdate': ('-startdate', '-pk'),
+        'pr': ('synthesis__pr', 'pk'),
+        '-pr': ('-synthesis__pr', '-pk'),
+    }
+    default_ordering = '-startdate'
+
+    def get_queryset(self):
+        self.form = EventFilterForm(self.request.GET)
+        return self.form.filter(super().get_queryset().for_listing())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.form
+        return context
+
+
+class SearchEvents(CachedViewMixin, ListView):
+    """Events whose region contains a point, lies within a distance of
+    a point, or intersects a bounding box"""
+
+    template_name = 'exevada/search_events.html'
+    cache_tags = ['event', 'region']
+    context_object_name = 'events'
+
+    def get_queryset(self):
+        self.form = SpatialSearchForm(self.request.GET or None)
+        if not self.form.is_valid():
+            return models.Event.objects.none()
+        data = self.form.cleaned_data
+        if data['bbox']:
+            regions = models.Region.objects.intersecting(data['bbox'])
+        else:
+            point = Point(data['lon'], data['lat'], srid=4326)
+            if data['radius']:
+                regions = models.Region.objects.within_distance(point, data['radius'])
+            else:
+                regions = models.Region.objects.containing(point)
+        return models.Event.objects.filter(region__in=regions).for_listing()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.form
+        return context
 
 
-class Event(DetailView):
+class TextSearch(CachedViewMixin, ListView):
+    """Events matching a full-text query, best first, with highlighted
+    snippets"""
+
+    template_name = 'exevada/search.html'
+    cache_tags = ['event', 'region', 'impact', 'synthesis', 'obsdataset']
+    context_object_name = 'events'
+    limit = 100
+
+    def get_queryset(self):
+        self.form = TextSearchForm(self.request.GET or None)
+        if not self.form.is_valid():
+            return []
+        results = search.search(self.form.cleaned_data['q'], self.limit)
+        events = models.Event.objects.for_listing().in_bulk([pk for pk, _, _ in results])
+        matches = []
+        for pk, rank, snippet in results:
+            if pk in events:
+                event = events[pk]
+                event.rank, event.snippet = rank, snippet
+                matches.append(event)
+        return matches
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.form
+        return context
+
+
+class Event(CachedViewMixin, DetailView):
     template_name = 'exevada/event.html'
     model = Event
     context_object_name = 'event'
+    pk_url_kwarg = 'event_id'
+
+    def get_cache_tags(self):
+        return ['event:%d' % self.kwargs['event_id']]
+
+
+class EventDatasetsMixin(CachedViewMixin):
+    """List the datasets of the event given by the `event_id` URL argument"""
+
+    context_object_name = 'datasets'
+
+    def get_cache_tags(self):
+        return ['event:%d' % self.kwargs['event_id']]
+
+    def get_queryset(self):
+        self.event = get_object_or_404(models.Event, pk=self.kwargs['event_id'])
+        return super().get_queryset().filter(event=self.event)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['event'] = self.event
+        return context
 
-class ObsDatasets(ListView):
+
+class ObsDatasets(EventDatasetsMixin, ListView):
     template_name = 'exevada/obsdatasets.html'
     model = ObsDataset
-    context_object_name = 'datasets'
+
+    def get_cache_tags(self):
+        # Return times are also updated in bulk, for many events at once
+        return super().get_cache_tags() + ['returntime']
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related('best_fit_value', 'return_period')
 
 
 class ObsDataset(ListView):
@@ -36,10 +161,9 @@ class ObsDataset(ListView):
     model = ObsDataset
 
 
-class ModelDatasets(ListView):
+class ModelDatasets(EventDatasetsMixin, ListView):
     template_name = 'exevada/modeldatasets.html'
     model = ModelDataset
-    context_object_name = 'datasets'
 
 
 class ModelDataset(ListView):
@@ -51,19 +175,258 @@ class CreateEvent(CreateView):
     form_class = EventForm
 
 
-class Regions(ListView):
+class Regions(CachedViewMixin, ListView):
     template_name = 'exevada/regions.html'
+    cache_tags = ['region']
     model = Region
     context_object_name = 'regions'
+    orderings = {
+        'name': ['name'],
+        'area': ['area_km2', 'pk'],
+        '-area': ['-area_km2', '-pk'],
+    }
+
+    def get_ordering(self):
+        return self.orderings.get(self.request.GET.get('sort'), self.orderings['name'])
 
 
-class Region(DetailView):
+class Region(CachedViewMixin, DetailView):
     template_name = 'exevada/region.html'
     model = Region
     context_object_name = 'region'
+    pk_url_kwarg = 'region_id'
 
+    def get_cache_tags(self):
+        return ['region:%d' % self.kwargs['region_id']]
 
+
+@method_decorator(csrf_exempt, 'dispatch')
 class CreateRegion(CreateView):
+    """Create a region from an uploaded file, or WKT or GeoJSON text
+
+    Uploads are always streamed to a temporary file, which GDAL reads
+    feature by feature. The upload handlers can only be changed before
+    the CSRF check reads the POST data, so that check is done in `post`.
+
+    """
+
     template_name = 'exevada/add_region.html'
     form_class = RegionForm
     success_url = reverse_lazy('exevada:regions')
+
+    def dispatch(self, request, *args, **kwargs):
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().dispatch(request, *args, **kwargs)
+
+    @method_decorator(csrf_protect)
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+
+class ZoomMixin:
+    """Take an optional map zoom level from the query string"""
+
+    def get_zoom(self):
+        try:
+            return int(self.request.GET['zoom'])
+        except (KeyError, ValueError):
+            return None
+
+
+class RegionsGeoJSON(CachedViewMixin, ZoomMixin, View):
+    """Region areas as GeoJSON, simplified for the `zoom` level"""
+
+    cache_tags = ['region']
+    content_type = 'application/geo+json'
+
+    def get_rows(self, **filters):
+        level = level_for_zoom(self.get_zoom())
+        if level is None:
+            return models.Region.objects.filter(**filters).values_list('area', 'pk', 'name')
+        return [(area, pk, name) for pk, name, area in
+                models.Region.objects.filter(**filters).simplified_areas(level)]
+
+    def get_content(self, rows):
+        return feature_collection((area, {'id': pk, 'name': name}) for area, pk, name in rows)
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(self.get_content(self.get_rows()), content_type=self.content_type)
+
+
+class RegionGeoJSON(RegionsGeoJSON):
+    """A single region area as GeoJSON, simplified for the `zoom` level"""
+
+    def get_cache_tags(self):
+        return ['region:%d' % self.kwargs['region_id']]
+
+    def get_rows(self):
+        rows = list(super().get_rows(pk=self.kwargs['region_id']))
+        if not rows:
+            raise Http404("No such region")
+        return rows
+
+
+class TWKBMixin:
+    """Take the TWKB precision (decimals, 0 to 7) from the query string"""
+
+    content_type = 'application/octet-stream'
+    default_precision = 5
+
+    def get_precision(self):
+        try:
+            return min(max(int(self.request.GET['precision']), 0), 7)
+        except (KeyError, ValueError):
+            return self.default_precision
+
+
+class RegionShapes(TWKBMixin, RegionsGeoJSON):
+    """Region areas as a TWKB geometry collection with the region ids,
+    simplified for the `zoom` level"""
+
+    def get_content(self, rows):
+        precision = self.get_precision()
+        return twkb_collection(((pk, twkb(area, precision)) for area, pk, name in rows),
+                               precision)
+
+
+class RegionShape(TWKBMixin, RegionGeoJSON):
+    """A single region area as WKB or TWKB, simplified for the `zoom`
+    level"""
+
+    formats = ['wkb', 'twkb']
+
+    def get_rows(self):
+        if self.kwargs['fmt'] not in self.formats:
+            raise Http404("Unsupported format")
+        return super().get_rows()
+
+    def get_content(self, rows):
+        area = rows[0][0]
+        if self.kwargs['fmt'] == 'wkb':
+            return bytes(area.wkb)
+        return twkb(area, self.get_precision())
+
+
+class RegionTile(View):
+    """Vector tile of the region areas, with the number of events and
+    the probability ratio of the most recent event as attributes"""
+
+    def get_rows(self, z, x, y):
+        bbox = tiles.tile_bounds(z, x, y, tiles.BUFFER)
+        latest = models.Event.objects.filter(region=OuterRef('pk')).order_by('-startdate')
+        regions = models.Region.objects.envelope_intersects(bbox).annotate(
+            events=Count('event'),
+            pr=Subquery(latest.values('synthesis__pr')[:1]))
+        properties = {pk: {'name': name, 'events': events, 'pr': pr}
+                      for pk, name, events, pr in regions.values_list('pk', 'name', 'events', 'pr')}
+
+        level = level_for_zoom(z)
+        regions = models.Region.objects.filter(pk__in=properties)
+        if level is None:
+            areas = regions.values_list('pk', 'area')
+        else:
+            areas = ((pk, area) for pk, name, area in regions.simplified_areas(level))
+        return ((pk, area, properties[pk]) for pk, area in areas)
+
+    def check_tile(self, z, x, y):
+        if z > tiles.MAXZOOM or x >= 2 ** z or y >= 2 ** z:
+            raise Http404("No such tile")
+
+    def get(self, request, z, x, y):
+        self.check_tile(z, x, y)
+        data = tiles.cached(z, x, y)
+        if data is None:
+            data = tiles.encode_regions(self.get_rows(z, x, y), z, x, y)
+            tiles.store(z, x, y, data)
+        return HttpResponse(data, content_type=tiles.CONTENT_TYPE)
+
+
+class ExportEvents(View):
+    """Stream the events, with their related data, in one of the
+    `export.FORMATS`; the events may be filtered as in the event list
+    (see `EventFilterForm`)"""
+
+    def get(self, request, fmt):
+        if not export.available(fmt):
+            raise Http404("Unsupported export format")
+        form = EventFilterForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'error': form.errors}, status=400)
+        chunks = export.export(fmt, queryset=form.filter(Event.objects.all()))
+        # The content is read after the middleware has returned
+        response = StreamingHttpResponse(routers.keep_routing(chunks),
+                                         content_type=export.FORMATS[fmt])
+        response['Content-Disposition'] = 'attachment; filename="events.%s"' % fmt
+        return response
+
+
+class Changes(View):
+    """Page of the change feed (see `changes`) after the `cursor`, with
+    up to `limit` objects; not cached, as it depends on the time"""
+
+    def get(self, request):
+        try:
+            limit = int(request.GET.get('limit', changes.DEFAULT_LIMIT))
+        except ValueError:
+            return JsonResponse({'error': "limit should be an integer"}, status=400)
+        try:
+            page = changes.changes(request.GET.get('cursor'),
+                                   min(max(limit, 1), changes.MAX_LIMIT))
+        except BadRequest as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        return JsonResponse(page)
+
+
+class EventClusters(CachedViewMixin, View):
+    """Clusters of the events in a `bbox`, by the geohash cells of their
+    region centroids, sized for the map `zoom` level"""
+
+    cache_tags = ['event', 'region', 'synthesis']
+
+    def get(self, request):
+        form = ClusterForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'error': form.errors}, status=400)
+        precision = cluster_precision(form.cleaned_data['zoom'])
+        return JsonResponse({'precision': precision, 'clusters': models.Event.objects.clusters(
+            form.cleaned_data['bbox'], precision)})
+
+
+class Statistics(CachedViewMixin, View):
+    """Summary statistics, optionally filtered by source, quantity,
+    dimension and key"""
+
+    cache_tags = ['statistic']
+    filters = ['source', 'quantity', 'dimension', 'key']
+
+    def get(self, request):
+        lookups = {name: request.GET[name] for name in self.filters if name in request.GET}
+        statistics = models.Statistic.objects.filter(**lookups).order_by(
+            'source', 'quantity', 'dimension', 'key')
+        return JsonResponse({'statistics': [{
+            'source': statistic.source,
+            'quantity': statistic.quantity,
+            'dimension': statistic.dimension,
+            'key': statistic.key,
+            'count': statistic.count,
+            'mean': statistic.mean,
+            'stddev': statistic.stddev,
+            'minimum': statistic.minimum,
+            'maximum': statistic.maximum,
+            'quantiles': json.loads(statistic.quantiles),
+            'histogram': json.loads(statistic.histogram),
+        } for statistic in statistics]})
+
+
+class ProfileStats(View):
+    """Statistics of the recent request profiles of this process, for
+    staff users or requests with the profiling token"""
+
+    def get(self, request):
+        if not settings.EXEVADA_PROFILE:
+            raise Http404("Profiling is disabled")
+        token = settings.EXEVADA_PROFILE_TOKEN
+        if not (request.user.is_staff or
+                (token and request.META.get(profiling.HEADER) == token)):
+            raise PermissionDenied
+        return JsonResponse(profiling.stats())
@@ -1,45 +1,34 @@
 from django import forms
-from django.contrib.gis.geos import Polygon, MultiPolygon
+from django.contrib.gis.geos import GEOSGeometry
 
 
 class AreaInput(forms.MultiWidget):
-    """DUMMY DOCSTRING"""
+    """A file upload, or a text field for WKT, hex WKB or GeoJSON
+
+    The value is the uploaded file if there is one, and the text
+    otherwise; `AreaField` turns it into a geometry.
+
+    """
 
     def __init__(self, attrs=None):
-        if attrs:
-            attrs['required'] = False
-        else:
-            attrs = {'required': False}
-        print('ATTRS', attrs)
-        widgets = [forms.TextInput, forms.ClearableFileInput, forms.Textarea]
+        widgets = [forms.FileInput, forms.Textarea(attrs={'rows': 4, 'cols': 60})]
         super().__init__(widgets, attrs=attrs)
 
-    def get_context(self, name, value, attrs):
-        print(name)
-        print(value)
-        print(attrs)
-        if attrs:
-            attrs['required'] = False
-        else:
-            attrs = {'required': False}
-        context = super().get_context(name, value, attrs)
-        context['widget']['required'] = False
-        print('CONTEXT', context)
-        return context
+    def use_required_attribute(self, initial):
+        # Either subwidget may be left empty
+        return False
 
     def decompress(self, value):
-        print('VALUE', value)
-        return [None, None, value]
+        # A form shown again after errors has the submitted text or file
+        if isinstance(value, GEOSGeometry):
+            return [None, value.geojson]
+        if isinstance(value, str):
+            return [None, value]
+        return [None, None]
 
     def value_from_datadict(self, data, files, name):
-        print(data)
-        print(files)
-        print(name)
-        mp = MultiPolygon([
-            Polygon( ((0, 0), (0, 1), (1, 1), (0, 0)) ),
-            Polygon( ((1, 1), (1, 2), (2, 2), (1, 1)) ),
-        ])
-        return mp
+        upload, text = super().value_from_datadict(data, files, name)
+        return upload or text or None
 
 
 class ShapeInput(forms.TextInput):
@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
+import django
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# Serve the read-only views with the async views of apps/exevada/asyncviews.py
+if django.VERSION >= (3, 1):
+    os.environ.setdefault('EXEVADA_ASYNC', '1')
 
 application = get_asgi_application()
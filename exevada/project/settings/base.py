@@ -35,11 +35,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.exevada.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After the authentication middleware, which it needs for staff users
+    'apps.exevada.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -72,6 +75,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.contrib.gis.db.backends.spatialite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Seconds to keep connections open for the next requests of a
+        # worker (persistent connections); 0 closes them after every request
+        'CONN_MAX_AGE': int(os.environ.get('EXEVADA_CONN_MAX_AGE', 0)),
+        # Server side cursors do not work through a transaction pooling
+        # connection pooler like PgBouncer (PostgreSQL only)
+        'DISABLE_SERVER_SIDE_CURSORS': bool(os.environ.get('EXEVADA_PGBOUNCER')),
+    }
+}
+
+# Read replicas (see apps/exevada/routers.py): add them to DATABASES,
+# with 'TEST': {'MIRROR': 'default'}, and list their aliases here.
+# Requests read from the primary for EXEVADA_REPLICA_LAG seconds after
+# they wrote anything.
+DATABASE_ROUTERS = ['apps.exevada.routers.PrimaryReplicaRouter']
+EXEVADA_REPLICAS = []
+EXEVADA_REPLICA_LAG = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# The default local-memory cache is per process; use a shared backend
+# (file based, memcached or a redis backend) with several processes
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('EXEVADA_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('EXEVADA_CACHE_LOCATION', 'exevada'),
     }
 }
 
@@ -99,3 +130,53 @@ AUTH_PASSWORD_VALIDATORS = [
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Exevada
+
+# Cache used for the pages and API responses, and their timeout in seconds
+EXEVADA_CACHE = 'default'
+EXEVADA_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Global mean temperature difference between the present and past
+# climate, in degrees, for the GEV probability ratios
+EXEVADA_GEV_DELTA_T = 1.2
+
+# Cache directory for the region vector tiles
+EXEVADA_TILE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'tiles')
+
+# Change feed for mirrors (see apps/exevada/changes.py): a sweep of the
+# feed covers the changes up to this many seconds before it starts, so
+# that transactions committing late are not skipped. It should exceed
+# the longest write transaction.
+EXEVADA_CHANGES_SETTLE = 60
+
+# Background jobs (see apps/exevada/jobs.py), run by `manage.py
+# run_workers`: the delay before the first retry of a failed job, and
+# the time after which the jobs of an unresponsive worker are queued
+# again, in seconds. Eager jobs run right away, without workers.
+EXEVADA_JOBS_EAGER = bool(os.environ.get('EXEVADA_JOBS_EAGER'))
+EXEVADA_JOBS_RETRY_DELAY = 30
+EXEVADA_JOBS_TIMEOUT = 600
+# Delay of the refresh of statistics distributions after a change, in
+# seconds; changes to a group within it share a refresh
+EXEVADA_STATISTICS_DELAY = 10
+
+# Async read views (see apps/exevada/asyncviews.py), for ASGI servers
+# with Django 3.1 or later; project.asgi enables them. The database
+# pool should not be larger than the number of connections the server
+# may open per process.
+EXEVADA_ASYNC = bool(os.environ.get('EXEVADA_ASYNC'))
+EXEVADA_ASYNC_DB_THREADS = int(os.environ.get('EXEVADA_ASYNC_DB_THREADS', 8))
+EXEVADA_ASYNC_GEOMETRY_THREADS = int(os.environ.get('EXEVADA_ASYNC_GEOMETRY_THREADS', 4))
+
+# Request profiling (see apps/exevada/profiling.py): off unless
+# EXEVADA_PROFILE is set. Requests are profiled when they carry an
+# X-Exevada-Profile header and come from a staff user or have the token
+# as its value, or at random with the sample rate (a fraction)
+EXEVADA_PROFILE = bool(os.environ.get('EXEVADA_PROFILE'))
+EXEVADA_PROFILE_TOKEN = os.environ.get('EXEVADA_PROFILE_TOKEN', '')
+EXEVADA_PROFILE_SAMPLE_RATE = float(os.environ.get('EXEVADA_PROFILE_SAMPLE_RATE', 0))
+# Stack sampling interval in seconds, and the number of profiles kept
+EXEVADA_PROFILE_INTERVAL = 0.005
+EXEVADA_PROFILE_HISTORY = 1000
@@ -19,3 +19,7 @@ USE_I18N = True
 USE_L10N = True
 
 USE_TZ = True
+
+
+# Run background jobs right away during development, without workers
+EXEVADA_JOBS_EAGER = DEBUG